@@ -1,14 +1,19 @@
+-- Snapshot of the schema after every migration in scheduler/db/Migrations.py.
+-- Prefer running `python -m db.Migrations migrate` from the scheduler directory,
+-- which also upgrades databases created from older versions of this file.
+
 CREATE TABLE Caregivers (
     Username varchar(255),
     Salt BINARY(16),
-    Hash BINARY(16),
+    Hash VARBINARY(64),
+    Kdf varchar(64),
     PRIMARY KEY (Username)
 );
 
 CREATE TABLE Availabilities (
     Time date,
-    Adminstrator varchar(255) REFERENCES Caregivers(Username) NOT NULL,
-    PRIMARY KEY (Time, Administrator)
+    Username varchar(255) REFERENCES Caregivers(Username) NOT NULL,
+    PRIMARY KEY (Time, Username)
 );
 
 CREATE TABLE Vaccines (
@@ -17,10 +22,11 @@ CREATE TABLE Vaccines (
     PRIMARY KEY (Name)
 );
 
-CREATE TABLE Patient (
+CREATE TABLE Patients (
     Username varchar(255),
     Salt BINARY(16),
-    Hash BINARY(16),
+    Hash VARBINARY(64),
+    Kdf varchar(64),
     PRIMARY KEY (Username)
 );
 
@@ -31,4 +37,45 @@ CREATE TABLE Appointments (
     pUsername varchar(255) REFERENCES Patients,
     Name varchar(255) REFERENCES Vaccines,
     PRIMARY KEY (apID)
-);
\ No newline at end of file
+);
+
+CREATE TABLE IdBlocks (
+    Name varchar(255),
+    NextValue int NOT NULL,
+    PRIMARY KEY (Name)
+);
+
+CREATE INDEX IX_Appointments_pUsername_apID ON Appointments (pUsername, apID) INCLUDE (Time, cUsername, Name);
+
+CREATE INDEX IX_Appointments_cUsername_apID ON Appointments (cUsername, apID) INCLUDE (Time, pUsername, Name);
+
+CREATE TABLE Waitlist (
+    WaitID int IDENTITY(1, 1),
+    pUsername varchar(255) REFERENCES Patients NOT NULL,
+    Time date NOT NULL,
+    Name varchar(255) REFERENCES Vaccines NOT NULL,
+    Priority int NOT NULL DEFAULT 0,
+    CreatedAt datetime2 NOT NULL DEFAULT SYSUTCDATETIME(),
+    PRIMARY KEY (WaitID),
+    UNIQUE (pUsername, Time, Name)
+);
+
+CREATE INDEX IX_Waitlist_Time_Priority ON Waitlist (Time, Priority DESC, WaitID) INCLUDE (pUsername, Name);
+
+CREATE INDEX IX_Waitlist_Name_Priority ON Waitlist (Name, Priority DESC, WaitID) INCLUDE (Time, pUsername);
+
+CREATE INDEX IX_Appointments_Time ON Appointments (Time) INCLUDE (cUsername, Name);
+
+CREATE TABLE SchemaVersion (
+    Version int PRIMARY KEY,
+    Name varchar(255) NOT NULL,
+    AppliedAt datetime2 NOT NULL DEFAULT SYSUTCDATETIME()
+);
+
+INSERT INTO SchemaVersion (Version, Name) VALUES
+    (1, 'reconcile base tables'),
+    (2, 'password hash parameters'),
+    (3, 'appointment ID blocks'),
+    (4, 'indexes for the command queries'),
+    (5, 'waitlist'),
+    (6, 'index for the utilization report');
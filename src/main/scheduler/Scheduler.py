@@ -1,21 +1,88 @@
-from model.Vaccine import Vaccine
-from model.Caregiver import Caregiver
-from model.Patient import Patient
-from util.Util import Util
-from db.ConnectionManager import ConnectionManager
-import pymssql
+from util import Metrics
+from db import Tracing
+import argparse
+import contextlib
+import contextvars
 import datetime
+import io
+import json
+import os
 import re
+import sys
+import threading
+import time
 
 
-'''
-objects to keep track of the currently logged-in user
-Note: it is always true that at most one of currentCaregiver and currentPatient is not null
-        since only one user can be logged-in at a time
-'''
-current_patient = None
+# The models, the database layer and the driver take a while to import, so they are loaded
+# on first use rather than before the banner; start_prewarm() loads them in the background.
+_models_loaded = False
+# prewarm() loads the models on its own thread, possibly while the first command does too
+_models_lock = threading.Lock()
 
-current_caregiver = None
+
+def load_models():
+    global _models_loaded, Vaccine, Caregiver, Patient, Appointment, ReservationError, NO_CAREGIVER, NO_DOSES, \
+        Waitlist, Allocation, AllocationRequest, Cancellation, Util, Dates, Manifest, Roster, Demand, caches, \
+        ConnectionManager, DatabaseError, AsyncDatabase
+    if _models_loaded:
+        return
+    with _models_lock:
+        if _models_loaded:
+            return
+        from model.Vaccine import Vaccine
+        from model.Caregiver import Caregiver
+        from model.Patient import Patient
+        from model.Appointment import Appointment, ReservationError, NO_CAREGIVER, NO_DOSES
+        from model.Waitlist import Waitlist
+        from model.Allocation import Allocation, AllocationRequest
+        from model.Cancellation import Cancellation
+        from util.Util import Util
+        from util.Dates import Dates
+        from util.Manifest import Manifest
+        from util.Roster import Roster
+        from util.Demand import Demand
+        from util.Cache import caches
+        from db.ConnectionManager import ConnectionManager
+        from db.Backend import DatabaseError
+        from db import AsyncDatabase
+        _models_loaded = True
+
+
+# Warm up while the banner is read: load the models, open PrewarmConnections pooled
+# connections (default 2, enough for a command's fan-out) and fetch the vaccine list, so the
+# first command runs as fast as later ones. Failures are left for that command to report.
+def prewarm():
+    try:
+        load_models()
+        ConnectionManager().get_pool().fill(int(os.getenv("PrewarmConnections", "2")))
+        AsyncDatabase.start()
+        Vaccine.get_all()
+    except Exception:
+        pass
+
+
+# Start prewarm() on a background thread unless Prewarm=off
+def start_prewarm():
+    if os.getenv("Prewarm", "on").lower() == "off":
+        return None
+    thread = threading.Thread(target=prewarm, name="prewarm", daemon=True)
+    thread.start()
+    return thread
+
+
+class Session:
+    '''
+    objects to keep track of the currently logged-in user
+    Note: it is always true that at most one of caregiver and patient is not null
+            since only one user can be logged-in at a time in a session
+    '''
+    def __init__(self):
+        self.patient = None
+        self.caregiver = None
+
+
+# the session commands act on; the CLI uses a single one, the server gives every client its own
+current_session = contextvars.ContextVar("current_session", default=Session())
 
 
 def create_patient(tokens):
@@ -28,21 +95,24 @@ def create_patient(tokens):
     username = tokens[1]
     password = tokens[2]
 
-    # check 2: check if the username has been taken already
-    if username_exists_patient(username):
+    # check 2: check if the username has been taken already. The password is hashed meanwhile,
+    # so the check's round trip hides behind the hash
+    kdf = Util.current_kdf()
+    checked = username_exists_patient(username, AsyncDatabase.run(Util.generate_salt_and_hash, password, kdf))
+    if checked is None:
+        return
+    taken, (salt, hash) = checked
+    if taken:
         print("Username taken, try again!")
         return
 
-    salt = Util.generate_salt()
-    hash = Util.generate_hash(password, salt)
-
     # create the patient
-    patient = Patient(username, salt=salt, hash=hash)
+    patient = Patient(username, salt=salt, hash=hash, kdf=kdf)
 
     # save to patient information to our database
     try:
         patient.save_to_db()
-    except pymssql.Error as e:
+    except DatabaseError as e:
         print("Failed to create user.")
         print("Db-Error:", e)
         quit()
@@ -53,27 +123,19 @@ def create_patient(tokens):
     print("Created user ",  username)
 
 
-def username_exists_patient(username):
-    cm = ConnectionManager()
-    conn = cm.create_connection()
-
-    select_username = "SELECT * FROM Patients WHERE Username = %s"
+# Check the username while `alongside` runs; returns (taken, result of alongside), or None
+# after reporting an error
+def username_exists_patient(username, alongside):
     try:
-        cursor = conn.cursor(as_dict=True)
-        cursor.execute(select_username, username)
-        #  returns false if the cursor is not before the first record or if there are no rows in the ResultSet.
-        for row in cursor:
-            return row['Username'] is not None
-    except pymssql.Error as e:
+        return AsyncDatabase.fan_out(Patient.exists_async(username), alongside)
+    except DatabaseError as e:
         print("Error occurred when checking username")
         print("Db-Error:", e)
         quit()
     except Exception as e:
         print("Error occurred when checking username")
         print("Error:", e)
-    finally:
-        cm.close_connection()
-    return False
+    return None
 
 
 def create_caregiver(tokens):
@@ -85,21 +147,24 @@ def create_caregiver(tokens):
 
     username = tokens[1]
     password = tokens[2]
-    # check 2: check if the username has been taken already
-    if username_exists_caregiver(username):
+    # check 2: check if the username has been taken already. The password is hashed meanwhile,
+    # so the check's round trip hides behind the hash
+    kdf = Util.current_kdf()
+    checked = username_exists_caregiver(username, AsyncDatabase.run(Util.generate_salt_and_hash, password, kdf))
+    if checked is None:
+        return
+    taken, (salt, hash) = checked
+    if taken:
         print("Username taken, try again!")
         return
 
-    salt = Util.generate_salt()
-    hash = Util.generate_hash(password, salt)
-
     # create the caregiver
-    caregiver = Caregiver(username, salt=salt, hash=hash)
+    caregiver = Caregiver(username, salt=salt, hash=hash, kdf=kdf)
 
     # save to caregiver information to our database
     try:
         caregiver.save_to_db()
-    except pymssql.Error as e:
+    except DatabaseError as e:
         print("Failed to create user.")
         print("Db-Error:", e)
         quit()
@@ -110,34 +175,115 @@ def create_caregiver(tokens):
     print("Created user ", username)
 
 
-def username_exists_caregiver(username):
-    cm = ConnectionManager()
-    conn = cm.create_connection()
-
-    select_username = "SELECT * FROM Caregivers WHERE Username = %s"
+# Check the username while `alongside` runs; returns (taken, result of alongside), or None
+# after reporting an error
+def username_exists_caregiver(username, alongside):
     try:
-        cursor = conn.cursor(as_dict=True)
-        cursor.execute(select_username, username)
-        #  returns false if the cursor is not before the first record or if there are no rows in the ResultSet.
-        for row in cursor:
-            return row['Username'] is not None
-    except pymssql.Error as e:
+        return AsyncDatabase.fan_out(Caregiver.exists_async(username), alongside)
+    except DatabaseError as e:
         print("Error occurred when checking username")
         print("Db-Error:", e)
         quit()
     except Exception as e:
         print("Error occurred when checking username")
         print("Error:", e)
-    finally:
-        cm.close_connection()
-    return False
+    return None
+
+
+def import_users(tokens):
+    #  import_users <patient|caregiver> <file>
+    #  the file is a username,password CSV; passwords are hashed on every core
+    session = current_session.get()
+    if session.caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
+    if len(tokens) != 3 or tokens[1].lower() not in ("patient", "caregiver"):
+        print("Please try again!")
+        return
+
+    model = Patient if tokens[1].lower() == "patient" else Caregiver
+    users = {}
+    errors = 0
+    try:
+        for line_no, username, password, error in Roster.read(tokens[2]):
+            if error is None and username in users:
+                error = "duplicate username in file"
+            if error is not None:
+                print(f"Line {line_no}: skipped ({error})")
+                errors += 1
+                continue
+            users[username] = password
+    except (OSError, ValueError) as e:
+        print("Could not read the user file!")
+        print("Error:", e)
+        return
+
+    if not users:
+        print("No users to import.")
+        return
+
+    # PBKDF2 is CPU bound, so spread the hashing across a process pool
+    usernames = list(users)
+    kdf = Util.current_kdf()
+    accounts = []
+    start_time = time.perf_counter()
+    report_every = max(1, len(usernames) // 10)
+    import concurrent.futures
+    with concurrent.futures.ProcessPoolExecutor() as executor:
+        hashes = executor.map(Util.generate_salt_and_hash, [users[username] for username in usernames],
+                              [kdf] * len(usernames),
+                              chunksize=max(1, len(usernames) // (4 * (os.cpu_count() or 1))))
+        for username, (salt, hash) in zip(usernames, hashes):
+            accounts.append(model(username, salt=salt, hash=hash, kdf=kdf))
+            if len(accounts) % report_every == 0 or len(accounts) == len(usernames):
+                elapsed = time.perf_counter() - start_time
+                print(f"Hashed {len(accounts)}/{len(usernames)} passwords ({len(accounts) / elapsed:.1f}/s)")
+
+    try:
+        inserted = model.save_all_to_db(accounts)
+    except DatabaseError as e:
+        print("Failed to import users.")
+        print("Db-Error:", e)
+        quit()
+    except Exception as e:
+        print("Failed to import users.")
+        print("Error:", e)
+        return
+
+    elapsed = time.perf_counter() - start_time
+    print(f"Imported {inserted} user(s), skipped {len(accounts) - inserted} taken username(s) and "
+          f"{errors} invalid line(s) in {elapsed:.1f}s ({len(accounts) / elapsed:.1f} users/s)")
+
+
+def calibrate_kdf(tokens):
+    #  calibrate_kdf <target_ms>
+    #  measure PBKDF2 on this host and suggest the KdfIterations setting for a target login cost
+    if len(tokens) != 2:
+        print("Please try again!")
+        return
+
+    try:
+        target_ms = float(tokens[1])
+        if target_ms <= 0:
+            raise ValueError("The target latency must be positive!")
+        algorithm, _, dklen = Util.parse_kdf(Util.current_kdf())
+        iterations = Util.calibrate_iterations(target_ms, algorithm, dklen)
+    except ValueError as e:
+        print("Please try again!")
+        print("Error:", e)
+        return
+
+    print("Current KDF:", Util.current_kdf())
+    print(f"{iterations} iterations take about {target_ms:g} ms on this host.")
+    print(f"Set KdfIterations={iterations} to use it; existing users are re-hashed at their next login.")
 
 
 def login_patient(tokens):
     # login_patient <username> <password>
     # check 1: if someone's already logged-in, they need to log out first
-    global current_patient
-    if current_patient is not None or current_caregiver is not None:
+    session = current_session.get()
+    if session.patient is not None or session.caregiver is not None:
         print("User already logged in.")
         return
 
@@ -152,7 +298,7 @@ def login_patient(tokens):
     patient = None
     try:
         patient = Patient(username, password=password).get()
-    except pymssql.Error as e:
+    except DatabaseError as e:
         print("Login failed.")
         print("Db-Error:", e)
         quit()
@@ -165,15 +311,15 @@ def login_patient(tokens):
         print("Login failed.")
         return
     else:
-        current_patient = patient
+        session.patient = patient
         print("Logged in as ", username)
 
 
 def login_caregiver(tokens):
     # login_caregiver <username> <password>
     # check 1: if someone's already logged-in, they need to log out first
-    global current_caregiver
-    if current_caregiver is not None or current_patient is not None:
+    session = current_session.get()
+    if session.caregiver is not None or session.patient is not None:
         print("User already logged in.")
         return
 
@@ -188,7 +334,7 @@ def login_caregiver(tokens):
     caregiver = None
     try:
         caregiver = Caregiver(username, password=password).get()
-    except pymssql.Error as e:
+    except DatabaseError as e:
         print("Login failed.")
         print("Db-Error:", e)
         quit()
@@ -202,13 +348,14 @@ def login_caregiver(tokens):
         print("Login failed.")
     else:
         print("Logged in as: " + username)
-        current_caregiver = caregiver
+        session.caregiver = caregiver
 
 
 def search_caregiver_schedule(tokens):
     #  search_caregiver_schedule <date>
     #  check 1: check if the current logged-in user is a patient or a caregiver
-    if current_caregiver is None and current_patient is None:
+    session = current_session.get()
+    if session.caregiver is None and session.patient is None:
         print("Please login first!")
         return
     
@@ -217,26 +364,18 @@ def search_caregiver_schedule(tokens):
         print("Please input the right arguments.")
         return
 
-    cm = ConnectionManager()
-    conn = cm.create_connection()
-    cursor = conn.cursor()
-
     date_tokens = tokens[1].split("-")
     month = int(date_tokens[0])
     day = int(date_tokens[1])
     year = int(date_tokens[2])
     d = datetime.datetime(year, month, day)
 
-    get_available_dates = "SELECT Time, Username FROM Availabilities WHERE Time = %s ORDER BY Username"
-    get_vaccines = "SELECT Name, Doses FROM Vaccines"
     try:
-        cursor.execute(get_available_dates, d)
-        caregiver_rows = cursor.fetchall()
-
-        cursor.execute(get_vaccines)
-        vaccine_rows = cursor.fetchall()
+        # the two reads are independent, so they run at the same time
+        caregiver_usernames, vaccine_rows = AsyncDatabase.fan_out(Caregiver.get_available_async(d),
+                                                                  Vaccine.get_all_async())
 
-        if not caregiver_rows: # no caregivers available
+        if not caregiver_usernames: # no caregivers available
             print("There are no appointments available on", tokens[1])
             return
         
@@ -245,16 +384,15 @@ def search_caregiver_schedule(tokens):
             print("Not enough available doses!")
             return
 
-        print("There is", len(caregiver_rows), "caregiver(s) available on", tokens[1], ":")
-        for row in caregiver_rows:
-            print("Caregiver:", row[1])
+        print("There is", len(caregiver_usernames), "caregiver(s) available on", tokens[1], ":")
+        for username in caregiver_usernames:
+            print("Caregiver:", username)
         
         print("There is",len(vaccine_rows), "vaccine(s) available:")
         for row in vaccine_rows:
             print("Vaccine:", row[0])
             print("Doses Left:", row[1])
-        conn.commit()
-    except pymssql.Error as e: # error handling for database errors
+    except DatabaseError as e: # error handling for database errors
         print("Please try again!")
         print("Db-Error:", e)
         quit()
@@ -266,19 +404,92 @@ def search_caregiver_schedule(tokens):
         print("Please try again!")
         print("Error:", e)
         return
-    finally:
-        cm.close_connection()
+
+
+def search_caregiver_schedule_range(tokens):
+    #  search_caregiver_schedule_range <start_date> <end_date>
+    session = current_session.get()
+    if session.caregiver is None and session.patient is None:
+        print("Please login first!")
+        return
+
+    if len(tokens) != 3:
+        print("Please input the right arguments.")
+        return
+
+    try:
+        start = Dates.parse_date(tokens[1])
+        end = Dates.parse_date(tokens[2])
+        if end < start:
+            raise ValueError("The end date must not be before the start date!")
+        summary = Caregiver.get_availability_summary(start, end)
+    except DatabaseError as e:
+        print("Please try again!")
+        print("Db-Error:", e)
+        quit()
+    except Exception as e:
+        print("Please try again!")
+        print("Error:", e)
+        return
+
+    if not summary:
+        print("There are no appointments available between", tokens[1], "and", tokens[2])
+        return
+
+    for day, caregivers, usable_doses in summary:
+        doses = ", ".join(f"{name}: {usable}" for name, usable in usable_doses.items()) or "no doses"
+        print(f"{day:%m-%d-%Y}: {caregivers} caregiver(s) available, usable doses: {doses}")
+
+
+def next_available(tokens):
+    #  next_available <vaccine>
+    session = current_session.get()
+    if session.caregiver is None and session.patient is None:
+        print("Please login first!")
+        return
+
+    if len(tokens) != 2:
+        print("Please input the right arguments.")
+        return
+
+    vaccine_name = tokens[1]
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    try:
+        slot = Caregiver.find_next_available(vaccine_name, today)
+        # the vaccine is only needed to explain a miss
+        vaccine = Vaccine(vaccine_name, 0).get() if slot is None else None
+    except DatabaseError as e:
+        print("Please try again!")
+        print("Db-Error:", e)
+        quit()
+    except Exception as e:
+        print("Please try again!")
+        print("Error:", e)
+        return
+
+    if slot is None:
+        if vaccine is None:
+            print("This facility does not carry that brand of vaccines. Please try again!")
+        elif vaccine.available_doses <= 0:
+            print("Not enough available doses!")
+        else:
+            print("No Caregiver is available!")
+        return
+
+    day, caregivers, doses = slot
+    print(f"The earliest available date for {vaccine_name} is {day:%m-%d-%Y}: "
+          f"{caregivers} caregiver(s) available, {doses} dose(s) left")
 
 
 def reserve(tokens):
     #  reserve <date> <vaccine>
     #  check 1: check if the current logged-in user is a patient
-    global current_patient
-    if current_caregiver is None and current_patient is None:
+    session = current_session.get()
+    if session.caregiver is None and session.patient is None:
         print("Please login first!")
         return
     
-    if current_patient is None:
+    if session.patient is None:
         print("Please login as a patient first!")
         return
 
@@ -286,10 +497,6 @@ def reserve(tokens):
     if len(tokens) != 3:
         print("Please try again!")
         return
-    
-    cm = ConnectionManager()
-    conn = cm.create_connection()
-    cursor = conn.cursor()
 
     date = tokens[1]
     date_tokens = date.split("-")
@@ -298,126 +505,134 @@ def reserve(tokens):
     year = int(date_tokens[2])
 
     vaccine_name = tokens[2]
-    
-     # check for caregiver availability
-    d = datetime.datetime(year, month, day)
-    available_caregiver = get_available_caregiver(d)
-    if available_caregiver == None:
-        return
-    # check for vaccine availability
-    get_vaccine = "SELECT Name, Doses FROM Vaccines WHERE Name = %s"
-        
+
+    # caregiver selection, dose check, appointment ID, appointment insert and dose decrement
+    # all happen in one transaction, so concurrent reservations cannot double-book
     try:
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor()
-        cursor.execute(get_vaccine, (vaccine_name))
-        doses = cursor.fetchone()
-        
-    except pymssql.Error as e:
-        print("pymssql error")
+        d = datetime.datetime(year, month, day)
+        appointment = AsyncDatabase.wait(Appointment(d, session.patient.username, vaccine_name).reserve_async())
+    except DatabaseError as e:
+        print("Error occurred when making reservation")
         print("Db-Error:", e)
         quit()
-    
+    except ReservationError as e:
+        print(e)
+        # rather than have the patient retry, book them once capacity frees up
+        if e.status in (NO_CAREGIVER, NO_DOSES):
+            join_waitlist(d, session.patient.username, vaccine_name)
+        return
+    except ValueError as e:
+        print(e)
+        return
     except Exception as e:
         print("Error occurred when making reservation")
         print("Error:", e)
         return
-    if doses == None:
-        print("This facility does not carry that brand of vaccines. Please try again!")
-        return
-    elif doses[1] == 0:
-        print("Not enough available doses!")
-        return
-
-    # get appointment ID
-    apID = get_apID()     
 
-    print(f"Appointment ID: {apID}, Caregiver username: {available_caregiver}")
+    print(f"Appointment ID: {appointment.apID}, Caregiver username: {appointment.caregiver_username}")
 
-    # update caregiver availability
-
-    # update appointments
-    add_appointment = "INSERT INTO Appointments VALUES (%s, %s, %s, %s, %s)"
 
+def join_waitlist(d, patient_username, vaccine_name):
+    if d.date() < datetime.date.today():
+        return
     try:
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor()
-        cursor.execute(add_appointment, (apID, available_caregiver, current_patient.username, d, vaccine_name))
-        conn.commit()
-    except pymssql.Error:
-        raise
-    finally:
-        cm.close_connection()
+        ahead = Waitlist.add(d, patient_username, vaccine_name)
+    except DatabaseError as e:
+        print("Error occurred when joining the waitlist")
+        print("Db-Error:", e)
+        quit()
+    except Exception as e:
+        print("Error occurred when joining the waitlist")
+        print("Error:", e)
+        return
+    if ahead is not None:
+        print(f"You are on the waitlist for {d:%m-%d-%Y} with {ahead} patient(s) ahead of you; "
+              "the appointment will be booked automatically once capacity frees up.")
 
-    # update vaccines
 
-    # create the vaccine
-    named_vaccine = Vaccine(vaccine_name, 0)
-    
+# Book waitlisted patients into capacity that was just freed on the given dates or for the
+# given vaccine, and report how many were booked. Whoever freed the capacity only sees the
+# count; the patients find their appointments with show_appointments.
+def fulfil_waitlist(dates=(), vaccine_name=None):
+    booked = []
     try:
-        named_vaccine.get()
-        named_vaccine.available_doses
-        named_vaccine.decrease_available_doses(1)
-    except pymssql.Error as e:
+        if vaccine_name is not None:
+            booked += Waitlist.fulfil(vaccine_name=vaccine_name)
+        if dates:
+            # one seek finds the dates anyone waits for, instead of a query per date
+            waiting = Waitlist.waiting_dates(min(dates), max(dates))
+            for d in sorted(waiting.intersection(dates)):
+                booked += Waitlist.fulfil(d)
+    except DatabaseError as e:
+        print("Error occurred when processing the waitlist")
         print("Db-Error:", e)
         quit()
     except Exception as e:
-        print("Error occurred when decreasing doses")
+        print("Error occurred when processing the waitlist")
         print("Error:", e)
-        return
-
-    pass
+    if booked:
+        print(f"Waitlist: booked {len(booked)} waiting patient(s).")
 
 
-def get_available_caregiver(d):
+def show_waitlist(tokens):
+    #  show_waitlist
+    session = current_session.get()
+    if session.patient is None:
+        print("Please login as a patient first!")
+        return
 
-    cm = ConnectionManager()
-    conn = cm.create_connection()
-    cursor = conn.cursor()
-    
-    # find available caregivers
-    available_caregiver = "SELECT Username FROM Availabilities WHERE Time = (%s) ORDER BY Username"
+    if len(tokens) != 1:
+        print("Please try again!")
+        return
 
     try:
-        cursor.execute(available_caregiver, (d))
-        caregiver_username = cursor.fetchone()
-    except pymssql.Error:
-        raise    
-    finally:
-        cm.close_connection()
-    if caregiver_username == None:
-        print("No Caregiver is available!")
+        entries = Waitlist.find_for_patient(session.patient.username)
+    except DatabaseError as e:
+        print("Error occurred when showing the waitlist")
+        print("Db-Error:", e)
+        quit()
+    except Exception as e:
+        print("Error occurred when showing the waitlist")
+        print("Error:", e)
         return
-    else:
-        return caregiver_username[0]
+    if not entries:
+        print("You are not on the waitlist.")
+    for entry in entries:
+        print(f"{entry.time:%m-%d-%Y} {entry.vaccine_name}")
 
 
-def get_apID():
+def leave_waitlist(tokens):
+    #  leave_waitlist <date> <vaccine>
+    session = current_session.get()
+    if session.patient is None:
+        print("Please login as a patient first!")
+        return
+
+    if len(tokens) != 3:
+        print("Please try again!")
+        return
 
-    get_last_apID = "SELECT MAX(apID) FROM Appointments"
     try:
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor()
-        cursor.execute(get_last_apID)
-        last_apID = cursor.fetchone()[0]
-        if last_apID == None:
-            apID = 1    
-        else: 
-            apID = last_apID + 1
-    except pymssql.Error:
-        raise    
-    finally:
-        cm.close_connection()
-    return apID
+        d = Dates.parse_date(tokens[1])
+        removed = Waitlist.remove(d, session.patient.username, tokens[2])
+    except DatabaseError as e:
+        print("Error occurred when leaving the waitlist")
+        print("Db-Error:", e)
+        quit()
+    except ValueError:
+        print("Please enter a valid date!")
+        return
+    except Exception as e:
+        print("Error occurred when leaving the waitlist")
+        print("Error:", e)
+        return
+    print("Left the waitlist." if removed else "You are not on the waitlist for that date and vaccine.")
 
 
 def upload_availability(tokens):
 
-    global current_caregiver
-    if current_caregiver is None:
+    session = current_session.get()
+    if session.caregiver is None:
         print("Please login as a caregiver first!")
         return
 
@@ -433,8 +648,8 @@ def upload_availability(tokens):
     year = int(date_tokens[2])
     try:
         d = datetime.datetime(year, month, day)
-        current_caregiver.upload_availability(d)
-    except pymssql.Error as e:
+        session.caregiver.upload_availability(d)
+    except DatabaseError as e:
         print("Upload Availability Failed")
         print("Db-Error:", e)
         quit()
@@ -446,48 +661,206 @@ def upload_availability(tokens):
         print("Error:", e)
         return
     print("Availability uploaded!")
+    fulfil_waitlist(dates=[d])
+
+
+def upload_availability_range(tokens):
+    #  upload_availability_range <start_date> <end_date> [<pattern>]
+    #  pattern: daily (default), weekdays, weekends, mon,wed,fri or everyN
+    session = current_session.get()
+    if session.caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
+    if len(tokens) not in (3, 4):
+        print("Please try again!")
+        return
+
+    pattern = tokens[3] if len(tokens) == 4 else "daily"
+    try:
+        start = Dates.parse_date(tokens[1])
+        end = Dates.parse_date(tokens[2])
+        dates = Dates.expand_range(start, end, pattern)
+    except ValueError as e:
+        print("Please enter a valid date range!")
+        print("Error:", e)
+        return
+    upload_availabilities(dates)
+
+
+def upload_availability_file(tokens):
+    #  upload_availability_file <path>
+    #  the file holds one mm-dd-yyyy date per line
+    session = current_session.get()
+    if session.caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
+    if len(tokens) != 2:
+        print("Please try again!")
+        return
+
+    try:
+        dates = Dates.read_dates(tokens[1])
+    except OSError as e:
+        print("Could not read the availability file!")
+        print("Error:", e)
+        return
+    except ValueError as e:
+        print("Please enter valid dates!")
+        print("Error:", e)
+        return
+    upload_availabilities(dates)
+
+
+def upload_availabilities(dates):
+    session = current_session.get()
+    try:
+        inserted, skipped = session.caregiver.upload_availabilities(dates)
+    except DatabaseError as e:
+        print("Upload Availability Failed")
+        print("Db-Error:", e)
+        quit()
+    except Exception as e:
+        print("Error occurred when uploading availability")
+        print("Error:", e)
+        return
+    print("Availability uploaded!", inserted, "date(s) inserted,", skipped, "duplicate(s) skipped.")
+    if inserted:
+        fulfil_waitlist(dates=dates)
 
 
 def cancel(tokens):
     """
     Extra Credit
     """
-    #  cancel <appointment_id>
-    global current_caregiver
-    global current_patient
+    #  cancel <appointment_id> [<appointment_id> ...]
+    #  patients and caregivers can only cancel their own appointments
+    session = current_session.get()
     
-    if current_patient is None and current_caregiver is None:
+    if session.patient is None and session.caregiver is None:
         print("Please log in!")
         return
 
-    # check 2: the length for tokens need to be exactly 2 
-    if len(tokens) != 2:
+    # check 2: at least one appointment ID
+    if len(tokens) < 2:
         print("Please try again!")
         return 
-    
-    cm = ConnectionManager()
-    conn = cm.create_connection()
-    cursor = conn.cursor(as_dict=True)
 
-    delete = "DELETE FROM Appointments WHERE apID = %s"
+    try:
+        apIDs = [int(token) for token in tokens[1:]]
+    except ValueError:
+        print("Please try again!")
+        return
+    if session.patient is not None:
+        cancellation = Cancellation(apIDs=apIDs, patient_username=session.patient.username)
+    else:
+        cancellation = Cancellation(apIDs=apIDs, caregiver_username=session.caregiver.username)
+    if run_cancellation(cancellation) is None:
+        return
+    for appointment in cancellation.cancelled:
+        print("Appointment", appointment.apID, "has been cancelled.")
+    for apID in cancellation.missing():
+        print("Appointment", apID, "was not found.")
+    fulfil_cancelled(cancellation)
+
+
+def cancel_day(tokens):
+    #  cancel_day <date> [withdraw]
+    #  cancels the logged-in caregiver's appointments on one date, e.g. when they call in sick;
+    #  withdraw takes the freed slots out of the schedule instead of reinstating them
+    session = current_session.get()
+    if session.caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
+    withdraw = tokens[-1] == "withdraw"
+    arguments = tokens[1:-1] if withdraw else tokens[1:]
+    if len(arguments) != 1:
+        print("Please try again!")
+        return
 
     try:
-        apID = tokens[1]
+        d = Dates.parse_date(arguments[0])
+    except ValueError as e:
+        print("Please try again!")
+        print("Error:", e)
+        return
+    cancellation = run_cancellation(Cancellation(caregiver_username=session.caregiver.username, start=d, end=d,
+                                                 reinstate=not withdraw))
+    if cancellation is not None:
+        report_cancellation(cancellation)
+        fulfil_cancelled(cancellation)
+
+
+def cancel_range(tokens):
+    #  cancel_range <start_date> <end_date> [withdraw]
+    #  cancels the logged-in caregiver's appointments in the range, e.g. over a leave
+    session = current_session.get()
+    if session.caregiver is None:
+        print("Please login as a caregiver first!")
+        return
 
-        cursor.execute(delete, apID)
+    withdraw = tokens[-1] == "withdraw"
+    arguments = tokens[1:-1] if withdraw else tokens[1:]
+    if len(arguments) != 2:
+        print("Please try again!")
+        return
 
-        conn.commit()
-    except:
+    try:
+        start = Dates.parse_date(arguments[0])
+        end = Dates.parse_date(arguments[1])
+        if end < start:
+            raise ValueError("The end date must not be before the start date!")
+    except ValueError as e:
         print("Please try again!")
+        print("Error:", e)
         return
-    print("Appointment", apID, "has been cancelled.")
+    cancellation = run_cancellation(Cancellation(caregiver_username=session.caregiver.username, start=start,
+                                                 end=end, reinstate=not withdraw))
+    if cancellation is not None:
+        report_cancellation(cancellation)
+        fulfil_cancelled(cancellation)
+
+
+# Run a cancellation; returns it, or None when it failed
+def run_cancellation(cancellation):
+    try:
+        cancellation.run()
+    except DatabaseError as e:
+        print("Error occurred when cancelling appointments")
+        print("Db-Error:", e)
+        quit()
+    except Exception as e:
+        print("Error occurred when cancelling appointments")
+        print("Error:", e)
+        return None
+    return cancellation
+
+
+# Book waitlisted patients into the capacity a cancellation freed
+def fulfil_cancelled(cancellation):
+    # slots only help waiting patients when they were reinstated; doses always come back
+    fulfil_waitlist(dates=cancellation.dates() if cancellation.reinstate else ())
+    for vaccine_name in sorted(cancellation.restored_doses):
+        fulfil_waitlist(vaccine_name=vaccine_name)
+
+
+def report_cancellation(cancellation):
+    if not cancellation.cancelled:
+        print("No appointments to cancel.")
+        return
+    doses = ", ".join(f"{name}: {count}" for name, count in sorted(cancellation.restored_doses.items()))
+    slots = f"{cancellation.reinstated} slot(s) reinstated" if cancellation.reinstate else "slots withdrawn"
+    print(f"Cancelled {len(cancellation.cancelled)} appointment(s) on {len(cancellation.dates())} date(s); "
+          f"doses restored: {doses}; {slots}.")
 
 
 def add_doses(tokens):
     #  add_doses <vaccine> <number>
     #  check 1: check if the current logged-in user is a caregiver
-    global current_caregiver
-    if current_caregiver is None:
+    session = current_session.get()
+    if session.caregiver is None:
         print("Please login as a caregiver first!")
         return
 
@@ -498,10 +871,11 @@ def add_doses(tokens):
 
     vaccine_name = tokens[1]
     doses = int(tokens[2])
-    vaccine = None
+    # one upsert adds the doses, or the vaccine when it is not in the database yet, so
+    # concurrent additions all count, including the first ones for a new vaccine
     try:
-        vaccine = Vaccine(vaccine_name, doses).get()
-    except pymssql.Error as e:
+        Vaccine.add_doses_in_bulk({vaccine_name: doses})
+    except DatabaseError as e:
         print("Error occurred when adding doses")
         print("Db-Error:", e)
         quit()
@@ -509,66 +883,153 @@ def add_doses(tokens):
         print("Error occurred when adding doses")
         print("Error:", e)
         return
-
-    # if the vaccine is not found in the database, add a new (vaccine, doses) entry.
-    # else, update the existing entry by adding the new doses
-    if vaccine is None:
-        vaccine = Vaccine(vaccine_name, doses)
-        try:
-            vaccine.save_to_db()
-        except pymssql.Error as e:
-            print("Error occurred when adding doses")
-            print("Db-Error:", e)
-            quit()
-        except Exception as e:
-            print("Error occurred when adding doses")
-            print("Error:", e)
-            return
-    else:
-        # if the vaccine is not null, meaning that the vaccine already exists in our table
-        try:
-            vaccine.increase_available_doses(doses)
-        except pymssql.Error as e:
-            print("Error occurred when adding doses")
-            print("Db-Error:", e)
-            quit()
-        except Exception as e:
-            print("Error occurred when adding doses")
-            print("Error:", e)
-            return
     print("Doses updated!")
+    fulfil_waitlist(vaccine_name=vaccine_name)
 
 
-def show_appointments(tokens):
-    # show_appointments
-    global current_caregiver
-    global current_patient
-    if current_caregiver is None and current_patient is None:
-        print("Please login first!")
+def import_inventory(tokens):
+    #  import_inventory <file>
+    #  the file is a CSV (name,doses), JSON array or JSON lines shipment manifest
+    session = current_session.get()
+    if session.caregiver is None:
+        print("Please login as a caregiver first!")
         return
 
-    cm = ConnectionManager()
-    conn = cm.create_connection()
-    cursor = conn.cursor(as_dict=True)
+    if len(tokens) != 2:
+        print("Please try again!")
+        return
+
+    # validate every line first, then apply the valid ones in a single transaction
+    accepted = []
+    deltas = {}
+    errors = 0
+    try:
+        for line_no, vaccine_name, doses, error in Manifest.read(tokens[1]):
+            if error is not None:
+                print(f"Line {line_no}: skipped ({error})")
+                errors += 1
+                continue
+            accepted.append((line_no, vaccine_name, doses))
+            deltas[vaccine_name] = deltas.get(vaccine_name, 0) + doses
+    except (OSError, ValueError) as e:
+        print("Could not read the manifest!")
+        print("Error:", e)
+        return
 
-    get_patient_appointment = "SELECT apID, Time, cUsername, pUsername, Name FROM Appointments WHERE pUsername = %s  ORDER BY apID"
-    get_caregiver_appointment = "SELECT apID, Time, cUsername, pUsername, Name FROM Appointments WHERE cUsername = %s  ORDER BY apID"
+    if not deltas:
+        print("No doses to import.")
+        return
 
     try:
-        if current_patient is not None: # if the current user is a patient
-            cursor.execute(get_patient_appointment, current_patient.username)
-            appointment_rows = cursor.fetchall()
-            for i in range(0, len(appointment_rows)):
-                print(f"Appointment ID: {appointment_rows[i]['apID']}, Vaccine name: {appointment_rows[i]['Name']}," +
-                f" Appointment Time: {appointment_rows[i]['Time']}, Caregiver Username: {appointment_rows[i]['cUsername']}")
-        
-        if current_caregiver is not None: # if the current user is a caregiver
-            cursor.execute(get_caregiver_appointment, current_caregiver.username)
-            appointment_rows = cursor.fetchall()
-            for i in range(0, len(appointment_rows)):
-                print(f"Appointment ID: {appointment_rows[i]['apID']}, Vaccine name: {appointment_rows[i]['Name']}," +
-                f" Appointment Time: {appointment_rows[i]['Time']}, Patient Username: {appointment_rows[i]['pUsername']}")
-    except pymssql.Error as e:
+        results = Vaccine.add_doses_in_bulk(deltas)
+    except DatabaseError as e:
+        print("Error occurred when importing inventory")
+        print("Db-Error:", e)
+        quit()
+    except Exception as e:
+        print("Error occurred when importing inventory")
+        print("Error:", e)
+        return
+
+    for line_no, vaccine_name, doses in accepted:
+        action, total = results[vaccine_name]
+        print(f"Line {line_no}: {vaccine_name} +{doses} ({action}, {total} doses after import)")
+    print("Inventory imported!", len(accepted), "line(s) applied to", len(results), "vaccine(s),",
+          errors, "line(s) skipped.")
+    for vaccine_name in sorted(results):
+        fulfil_waitlist(vaccine_name=vaccine_name)
+
+
+def allocate(tokens):
+    #  allocate <file>
+    #  the file lists patient requests for a clinic event: patient, vaccine and preferred dates
+    session = current_session.get()
+    if session.caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
+    if len(tokens) != 2:
+        print("Please try again!")
+        return
+
+    requests = []
+    errors = 0
+    try:
+        for line_no, patient_username, vaccine_name, dates, error in Demand.read(tokens[1]):
+            if error is not None:
+                print(f"Line {line_no}: skipped ({error})")
+                errors += 1
+                continue
+            requests.append(AllocationRequest(line_no, patient_username, vaccine_name, dates))
+    except (OSError, ValueError) as e:
+        print("Could not read the request file!")
+        print("Error:", e)
+        return
+
+    if not requests:
+        print("No requests to allocate.")
+        return
+
+    try:
+        allocation = Allocation(requests).run()
+    except DatabaseError as e:
+        print("Error occurred when allocating appointments")
+        print("Db-Error:", e)
+        quit()
+    except Exception as e:
+        print("Error occurred when allocating appointments")
+        print("Error:", e)
+        return
+
+    first_choice = 0
+    for request in allocation.allocated():
+        rank = request.preference_rank()
+        first_choice += rank == 0
+        print(f"Line {request.line_no}: {request.patient_username} Appointment ID: {request.apID}, "
+              f"{request.time:%m-%d-%Y} (choice {rank + 1}), Caregiver username: {request.caregiver_username}")
+    unmet = {}
+    for request in allocation.unmet():
+        print(f"Line {request.line_no}: {request.patient_username} not allocated ({request.reason})")
+        unmet[request.reason] = unmet.get(request.reason, 0) + 1
+    print("Allocation finished!", len(allocation.allocated()), "of", len(requests), "request(s) allocated,",
+          first_choice, "on the first choice,", errors, "line(s) skipped.")
+    for reason, count in sorted(unmet.items()):
+        print(f"Unmet: {count} ({reason})")
+
+
+def show_appointments(tokens):
+    # show_appointments [from <date>] [to <date>] [vaccine <name>]
+    session = current_session.get()
+    if session.caregiver is None and session.patient is None:
+        print("Please login first!")
+        return
+
+    try:
+        # filters come in keyword/value pairs
+        if len(tokens) % 2 != 1:
+            raise ValueError("Filters must be given as from <date>, to <date> or vaccine <name>")
+        filters = {}
+        for keyword, value in zip(tokens[1::2], tokens[2::2]):
+            if keyword == "from":
+                filters["start"] = Dates.parse_date(value)
+            elif keyword == "to":
+                filters["end"] = Dates.parse_date(value)
+            elif keyword == "vaccine":
+                filters["vaccine_name"] = value
+            else:
+                raise ValueError("Unknown filter " + keyword)
+
+        # rows are printed page by page as they arrive instead of being collected first
+        if session.patient is not None: # if the current user is a patient
+            for appointment in Appointment.find_for_user("patient", session.patient.username, **filters):
+                print(f"Appointment ID: {appointment.apID}, Vaccine name: {appointment.vaccine_name}," +
+                f" Appointment Time: {appointment.time}, Caregiver Username: {appointment.caregiver_username}")
+
+        if session.caregiver is not None: # if the current user is a caregiver
+            for appointment in Appointment.find_for_user("caregiver", session.caregiver.username, **filters):
+                print(f"Appointment ID: {appointment.apID}, Vaccine name: {appointment.vaccine_name}," +
+                f" Appointment Time: {appointment.time}, Patient Username: {appointment.patient_username}")
+    except DatabaseError as e:
         print("Upload Availability Failed")
         print("Db-Error:", e)
         quit()
@@ -579,47 +1040,238 @@ def show_appointments(tokens):
         print("Error occurred when uploading availability")
         print("Error:", e)
         return
-    finally:
-        cm.close_connection()
+
+
+def cache_stats(tokens):
+    #  cache_stats
+    for name in sorted(caches):
+        stats = caches[name].stats()
+        print(f"Cache {name}: {stats['hits']} hit(s), {stats['misses']} miss(es), "
+              f"{stats['hit_ratio']:.1%} hit ratio, {stats['size']} entries, {stats['evictions']} eviction(s)")
+
+
+def stats(tokens):
+    #  stats [json|prometheus]
+    if len(tokens) > 2 or (len(tokens) == 2 and tokens[1] not in ("json", "prometheus")):
+        print("Please try again!")
+        return
+    if len(tokens) == 2:
+        print(json.dumps(Metrics.registry.to_json(), indent=2) if tokens[1] == "json"
+              else Metrics.registry.to_prometheus(), end="")
+        return
+
+    registry = Metrics.registry
+    for operation, histogram in sorted(registry.histograms_named("scheduler_command_seconds").items()):
+        failures = registry.counter("scheduler_command_failures_total", operation)
+        print(f"Command {operation}: {histogram.count} call(s), {failures} failure(s), "
+              f"mean {histogram.sum / histogram.count * 1000:.1f} ms, "
+              f"p50 <= {histogram.quantile(0.5) * 1000:g} ms, p99 <= {histogram.quantile(0.99) * 1000:g} ms")
+    # the statements that took the most time in total first
+    statements = registry.histograms_named("scheduler_statement_seconds")
+    for label, histogram in sorted(statements.items(), key=lambda item: -item[1].sum)[:10]:
+        errors = registry.counter("scheduler_statement_errors_total", label)
+        print(f"Statement {label}: {histogram.count} call(s), {errors} error(s), "
+              f"total {histogram.sum * 1000:.1f} ms, p99 <= {histogram.quantile(0.99) * 1000:g} ms")
+    print(f"Connections: {registry.counter('scheduler_connections_opened_total')} opened, "
+          f"{registry.counter('scheduler_connections_acquired_total')} acquired, "
+          f"{registry.counter('scheduler_connections_discarded_total')} discarded, "
+          f"{registry.counter('scheduler_connection_errors_total')} failed; "
+          f"{registry.counter('scheduler_rows_fetched_total')} row(s) fetched")
+
+
+def report(tokens):
+    #  report [<start_date> <end_date>] [json]
+    #  utilization per day and caregiver and when each vaccine runs out; the two weeks either
+    #  side of today by default
+    session = current_session.get()
+    if session.caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
+    as_json = tokens[-1] == "json"
+    arguments = tokens[1:-1] if as_json else tokens[1:]
+    if len(arguments) not in (0, 2):
+        print("Please try again!")
+        return
+
+    # imported here, it loads numpy when that is installed
+    from model.Utilization import UtilizationReport
+    try:
+        if arguments:
+            start, end = Dates.parse_date(arguments[0]), Dates.parse_date(arguments[1])
+        else:
+            today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+            start, end = today - datetime.timedelta(days=14), today + datetime.timedelta(days=14)
+        summary = UtilizationReport(start, end).run().to_json()
+    except DatabaseError as e:
+        print("Error occurred when building the report")
+        print("Db-Error:", e)
+        quit()
+    except Exception as e:
+        print("Please try again!")
+        print("Error:", e)
+        return
+
+    if as_json:
+        print(json.dumps(summary, indent=2))
+        return
+    for day in summary["days"]:
+        if day["booked"] or day["free"]:
+            print(f"{day['date']}: {day['booked']} booked, {day['free']} free, "
+                  f"{day['utilization']:.0%} utilized")
+    for caregiver in summary["caregivers"]:
+        print(f"Caregiver {caregiver['username']}: {caregiver['booked']} booked, {caregiver['free']} free, "
+              f"{caregiver['utilization']:.0%} utilized")
+    for vaccine in summary["vaccines"]:
+        if vaccine["runs_out"] is not None:
+            runs_out = f"runs out {vaccine['runs_out']}"
+        elif vaccine["burn_per_day"] > 0:
+            runs_out = "lasts over ten years"
+        else:
+            runs_out = "not in demand"
+        print(f"Vaccine {vaccine['name']}: {vaccine['doses']} dose(s), "
+              f"{vaccine['burn_per_day']:.2f} per day, {runs_out}")
 
 
 def logout(tokens):
     # logout
-    global current_caregiver
-    global current_patient
+    session = current_session.get()
 
     try: 
-        if current_caregiver is None and current_patient is None:
+        if session.caregiver is None and session.patient is None:
             print("Please login first!")
             return
         else: 
-            current_caregiver = None
-            current_patient = None
+            session.caregiver = None
+            session.patient = None
             print("Successfully logged out!")
-            start()
     except Exception as e:
         print("Please try again!")
         print("Error:", e)
         return
     
 
-def start():
-    stop = False
+def print_banner():
     print()
     print(" *** Please enter one of the following commands *** ")
     print("> create_patient <username> <password>")  # //TODO: implement create_patient (Part 1)
     print("> create_caregiver <username> <password>")
+    print("> import_users <patient|caregiver> <file>")
+    print("> calibrate_kdf <target_ms>")
     print("> login_patient <username> <password>")  # // TODO: implement login_patient (Part 1)
     print("> login_caregiver <username> <password>")
     print("> search_caregiver_schedule <date>")  # // TODO: implement search_caregiver_schedule (Part 2)
+    print("> search_caregiver_schedule_range <start_date> <end_date>")
+    print("> next_available <vaccine>")
     print("> reserve <date> <vaccine>")  # // TODO: implement reserve (Part 2)
     print("> upload_availability <date>")
-    print("> cancel <appointment_id>")  # // TODO: implement cancel (extra credit)
+    print("> upload_availability_range <start_date> <end_date> [daily|weekdays|weekends|mon,wed,...|everyN]")
+    print("> upload_availability_file <path>")
+    print("> cancel <appointment_id> [<appointment_id> ...]")
+    print("> cancel_day <date> [withdraw]")
+    print("> cancel_range <start_date> <end_date> [withdraw]")
     print("> add_doses <vaccine> <number>")
-    print("> show_appointments")  # // TODO: implement show_appointments (Part 2)
+    print("> import_inventory <file>")
+    print("> allocate <file>")
+    print("> show_appointments [from <date>] [to <date>] [vaccine <name>]")  # // TODO: implement show_appointments (Part 2)
+    print("> show_waitlist")
+    print("> leave_waitlist <date> <vaccine>")
+    print("> cache_stats")
+    print("> stats [json|prometheus]")
+    print("> report [<start_date> <end_date>] [json]")
     print("> logout")  # // TODO: implement logout (Part 2)
     print("> Quit")
     print()
+
+
+# Run one command line; returns False once the user asks to quit
+def run_command(response):
+    # file paths are case sensitive, so keep the raw tokens around for commands that take one
+    raw_tokens = response.split(" ")
+    tokens = response.lower().split(" ")
+    operation = tokens[0]
+    start_time = time.perf_counter()
+    command_token = Tracing.current_command.set(operation)
+    try:
+        load_models()
+        keep_going = dispatch(operation, tokens, raw_tokens)
+    except BaseException:
+        Metrics.record_command(operation, time.perf_counter() - start_time, failed=True)
+        raise
+    finally:
+        Tracing.current_command.reset(command_token)
+    # unknown names are recorded together, so typos can't grow the metrics without bound
+    Metrics.record_command(operation if keep_going is not None else "invalid", time.perf_counter() - start_time)
+    return keep_going is not False
+
+
+# Run the command named by operation; returns False to quit and None for an unknown name
+def dispatch(operation, tokens, raw_tokens):
+    if operation == "create_patient":
+        create_patient(tokens)
+    elif operation == "create_caregiver":
+        create_caregiver(tokens)
+    elif operation == "import_users":
+        import_users(raw_tokens)
+    elif operation == "calibrate_kdf":
+        calibrate_kdf(tokens)
+    elif operation == "login_patient":
+        login_patient(tokens)
+    elif operation == "login_caregiver":
+        login_caregiver(tokens)
+    elif operation == "search_caregiver_schedule":
+        search_caregiver_schedule(tokens)
+    elif operation == "search_caregiver_schedule_range":
+        search_caregiver_schedule_range(tokens)
+    elif operation == "next_available":
+        next_available(tokens)
+    elif operation == "reserve":
+        reserve(tokens)
+    elif operation == "upload_availability":
+        upload_availability(tokens)
+    elif operation == "upload_availability_range":
+        upload_availability_range(tokens)
+    elif operation == "upload_availability_file":
+        upload_availability_file(raw_tokens)
+    elif operation == "cancel":
+        cancel(tokens)
+    elif operation == "cancel_day":
+        cancel_day(tokens)
+    elif operation == "cancel_range":
+        cancel_range(tokens)
+    elif operation == "add_doses":
+        add_doses(tokens)
+    elif operation == "import_inventory":
+        import_inventory(raw_tokens)
+    elif operation == "allocate":
+        allocate(raw_tokens)
+    elif operation == "show_appointments":
+        show_appointments(tokens)
+    elif operation == "show_waitlist":
+        show_waitlist(tokens)
+    elif operation == "leave_waitlist":
+        leave_waitlist(tokens)
+    elif operation == "cache_stats":
+        cache_stats(tokens)
+    elif operation == "stats":
+        stats(tokens)
+    elif operation == "report":
+        report(tokens)
+    elif operation == "logout":
+        logout(tokens)
+    elif operation == "quit":
+        print("Bye!")
+        return False
+    else:
+        print("Invalid operation name!")
+        return None
+    return True
+
+
+def start():
+    start_prewarm()
+    print_banner()
+    stop = False
     while not stop:
         response = ""
         print("> ", end='')
@@ -629,40 +1281,44 @@ def start():
         except ValueError:
             print("Please try again!")
             break
+        except EOFError:
+            break
+
+        stop = not run_command(response)
 
-        response = response.lower()
-        tokens = response.split(" ")
-        if len(tokens) == 0:
-            ValueError("Please try again!")
+
+# Run commands read from a stream without prompting, writing one JSON object per command
+# with its output and timing. Blank lines and # comments are skipped. A command that raises
+# gets an "error" in its result; the run stops after a command that exits.
+def run_script(stream, out=None):
+    out = out or sys.stdout
+    # commands run one at a time, but each may fan out two independent reads
+    os.environ.setdefault("PoolSize", "2")
+    start_prewarm()
+    for line_no, line in enumerate(stream, start=1):
+        response = line.rstrip("\r\n")
+        if not response.strip() or response.lstrip().startswith("#"):
             continue
-        operation = tokens[0]
-        if operation == "create_patient":
-            create_patient(tokens)
-        elif operation == "create_caregiver":
-            create_caregiver(tokens)
-        elif operation == "login_patient":
-            login_patient(tokens)
-        elif operation == "login_caregiver":
-            login_caregiver(tokens)
-        elif operation == "search_caregiver_schedule":
-            search_caregiver_schedule(tokens)
-        elif operation == "reserve":
-            reserve(tokens)
-        elif operation == "upload_availability":
-            upload_availability(tokens)
-        elif operation == "cancel":
-            cancel(tokens)
-        elif operation == "add_doses":
-            add_doses(tokens)
-        elif operation == "show_appointments":
-            show_appointments(tokens)
-        elif operation == "logout":
-            logout(tokens)
-        elif operation == "quit":
-            print("Bye!")
-            stop = True
-        else:
-            print("Invalid operation name!")
+        result = {"line": line_no, "command": response.split(" ")[0].lower()}
+        captured = io.StringIO()
+        start_time = time.perf_counter()
+        keep_going = True
+        try:
+            with contextlib.redirect_stdout(captured):
+                keep_going = run_command(response)
+        except SystemExit:
+            # commands quit() on database errors; report it and stop the run
+            result["error"] = "exited"
+            keep_going = False
+        except Exception as e:
+            # a failure the command did not handle itself; report it and go on with the next line
+            result["error"] = f"{type(e).__name__}: {e}"
+        result["ms"] = round((time.perf_counter() - start_time) * 1000, 3)
+        result["output"] = captured.getvalue().splitlines()
+        out.write(json.dumps(result) + "\n")
+        out.flush()
+        if not keep_going:
+            break
 
 
 if __name__ == "__main__":
@@ -673,8 +1329,21 @@ if __name__ == "__main__":
     // and then construct a map of vaccineName -> vaccineObject
     '''
 
-    # start command line
-    print()
-    print("Welcome to the COVID-19 Vaccine Reservation Scheduling Application!")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--script", metavar="FILE",
+                        help="run the commands in FILE (or - for stdin) and print JSON lines results")
+    args = parser.parse_args()
+    Metrics.start_dump()
+    Tracing.start()
+
+    if args.script == "-":
+        run_script(sys.stdin)
+    elif args.script is not None:
+        with open(args.script) as f:
+            run_script(f)
+    else:
+        # start command line
+        print()
+        print("Welcome to the COVID-19 Vaccine Reservation Scheduling Application!")
 
-    start()
+        start()
@@ -0,0 +1,165 @@
+import Scheduler
+from db import Tracing
+from util import Metrics
+import argparse
+import asyncio
+import concurrent.futures
+import contextvars
+import io
+import json
+import os
+import sys
+import time
+
+
+'''
+Line-oriented TCP front-end for the Scheduler commands.
+
+Every client connection gets its own Session, so many patients and caregivers can be
+logged in at once. A client sends one command per line, exactly as typed at the CLI, and
+gets back one JSON object per line: {"command", "ms", "output"[, "error"]}.
+Commands run on a bounded thread pool; once all workers are busy and the queue is full,
+connections stop being read until a slot frees up.
+
+Only the commands in SESSION_COMMANDS are served. The ones that read a file by path on
+this host (import_users, upload_availability_file, import_inventory, allocate), and the
+operator commands that report on or load the whole process, are left to the CLI.
+'''
+
+# the commands a client may send
+SESSION_COMMANDS = frozenset([
+    "create_patient", "create_caregiver", "login_patient", "login_caregiver", "logout",
+    "search_caregiver_schedule", "search_caregiver_schedule_range", "next_available", "reserve",
+    "upload_availability", "upload_availability_range", "add_doses",
+    "cancel", "cancel_day", "cancel_range",
+    "show_appointments", "show_waitlist", "leave_waitlist", "report", "quit",
+])
+
+# buffer collecting the printed output of the command running in the current context
+command_output = contextvars.ContextVar("command_output", default=None)
+
+
+class SessionOutput:
+    # sys.stdout replacement that routes print() from a command to its own client
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        buffer = command_output.get()
+        return (buffer if buffer is not None else self.stream).write(text)
+
+    def flush(self):
+        if command_output.get() is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+# Run one command line for a session; called on a worker thread
+def execute(session, response):
+    def run():
+        # a fresh context per command, so state never leaks between clients sharing a worker
+        Scheduler.current_session.set(session)
+        output = io.StringIO()
+        command_output.set(output)
+        result = {"command": response.split(" ")[0].lower()}
+        if result["command"] not in SESSION_COMMANDS:
+            result["ms"] = 0.0
+            result["output"] = ["This command is not available over the network!"]
+            result["error"] = "not allowed"
+            return result, True
+        start_time = time.perf_counter()
+        keep_going = True
+        try:
+            keep_going = Scheduler.run_command(response)
+        except SystemExit:
+            # commands quit() on database errors; only this command fails
+            result["error"] = "exited"
+        except Exception as e:
+            result["error"] = str(e)
+        result["ms"] = round((time.perf_counter() - start_time) * 1000, 3)
+        result["output"] = output.getvalue().splitlines()
+        return result, keep_going
+
+    return contextvars.Context().run(run)
+
+
+class SchedulerServer:
+    def __init__(self, host="127.0.0.1", port=8765, workers=16, queue_size=64, max_clients=1000):
+        self.host = host
+        self.port = port
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        # commands that may be running or waiting for a worker at any one time
+        self.in_flight = asyncio.Semaphore(workers + queue_size)
+        self.clients = asyncio.Semaphore(max_clients)
+        self.server = None
+        self.stdout = None
+
+    async def start(self):
+        if not isinstance(sys.stdout, SessionOutput):
+            self.stdout = sys.stdout
+            sys.stdout = SessionOutput(sys.stdout)
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def serve_forever(self):
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        self.executor.shutdown(wait=True)
+        if self.stdout is not None:
+            sys.stdout, self.stdout = self.stdout, None
+
+    async def handle_client(self, reader, writer):
+        session = Scheduler.Session()
+        loop = asyncio.get_running_loop()
+        try:
+            async with self.clients:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    response = line.decode("utf-8", errors="replace").rstrip("\r\n")
+                    if not response.strip():
+                        continue
+                    async with self.in_flight:
+                        result, keep_going = await loop.run_in_executor(self.executor, execute, session, response)
+                    writer.write((json.dumps(result) + "\n").encode("utf-8"))
+                    await writer.drain()
+                    if not keep_going:
+                        break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def main(host, port, workers, queue_size):
+    server = await SchedulerServer(host, port, workers, queue_size).start()
+    print(f"Scheduler server listening on {server.host}:{server.port}", file=sys.stderr)
+    await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=16, help="threads running blocking database work")
+    parser.add_argument("--queue-size", type=int, default=64, help="commands allowed to wait for a worker")
+    args = parser.parse_args()
+
+    # let every worker hold a pooled connection without waiting on the others
+    os.environ.setdefault("PoolSize", str(args.workers))
+    Metrics.start_dump()
+    Tracing.start()
+    Scheduler.start_prewarm()
+    try:
+        asyncio.run(main(args.host, args.port, args.workers, args.queue_size))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,236 @@
+import Scheduler
+from db import Instrumentation
+from db.ConnectionManager import ConnectionManager
+from db.IdAllocator import IdAllocator
+from db import Batch
+from model.Caregiver import Caregiver
+from model.Patient import Patient
+from model.Vaccine import Vaccine
+from util.Util import Util
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import re
+import time
+import uuid
+
+
+'''
+Per-command micro-benchmarks with round-trip accounting.
+
+Drives each Scheduler command through run_command(), exactly as the CLI does, against the
+database the environment points at - normally a local server (set ServerHost, e.g.
+localhost:1433) or a scratch SQLite file (Backend=sqlite, SqlitePath) - after seeding it
+with data of each requested size. For every command it reports latency percentiles and,
+per call, connections opened, statements executed and rows fetched. Seeded rows are
+prefixed with a per-run tag and removed again.
+
+    python -m bench.Benchmark --sizes 100,1000,10000 --iterations 50 --output bench.json
+    python -m bench.Benchmark --sizes 1000 --compare bench.json
+'''
+
+# calendar far away from real bookings
+BASE_DATE = datetime.datetime(2099, 1, 1)
+VACCINE_DOSES = 1000000
+
+
+class Counter(Instrumentation.Listener):
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.connections = 0
+        self.statements = 0
+        self.rows = 0
+
+    def connection_opened(self):
+        self.connections += 1
+
+    def statement_executed(self, sql, params, seconds, rowcount):
+        self.statements += 1
+
+    def statement_failed(self, sql, params, seconds, error):
+        self.statements += 1
+
+    def rows_fetched(self, count):
+        self.rows += count
+
+
+def percentile(sorted_values, fraction):
+    # nearest-rank percentile of an already sorted list
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class Benchmark:
+    def __init__(self, size, iterations, counter):
+        self.size = size
+        self.iterations = iterations
+        # a registered Counter listener
+        self.counter = counter
+        self.tag = "bench" + uuid.uuid4().hex[:8]
+        self.days = max(1, size // 100)
+
+    def date(self, i):
+        return BASE_DATE + datetime.timedelta(days=i % self.days)
+
+    def date_token(self, i):
+        return f"{self.date(i):%m-%d-%Y}"
+
+    # Seed `size` availability slots and a patient with `size` past appointments
+    def seed(self):
+        kdf = Util.current_kdf()
+        caregivers = []
+        for i in range(max(1, self.size // self.days)):
+            salt, hash = Util.generate_salt_and_hash("pw", kdf)
+            caregivers.append(Caregiver(f"{self.tag}c{i}", salt=salt, hash=hash, kdf=kdf))
+        Caregiver.save_all_to_db(caregivers)
+        dates = [self.date(i) for i in range(self.days)]
+        for caregiver in caregivers:
+            caregiver.upload_availabilities(dates)
+
+        salt, hash = Util.generate_salt_and_hash("pw", kdf)
+        Patient.save_all_to_db([Patient(f"{self.tag}p", salt=salt, hash=hash, kdf=kdf)])
+        Vaccine.add_doses_in_bulk({f"{self.tag}v": VACCINE_DOSES})
+
+        # history for show_appointments, with IDs leased from the shared counter in one block
+        ids = IdAllocator("Appointments", "apID", block_size=self.size)
+        rows = [(ids.next_id(), self.date(i) - datetime.timedelta(days=self.days), caregivers[0].username,
+                 f"{self.tag}p", f"{self.tag}v") for i in range(self.size)]
+        add_appointments = "INSERT INTO Appointments (apID, Time, cUsername, pUsername, Name) VALUES {}"
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            for chunk in Batch.chunks(rows):
+                cursor.execute(add_appointments.format(Batch.values_clause(len(chunk), "(%d, %s, %s, %s, %s)")),
+                               Batch.flatten(chunk))
+            conn.commit()
+
+    def cleanup(self):
+        pattern = self.tag + "%"
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM Appointments WHERE pUsername LIKE %s OR cUsername LIKE %s", (pattern, pattern))
+            cursor.execute("DELETE FROM Waitlist WHERE pUsername LIKE %s", pattern)
+            cursor.execute("DELETE FROM Availabilities WHERE Username LIKE %s", pattern)
+            cursor.execute("DELETE FROM Patients WHERE Username LIKE %s", pattern)
+            cursor.execute("DELETE FROM Caregivers WHERE Username LIKE %s", pattern)
+            cursor.execute("DELETE FROM Vaccines WHERE Name LIKE %s", pattern)
+            conn.commit()
+
+    # Time `command(i)` for every iteration, running `before(i)` / `after(i)` untimed
+    def measure(self, name, command, before=None, after=None):
+        latencies = []
+        connections = statements = rows = 0
+        outputs = []
+        for i in range(self.iterations):
+            if before is not None:
+                self.run(before(i))
+            self.counter.reset()
+            captured = io.StringIO()
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(captured):
+                Scheduler.run_command(command(i))
+            latencies.append((time.perf_counter() - start) * 1000)
+            connections += self.counter.connections
+            statements += self.counter.statements
+            rows += self.counter.rows
+            outputs.append(captured.getvalue())
+            if after is not None:
+                self.run(after(i))
+
+        latencies.sort()
+        result = {
+            "command": name,
+            "iterations": self.iterations,
+            "p50_ms": percentile(latencies, 0.50),
+            "p90_ms": percentile(latencies, 0.90),
+            "p99_ms": percentile(latencies, 0.99),
+            "mean_ms": sum(latencies) / len(latencies),
+            "connections_per_call": connections / self.iterations,
+            "statements_per_call": statements / self.iterations,
+            "rows_per_call": rows / self.iterations,
+        }
+        return result, outputs
+
+    def run(self, response):
+        with contextlib.redirect_stdout(io.StringIO()):
+            Scheduler.run_command(response)
+
+    def run_all(self):
+        tag = self.tag
+        Scheduler.current_session.set(Scheduler.Session())
+        results = []
+
+        def record(name, command, before=None, after=None):
+            result, outputs = self.measure(name, command, before, after)
+            results.append(result)
+            return outputs
+
+        record("create_patient", lambda i: f"create_patient {tag}n{i} pw")
+        record("login_patient", lambda i: f"login_patient {tag}p pw", after=lambda i: "logout")
+        record("login_caregiver", lambda i: f"login_caregiver {tag}c0 pw", after=lambda i: "logout")
+
+        self.run(f"login_caregiver {tag}c0 pw")
+        record("add_doses", lambda i: f"add_doses {tag}v 1")
+        self.run("logout")
+
+        self.run(f"login_patient {tag}p pw")
+        record("search_caregiver_schedule", lambda i: f"search_caregiver_schedule {self.date_token(i)}")
+        outputs = record("reserve", lambda i: f"reserve {self.date_token(i)} {tag}v")
+        record("show_appointments", lambda i: "show_appointments")
+        booked = [m.group(1) for output in outputs for m in re.finditer(r"Appointment ID: (\d+)", output)]
+        record("cancel", lambda i: f"cancel {booked[i] if i < len(booked) else 0}")
+        self.run("logout")
+        return results
+
+
+def compare(results, baseline):
+    # print the change in p50 latency and statements per call against an earlier run
+    previous = {(run["size"], result["command"]): result for run in baseline["runs"] for result in run["results"]}
+    for run in results["runs"]:
+        for result in run["results"]:
+            old = previous.get((run["size"], result["command"]))
+            if old is None:
+                continue
+            change = (result["p50_ms"] - old["p50_ms"]) / old["p50_ms"] * 100 if old["p50_ms"] else 0.0
+            print(f"size {run['size']:>7} {result['command']:<26} p50 {old['p50_ms']:9.2f} -> {result['p50_ms']:9.2f} ms "
+                  f"({change:+.1f}%), statements {old['statements_per_call']:.1f} -> {result['statements_per_call']:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="100,1000", help="comma separated data sizes to seed")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare against the results in this JSON file")
+    args = parser.parse_args()
+
+    counter = Counter()
+    Instrumentation.add_listener(counter)
+    results = {"started": datetime.datetime.now().isoformat(timespec="seconds"),
+               "iterations": args.iterations, "kdf": Util.current_kdf(), "runs": []}
+    for size in [int(size) for size in args.sizes.split(",")]:
+        benchmark = Benchmark(size, args.iterations, counter)
+        try:
+            benchmark.seed()
+            run = {"size": size, "results": benchmark.run_all()}
+        finally:
+            benchmark.cleanup()
+        results["runs"].append(run)
+        for result in run["results"]:
+            print(f"size {size:>7} {result['command']:<26} p50 {result['p50_ms']:9.2f} p90 {result['p90_ms']:9.2f} "
+                  f"p99 {result['p99_ms']:9.2f} ms  conns {result['connections_per_call']:.2f}  "
+                  f"stmts {result['statements_per_call']:.1f}  rows {result['rows_per_call']:.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
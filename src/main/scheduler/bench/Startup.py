@@ -0,0 +1,131 @@
+from bench.Benchmark import Benchmark, percentile
+import argparse
+import datetime
+import json
+import math
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+'''
+Startup benchmark: import time, time to the banner and first-command latency.
+
+Starts the CLI in fresh processes against the database the environment points at and
+measures, over --runs runs each:
+
+    import       importing the Scheduler module
+    banner       launching Scheduler.py until the banner is shown
+    session      a short session typed after a pause of --idle seconds at the banner,
+                 with background pre-warming on and off (Prewarm=off): login, then
+                 search_caregiver_schedule and reserve a few times each
+
+With pre-warming on, the first search_caregiver_schedule and reserve of a session should
+cost about as much as the later ones. The patient, caregivers and doses the sessions use are
+seeded like bench.Benchmark does it and removed again.
+
+    python -m bench.Startup --runs 5 --idle 1 --output startup.json
+'''
+
+SCHEDULER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# repetitions of each timed command per session
+REPEATS = 3
+
+
+def time_import():
+    code = "import time; start = time.perf_counter(); import Scheduler; print(time.perf_counter() - start)"
+    result = subprocess.run([sys.executable, "-c", code], cwd=SCHEDULER_DIR, capture_output=True, text=True,
+                            check=True)
+    return float(result.stdout.split()[-1]) * 1000
+
+
+def time_to_banner():
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "Scheduler.py"], cwd=SCHEDULER_DIR, stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, text=True, env=dict(os.environ, PYTHONUNBUFFERED="1"))
+    try:
+        # "> Quit" is the last line of the banner
+        for line in process.stdout:
+            if line.startswith("> Quit"):
+                break
+        elapsed = (time.perf_counter() - start) * 1000
+        process.communicate("quit\n", timeout=60)
+    finally:
+        if process.poll() is None:
+            process.kill()
+    return elapsed
+
+
+# Type the commands into a fresh CLI after idle seconds; returns [(command, ms), ...]
+def time_session(commands, idle, prewarm):
+    env = dict(os.environ, Prewarm="on" if prewarm else "off")
+    process = subprocess.Popen([sys.executable, "Scheduler.py", "--script", "-"], cwd=SCHEDULER_DIR,
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, env=env)
+    time.sleep(idle)
+    out, _ = process.communicate("\n".join(commands) + "\nquit\n", timeout=300)
+    results = [json.loads(line) for line in out.splitlines() if line.startswith("{")]
+    return [(result["command"], result["ms"]) for result in results]
+
+
+def first_and_rest(timings, command):
+    values = [ms for name, ms in timings if name == command]
+    return values[0], statistics.median(values[1:])
+
+
+def summarize(values):
+    values = sorted(values)
+    return {"p50_ms": percentile(values, 0.50), "max_ms": values[-1], "mean_ms": sum(values) / len(values)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--idle", type=float, default=1.0, help="seconds spent at the banner before typing")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = {"started": datetime.datetime.now().isoformat(timespec="seconds"), "runs": args.runs,
+               "idle_s": args.idle}
+    results["import"] = summarize([time_import() for _ in range(args.runs)])
+    results["banner"] = summarize([time_to_banner() for _ in range(args.runs)])
+    print(f"import  p50 {results['import']['p50_ms']:9.2f} max {results['import']['max_ms']:9.2f} ms")
+    print(f"banner  p50 {results['banner']['p50_ms']:9.2f} max {results['banner']['max_ms']:9.2f} ms")
+
+    # Benchmark seeds `size` slots over size // 100 dates. Every session books REPEATS slots
+    # and each command of a session uses its own date, so none is answered from the cache
+    # another one filled and the first command is compared with like for like.
+    benchmark = Benchmark(100 * max(REPEATS, math.ceil(2 * args.runs * REPEATS / 100)), 1, None)
+    booked = 0
+    try:
+        benchmark.seed()
+        for prewarm in (True, False):
+            firsts = {"search_caregiver_schedule": [], "reserve": []}
+            rests = {"search_caregiver_schedule": [], "reserve": []}
+            for _ in range(args.runs):
+                commands = [f"login_patient {benchmark.tag}p pw"]
+                commands += [f"search_caregiver_schedule {benchmark.date_token(booked + i)}" for i in range(REPEATS)]
+                commands += [f"reserve {benchmark.date_token(booked + i)} {benchmark.tag}v" for i in range(REPEATS)]
+                booked += REPEATS
+                timings = time_session(commands, args.idle, prewarm)
+                for command in firsts:
+                    first, rest = first_and_rest(timings, command)
+                    firsts[command].append(first)
+                    rests[command].append(rest)
+            mode = "prewarm" if prewarm else "cold"
+            results[mode] = {}
+            for command in firsts:
+                results[mode][command] = {"first": summarize(firsts[command]), "later": summarize(rests[command])}
+                print(f"{mode:<7} {command:<26} first p50 {results[mode][command]['first']['p50_ms']:9.2f} ms  "
+                      f"later p50 {results[mode][command]['later']['p50_ms']:9.2f} ms")
+    finally:
+        benchmark.cleanup()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
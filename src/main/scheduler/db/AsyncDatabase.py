@@ -0,0 +1,111 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import os
+import threading
+
+
+'''
+Asynchronous database access.
+
+Neither pymssql nor sqlite3 has an asyncio interface, so the AsyncConnectionPool runs each
+unit of work - a model call that borrows its own pooled connection - on one of its worker
+threads and hands back an awaitable. There is one worker per pooled connection (PoolSize),
+so a unit of work never queues behind another for a connection, and independent reads
+started together overlap their round trips: a command that needs three of them waits
+about as long as it would for one.
+
+The commands are synchronous; they hand coroutines to fan_out() or wait(), which run them
+on one event loop thread shared by the process. The caller's context - its session and
+traced command name - is carried over to the loop and on to the worker threads.
+
+    caregivers, vaccines = AsyncDatabase.fan_out(Caregiver.get_available_async(d),
+                                                 Vaccine.get_all_async())
+'''
+
+
+class AsyncConnectionPool:
+    def __init__(self, size=None):
+        self.size = size
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # sized on first use, after the command line has had a chance to set PoolSize
+                    if self.size is None:
+                        self.size = int(os.getenv("PoolSize", "5"))
+                    self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.size,
+                                                                           thread_name_prefix="db-async")
+        return self._executor
+
+    # Start every worker thread now rather than on the first requests
+    def start(self):
+        executor = self.executor()
+        # the executor adds a thread per submission while none is idle
+        for future in [executor.submit(int) for _ in range(self.size)]:
+            future.result()
+
+    # Run fn(*args) on a worker thread in a copy of the caller's context
+    async def run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.executor(), functools.partial(context.run, fn, *args))
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+pool = AsyncConnectionPool()
+
+_loop = None
+_loop_thread = None
+_loop_lock = threading.Lock()
+
+
+def event_loop():
+    global _loop, _loop_thread
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                _loop_thread = threading.Thread(target=loop.run_forever, name="db-async-loop", daemon=True)
+                _loop_thread.start()
+                _loop = loop
+    return _loop
+
+
+# Start the shared event loop and pool workers ahead of use
+def start():
+    event_loop()
+    pool.start()
+
+
+# Await fn(*args) run on the shared pool
+async def run(fn, *args):
+    return await pool.run(fn, *args)
+
+
+# Block until the coroutine finishes on the shared event loop and return its result.
+# Called from synchronous code only; the loop thread itself must await instead.
+def wait(coro):
+    loop = event_loop()
+    if threading.current_thread() is _loop_thread:
+        coro.close()
+        raise RuntimeError("wait() called on the event loop thread")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+async def gather(*awaitables):
+    return await asyncio.gather(*awaitables)
+
+
+# Run independent awaitables concurrently and return their results in order
+def fan_out(*awaitables):
+    return wait(gather(*awaitables))
@@ -0,0 +1,302 @@
+import datetime
+import os
+import re
+import sqlite3
+import threading
+
+
+'''
+Storage backends. The Backend environment variable picks one:
+
+    mssql   (default) SQL Server through pymssql, configured by Server or ServerHost,
+            UserID, Password and DBName
+    sqlite  an embedded SQLite database in WAL mode at SqlitePath (default scheduler.db),
+            created on first use; for single-site kiosks and hermetic test and benchmark runs
+
+Every connection handed out is wrapped so that driver errors surface as DatabaseError.
+Statements are written in T-SQL with %s / %d parameters; the SQLite connection rewrites the
+common idioms (placeholders, table hints, TOP, CAST AS date, VALUES aliases, OUTPUT of a
+DELETE or UPDATE) and the few multi-statement batches have SQLite variants next to them,
+chosen by ConnectionManager.dialect(). A statement with T-SQL left over after the rewrite,
+say an idiom in a form the rewrite does not recognise, is refused with a DatabaseError
+rather than run half translated.
+'''
+
+
+class DatabaseError(Exception):
+    # any error raised by the database driver; the original is chained as __cause__
+    pass
+
+
+class Backend:
+    name = None
+    # exception class(es) raised by the driver
+    driver_errors = ()
+
+    def connect(self):
+        raise NotImplementedError
+
+    # wrap a raw connection from connect() for use by the models
+    def adapt(self, conn):
+        return Connection(conn, self)
+
+    def translate(self, sql, params):
+        return sql, params
+
+
+class MssqlBackend(Backend):
+    name = "mssql"
+
+    def __init__(self, server, user, password, database):
+        # imported here so that the other backends run without the driver installed
+        import pymssql
+        self.driver = pymssql
+        self.driver_errors = pymssql.Error
+        self.server = server
+        self.user = user
+        self.password = password
+        self.database = database
+
+    def connect(self):
+        try:
+            return self.driver.connect(server=self.server, user=self.user, password=self.password,
+                                       database=self.database)
+        except self.driver.Error as e:
+            raise DatabaseError(str(e)) from e
+
+
+def adapt_date(value):
+    # the models pass dates as midnight datetimes; store them as plain ISO dates
+    if isinstance(value, datetime.datetime) and value.time() == datetime.time():
+        return value.date().isoformat()
+    return value.isoformat(" ") if isinstance(value, datetime.datetime) else value.isoformat()
+
+
+sqlite3.register_adapter(datetime.datetime, adapt_date)
+sqlite3.register_adapter(datetime.date, adapt_date)
+sqlite3.register_converter("date", lambda value: datetime.date.fromisoformat(value.decode()[:10]))
+
+HINT = re.compile(r"\s+WITH \((?:UPDLOCK|HOLDLOCK|READPAST|ROWLOCK|NOLOCK)(?:, (?:UPDLOCK|HOLDLOCK|READPAST|ROWLOCK|NOLOCK))*\)")
+TOP = re.compile(r"^(\s*SELECT )TOP \((%d|\d+)\) ")
+CAST_DATE = re.compile(r"CAST\(([\w.%]+) AS date\)")
+VALUES_ALIAS = re.compile(r"\(VALUES (.+?)\) AS (\w+)\(([\w, ]+)\)")
+OUTPUT_DELETED = re.compile(r"^(\s*DELETE FROM \w+) OUTPUT ((?:deleted\.\w+)(?:, deleted\.\w+)*) (WHERE .*)$", re.S)
+OUTPUT_INSERTED = re.compile(r"^(\s*UPDATE \w+ SET .+?) OUTPUT ((?:inserted\.\w+)(?:, inserted\.\w+)*) (WHERE .*)$", re.S)
+# T-SQL that must not survive the rewrite, checked with string literals blanked out
+UNTRANSLATED = re.compile(r"\bWITH \(|\bTOP\b|\bOUTPUT\b|\bAS date\b|\) AS \w+\(|@\w|\$action|\bDECLARE\b|"
+                          r"\bSET NOCOUNT\b|\bBEGIN TRAN|\bMERGE\b|\bEXEC\b|\b(?:ISNULL|GETDATE|SYSUTCDATETIME|"
+                          r"DATEDIFF|DATEADD|OBJECT_ID|COL_LENGTH|LEN)\(", re.I)
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+PLACEHOLDER = re.compile(r"%[sd]")
+WRITE = re.compile(r"^\s*(INSERT|UPDATE|DELETE|REPLACE|CREATE|DROP|ALTER)\b", re.I)
+
+
+class SqliteBackend(Backend):
+    name = "sqlite"
+    driver_errors = sqlite3.Error
+
+    def __init__(self, path):
+        self.path = path
+        self._initialized = False
+        self._lock = threading.Lock()
+        # T-SQL text -> (SQLite text, index of a parameter to move to the end, begins a write)
+        self._translations = {}
+
+    def connect(self):
+        try:
+            # transactions are begun explicitly by the adapter, see Connection.begin
+            conn = sqlite3.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES, isolation_level=None,
+                                   check_same_thread=False, timeout=float(os.getenv("SqliteTimeout", "30")))
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute("PRAGMA foreign_keys = ON")
+            with self._lock:
+                if not self._initialized:
+                    from db import Migrations
+                    Migrations.create_sqlite_schema(conn)
+                    self._initialized = True
+            return conn
+        except sqlite3.Error as e:
+            raise DatabaseError(str(e)) from e
+
+    def translate(self, sql, params):
+        translation = self._translations.get(sql)
+        if translation is None:
+            translation = self._translations[sql] = self.rewrite(sql)
+        text, moved, _ = translation
+        if params is None:
+            params = ()
+        elif not isinstance(params, (tuple, list)):
+            params = (params,)
+        if moved is not None:
+            params = tuple(params[:moved]) + tuple(params[moved + 1:]) + (params[moved],)
+        return text, params
+
+    def begins_write(self, sql):
+        translation = self._translations.get(sql)
+        return translation[2] if translation is not None else self.rewrite(sql)[2]
+
+    # Rewrite one T-SQL statement for SQLite
+    def rewrite(self, sql):
+        # lock hints say the transaction is going to write, so take the write lock up front
+        writes = bool(WRITE.match(sql)) or bool(HINT.search(sql))
+        text = HINT.sub("", sql)
+        moved = None
+        top = TOP.match(text)
+        if top is not None:
+            if top.group(2) == "%d":
+                moved = len(PLACEHOLDER.findall(text[:top.start(2)]))
+                limit = "%d"
+            else:
+                limit = top.group(2)
+            text = top.group(1) + text[top.end():].rstrip().rstrip(";") + " LIMIT " + limit
+        text = CAST_DATE.sub(r"date(\1)", text)
+        text = VALUES_ALIAS.sub(lambda m: "(SELECT " + ", ".join(
+            f"column{i} AS {column.strip()}" for i, column in enumerate(m.group(3).split(","), start=1))
+            + " FROM (VALUES " + m.group(1) + ")) AS " + m.group(2), text)
+        output = OUTPUT_DELETED.match(text) or OUTPUT_INSERTED.match(text)
+        if output is not None:
+            # RETURNING gives the deleted row of a DELETE and the new row of an UPDATE
+            text = output.group(1) + " " + output.group(3).rstrip().rstrip(";") + " RETURNING " + \
+                output.group(2).replace("deleted.", "").replace("inserted.", "")
+        untranslated = UNTRANSLATED.search(STRING_LITERAL.sub("''", text))
+        if untranslated is not None:
+            raise DatabaseError(f"Cannot run {untranslated.group(0)!r} on SQLite; write a SQLite variant of: "
+                                + " ".join(sql.split()))
+        return PLACEHOLDER.sub("?", text), moved, writes
+
+
+class Connection:
+    def __init__(self, conn, backend):
+        self._conn = conn
+        self._backend = backend
+        # the SQLite cursors handed out, see reset_cursors
+        self._cursors = []
+
+    def cursor(self, as_dict=False):
+        try:
+            if isinstance(self._backend, SqliteBackend):
+                cursor = SqliteCursor(self._conn.cursor(), self, as_dict)
+                self._cursors.append(cursor)
+                return cursor
+            return Cursor(self._conn.cursor(as_dict=as_dict), self._backend)
+        except self._backend.driver_errors as e:
+            raise DatabaseError(str(e)) from e
+
+    # SQLite runs in autocommit mode; like SQL Server's implicit transactions, every unit of
+    # work is opened on its first statement, taking the write lock at once when it will write
+    def begin(self, sql):
+        if not self._conn.in_transaction:
+            self.reset_cursors()
+            self._conn.execute("BEGIN IMMEDIATE" if self._backend.begins_write(sql) else "BEGIN")
+
+    # A SQLite result set that was not read to the end keeps its read snapshot after the
+    # transaction ends, and a connection holding an old snapshot fails BEGIN IMMEDIATE at once
+    # instead of waiting for the write lock. So results are ended before every new transaction
+    # and when the connection is returned, even if a cursor object outlives its connection.
+    def reset_cursors(self):
+        for cursor in self._cursors:
+            cursor.reset()
+
+    def commit(self):
+        try:
+            self._conn.commit()
+        except self._backend.driver_errors as e:
+            raise DatabaseError(str(e)) from e
+
+    def rollback(self):
+        try:
+            self._conn.rollback()
+        except self._backend.driver_errors as e:
+            raise DatabaseError(str(e)) from e
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class Cursor:
+    # a driver cursor whose errors are raised as DatabaseError
+    def __init__(self, cursor, backend):
+        self._cursor = cursor
+        self._backend = backend
+
+    def execute(self, sql, params=None):
+        try:
+            if params is None:
+                return self._cursor.execute(sql)
+            return self._cursor.execute(sql, params)
+        except self._backend.driver_errors as e:
+            raise DatabaseError(str(e)) from e
+
+    def fetchone(self):
+        try:
+            return self._cursor.fetchone()
+        except self._backend.driver_errors as e:
+            raise DatabaseError(str(e)) from e
+
+    def fetchmany(self, size=None):
+        try:
+            return self._cursor.fetchmany() if size is None else self._cursor.fetchmany(size)
+        except self._backend.driver_errors as e:
+            raise DatabaseError(str(e)) from e
+
+    def fetchall(self):
+        try:
+            return self._cursor.fetchall()
+        except self._backend.driver_errors as e:
+            raise DatabaseError(str(e)) from e
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class SqliteCursor(Cursor):
+    def __init__(self, cursor, connection, as_dict):
+        super().__init__(cursor, connection._backend)
+        self._connection = connection
+        self._as_dict = as_dict
+
+    # end any result set still open; the cursor stays usable
+    def reset(self):
+        self._cursor.close()
+        self._cursor = self._connection._conn.cursor()
+
+    def execute(self, sql, params=None):
+        text, params = self._backend.translate(sql, params)
+        try:
+            self._connection.begin(sql)
+            return self._cursor.execute(text, params)
+        except sqlite3.Error as e:
+            raise DatabaseError(str(e)) from e
+
+    def fetchone(self):
+        return self._row(super().fetchone())
+
+    def fetchmany(self, size=None):
+        return [self._row(row) for row in super().fetchmany(size)]
+
+    def fetchall(self):
+        return [self._row(row) for row in super().fetchall()]
+
+    def _row(self, row):
+        if row is None or not self._as_dict:
+            return row
+        return {column[0]: value for column, value in zip(self._cursor.description, row)}
+
+
+def from_env():
+    name = os.getenv("Backend", "mssql").lower()
+    if name == "sqlite":
+        return SqliteBackend(os.getenv("SqlitePath", "scheduler.db"))
+    if name == "mssql":
+        # ServerHost names any server directly, e.g. a local stand-in for benchmarks
+        server = os.getenv("ServerHost") or os.getenv("Server") + ".database.windows.net"
+        return MssqlBackend(server, os.getenv("UserID"), os.getenv("Password"), os.getenv("DBName"))
+    raise ValueError("Unknown Backend " + name + ", expected mssql or sqlite")
@@ -0,0 +1,19 @@
+# SQL Server accepts at most 1000 row value expressions in one VALUES list
+MAX_ROWS = 1000
+
+
+# Split rows into lists small enough for one multi-row VALUES statement
+def chunks(rows, size=MAX_ROWS):
+    rows = list(rows)
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+# "(%s, %s), (%s, %s), ..." for row_count rows of the given placeholder tuple
+def values_clause(row_count, placeholders):
+    return ", ".join([placeholders] * row_count)
+
+
+# Flatten a list of row tuples into one parameter tuple
+def flatten(rows):
+    return tuple(value for row in rows for value in row)
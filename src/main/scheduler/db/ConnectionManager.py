@@ -1,29 +1,89 @@
-import pymssql
 import os
+import threading
+import time
+from db.ConnectionPool import ConnectionPool
+from db import Backend
+from db.Backend import DatabaseError
+from db import Instrumentation
+from util import Metrics
 
 
 class ConnectionManager:
+    # one backend and pool are shared by every ConnectionManager in the process
+    _backend = None
+    _pool = None
+    _pool_lock = threading.Lock()
 
     def __init__(self):
-        self.server_name = os.getenv("Server") + ".database.windows.net"
-        self.db_name = os.getenv("DBName")
-        self.user = os.getenv("UserID")
-        self.password = os.getenv("Password")
         self.conn = None
+        # what create_connection handed out: the adapted, possibly instrumented, connection
+        self.handle = None
 
     def create_connection(self):
+        start_time = time.perf_counter()
         try:
-            self.conn = pymssql.connect(server=self.server_name, user=self.user, password=self.password, database=self.db_name)
-        except pymssql.Error as db_err:
+            self.conn = self.get_pool().acquire()
+        except DatabaseError as db_err:
+            Metrics.registry.increment("scheduler_connection_errors_total")
             print("Database Programming Error in SQL connection processing! ")
             print(db_err)
             quit()
-        return self.conn
+        Metrics.record_connection_acquired(time.perf_counter() - start_time)
+        self.handle = Instrumentation.wrap(ConnectionManager.get_backend().adapt(self.conn))
+        return self.handle
 
-    def close_connection(self):
-        try:
-            self.conn.close()
-        except pymssql.Error as db_err:
-            print("Database Programming Error in SQL connection processing! ")
-            print(db_err)
-            quit()
+    def close_connection(self, discard=False):
+        # returns the connection to the pool; safe to call more than once
+        if self.conn is None:
+            return
+        conn, self.conn = self.conn, None
+        handle, self.handle = self.handle, None
+        Instrumentation.finish(handle)
+        handle.reset_cursors()
+        self.get_pool().release(conn, discard=discard)
+        Metrics.record_connection_released(discard)
+
+    def __enter__(self):
+        return self.create_connection()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # a driver error may leave the connection unusable, so don't reuse it
+        self.close_connection(discard=isinstance(exc_value, DatabaseError))
+        return False
+
+    @staticmethod
+    def get_backend():
+        if ConnectionManager._backend is None:
+            with ConnectionManager._pool_lock:
+                if ConnectionManager._backend is None:
+                    ConnectionManager._backend = Backend.from_env()
+        return ConnectionManager._backend
+
+    # "mssql" or "sqlite", for the statements that are written once per dialect
+    @staticmethod
+    def dialect():
+        return ConnectionManager.get_backend().name
+
+    def get_pool(self):
+        if ConnectionManager._pool is None:
+            backend = ConnectionManager.get_backend()
+            with ConnectionManager._pool_lock:
+                if ConnectionManager._pool is None:
+                    ConnectionManager._pool = ConnectionPool(
+                        Instrumentation.instrument_connect(backend.connect),
+                        size=int(os.getenv("PoolSize", "5")),
+                        idle_timeout=float(os.getenv("PoolIdleTimeout", "300")),
+                        check_interval=float(os.getenv("PoolCheckInterval", "30")),
+                        timeout=float(os.getenv("PoolTimeout", "30")))
+        return ConnectionManager._pool
+
+    @staticmethod
+    def configure_pool(pool, backend=None):
+        # replaces the shared pool, e.g. with one built on a stand-in driver; the backend
+        # decides how its connections are adapted
+        with ConnectionManager._pool_lock:
+            if backend is not None:
+                ConnectionManager._backend = backend
+            old_pool, ConnectionManager._pool = ConnectionManager._pool, pool
+        if old_pool is not None:
+            old_pool.close()
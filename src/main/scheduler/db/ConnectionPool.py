@@ -0,0 +1,134 @@
+import threading
+import time
+
+
+class ConnectionPool:
+    """
+    A bounded pool of reusable DB-API connections.
+
+    `connect` is any zero-argument callable returning a DB-API connection, so the
+    pool can be driven by any backend's driver, or by a local stand-in driver in
+    tests.
+    """
+
+    def __init__(self, connect, size=5, idle_timeout=300, check_interval=30, timeout=30):
+        if size <= 0:
+            raise ValueError("Pool size must be positive!")
+        self.connect = connect
+        self.size = size
+        # connections idle for longer than this many seconds are closed
+        self.idle_timeout = idle_timeout
+        # connections idle for longer than this many seconds are pinged on checkout
+        self.check_interval = check_interval
+        # seconds to wait for a free connection before giving up
+        self.timeout = timeout
+        self._idle = []  # (connection, last_used) pairs, most recently used last
+        self._in_use = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Connection pool is closed!")
+                self._evict_idle()
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._in_use < self.size:
+                    conn, last_used = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("Timed out waiting for a database connection")
+                self._cond.wait(remaining)
+            self._in_use += 1
+
+        # health checks and new connections happen outside the lock
+        try:
+            if conn is not None and time.monotonic() - last_used > self.check_interval:
+                if not self._is_healthy(conn):
+                    self._close_quietly(conn)
+                    conn = None
+            if conn is None:
+                conn = self.connect()
+        except BaseException:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    # Open connections ahead of demand until `count` (at most the pool size) are idle or in
+    # use; returns how many were opened
+    def fill(self, count):
+        count = min(count, self.size)
+        opened = 0
+        while True:
+            with self._cond:
+                if self._closed or len(self._idle) + self._in_use >= count:
+                    return opened
+                # hold the slot while connecting, like acquire does
+                self._in_use += 1
+            try:
+                conn = self.connect()
+            except BaseException:
+                with self._cond:
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+                if self._closed:
+                    self._close_quietly(conn)
+                    return opened
+                self._idle.append((conn, time.monotonic()))
+            opened += 1
+
+    def release(self, conn, discard=False):
+        # never hand uncommitted work to the next borrower
+        if not discard:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+        with self._cond:
+            self._in_use -= 1
+            if discard or self._closed:
+                self._close_quietly(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def _evict_idle(self):
+        # idle connections are ordered by last use, so stale ones are at the front
+        now = time.monotonic()
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            conn, _ = self._idle.pop(0)
+            self._close_quietly(conn)
+
+    def _is_healthy(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            return True
+        except Exception:
+            return False
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
@@ -0,0 +1,90 @@
+import os
+import threading
+from db.ConnectionManager import ConnectionManager
+
+
+# Leases the next block of IDs. The counter row is created on first use, starting after the
+# largest ID already in the seed table; HOLDLOCK makes concurrent first leases queue up
+# rather than both inserting the row.
+LEASE_BLOCK = """
+SET NOCOUNT ON;
+SET XACT_ABORT ON;
+DECLARE @Name varchar(255) = %s;
+DECLARE @Block int = %d;
+DECLARE @Leased TABLE (Start int);
+
+BEGIN TRANSACTION;
+
+UPDATE IdBlocks WITH (UPDLOCK, HOLDLOCK) SET NextValue = NextValue + @Block
+    OUTPUT deleted.NextValue INTO @Leased
+    WHERE Name = @Name;
+
+IF NOT EXISTS (SELECT 1 FROM @Leased)
+    INSERT INTO IdBlocks (Name, NextValue)
+        OUTPUT inserted.NextValue - @Block INTO @Leased
+        SELECT @Name, ISNULL(MAX({column}), 0) + 1 + @Block FROM {table} WITH (UPDLOCK, HOLDLOCK);
+
+COMMIT TRANSACTION;
+
+SELECT Start FROM @Leased;
+"""
+
+# The same for SQLite, where the write lock taken by the first statement serializes leases
+LEASE_BLOCK_SQLITE = [
+    "INSERT OR IGNORE INTO IdBlocks (Name, NextValue) SELECT %s, IFNULL(MAX({column}), 0) + 1 FROM {table}",
+    "UPDATE IdBlocks SET NextValue = NextValue + %d WHERE Name = %s RETURNING NextValue - %d",
+]
+
+
+class IdAllocator:
+    """
+    Hands out unique integer IDs for `table`.`column` from blocks leased out of the
+    IdBlocks counter table (hi/lo allocation). Only one round trip is made per block, and a
+    crashed process loses at most the unused part of its current block.
+    """
+
+    def __init__(self, table, column, block_size=None):
+        self.name = table
+        self.lease_block = LEASE_BLOCK.format(table=table, column=column)
+        self.lease_block_sqlite = [statement.format(table=table, column=column) for statement in LEASE_BLOCK_SQLITE]
+        if block_size is None:
+            block_size = int(os.getenv("IdBlockSize", "20"))
+        if block_size <= 0:
+            raise ValueError("Block size must be positive!")
+        self.block_size = block_size
+        self._next = 0
+        self._limit = 0
+        self._returned = []
+        self._lock = threading.Lock()
+
+    def next_id(self):
+        with self._lock:
+            if self._returned:
+                return self._returned.pop()
+            if self._next >= self._limit:
+                self._next = self._lease()
+                self._limit = self._next + self.block_size
+            new_id = self._next
+            self._next += 1
+            return new_id
+
+    # Give back an ID that was never used, so the next caller can have it
+    def release(self, unused_id):
+        with self._lock:
+            self._returned.append(unused_id)
+
+    # Lease `count` consecutive IDs on the caller's cursor, so the lease commits or rolls back
+    # with the caller's transaction; returns the first ID
+    def lease_range(self, count, cursor):
+        if ConnectionManager.dialect() == "sqlite":
+            cursor.execute(self.lease_block_sqlite[0], self.name)
+            cursor.execute(self.lease_block_sqlite[1], (count, self.name, count))
+        else:
+            cursor.execute(self.lease_block, (self.name, count))
+        return cursor.fetchone()[0]
+
+    def _lease(self):
+        with ConnectionManager() as conn:
+            start = self.lease_range(self.block_size, conn.cursor())
+            conn.commit()
+        return start
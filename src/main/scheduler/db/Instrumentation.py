@@ -0,0 +1,155 @@
+import time
+
+
+'''
+Hooks for observing database traffic. Listeners are notified when a connection is opened,
+when a statement executes or fails, when rows are fetched, and once a statement's results
+have been read. Connections are only wrapped while at least one listener is registered.
+util.Metrics registers one when it is imported unless Metrics=off, so the CLI and the server
+wrap every connection by default. The wrapper adds two clock reads and a call per listener
+to each statement and fetch, which is small next to a round trip. With Metrics=off and no
+tracer started, connections are handed out unwrapped.
+'''
+
+listeners = []
+
+
+class Listener:
+    # override the events of interest; these are called on the thread running the query
+    def connection_opened(self):
+        pass
+
+    def statement_executed(self, sql, params, seconds, rowcount):
+        pass
+
+    def statement_failed(self, sql, params, seconds, error):
+        pass
+
+    def rows_fetched(self, count):
+        pass
+
+    # after the last row was fetched, the next statement started or the connection was
+    # returned; seconds covers execute and fetch time, rows counts the rows read, or the
+    # rows affected for statements without a result set
+    def statement_finished(self, sql, params, seconds, rows):
+        pass
+
+
+def add_listener(listener):
+    listeners.append(listener)
+
+
+def remove_listener(listener):
+    listeners.remove(listener)
+
+
+# Wrap a connect callable so that listeners hear about every new connection
+def instrument_connect(connect):
+    def instrumented_connect():
+        conn = connect()
+        for listener in listeners:
+            listener.connection_opened()
+        return conn
+    return instrumented_connect
+
+
+def wrap(conn):
+    return InstrumentedConnection(conn) if listeners else conn
+
+
+# Report the statements still open on a connection handed out by wrap()
+def finish(conn):
+    if isinstance(conn, InstrumentedConnection):
+        conn.finish()
+
+
+class InstrumentedConnection:
+    def __init__(self, conn):
+        self._conn = conn
+        self._cursors = []
+
+    def cursor(self, *args, **kwargs):
+        cursor = InstrumentedCursor(self._conn.cursor(*args, **kwargs))
+        self._cursors.append(cursor)
+        return cursor
+
+    def finish(self):
+        for cursor in self._cursors:
+            cursor.finish()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class InstrumentedCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        # [sql, params, seconds, rows] of the statement whose results are being read
+        self._pending = None
+
+    def execute(self, sql, params=None):
+        self.finish()
+        start = time.perf_counter()
+        try:
+            if params is None:
+                result = self._cursor.execute(sql)
+            else:
+                result = self._cursor.execute(sql, params)
+        except Exception as e:
+            seconds = time.perf_counter() - start
+            for listener in listeners:
+                listener.statement_failed(sql, params, seconds, e)
+            raise
+        seconds = time.perf_counter() - start
+        rowcount = self._cursor.rowcount
+        for listener in listeners:
+            listener.statement_executed(sql, params, seconds, rowcount)
+        has_results = self._cursor.description is not None
+        self._pending = [sql, params, seconds, 0 if has_results else rowcount]
+        if not has_results:
+            self.finish()
+        return result
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._fetched(0 if row is None else 1, start, done=row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = self._cursor.fetchmany() if size is None else self._cursor.fetchmany(size)
+        self._fetched(len(rows), start, done=not rows)
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = self._cursor.fetchall()
+        self._fetched(len(rows), start, done=True)
+        return rows
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    def finish(self):
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            for listener in listeners:
+                listener.statement_finished(*pending)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def _fetched(self, count, start, done):
+        if self._pending is not None:
+            self._pending[2] += time.perf_counter() - start
+            self._pending[3] += count
+        if count:
+            for listener in listeners:
+                listener.rows_fetched(count)
+        if done:
+            self.finish()
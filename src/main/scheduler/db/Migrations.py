@@ -0,0 +1,341 @@
+import sqlite3
+import sys
+from db.ConnectionManager import ConnectionManager
+
+
+'''
+Versioned schema migrations.
+
+Every migration is numbered and written to be idempotent, so it is safe to re-run against a
+database that was created by hand or from an older create.sql. Applied versions are recorded
+in SchemaVersion. Run from the scheduler directory:
+
+    python -m db.Migrations status       list applied and pending migrations
+    python -m db.Migrations migrate      apply pending migrations
+    python -m db.Migrations check-plan   check the hot queries seek on the planned indexes,
+                                         on an in-memory SQLite copy of the schema
+'''
+
+CREATE_VERSION_TABLE = """
+IF OBJECT_ID('SchemaVersion', 'U') IS NULL
+    CREATE TABLE SchemaVersion (
+        Version int PRIMARY KEY,
+        Name varchar(255) NOT NULL,
+        AppliedAt datetime2 NOT NULL DEFAULT SYSUTCDATETIME()
+    );
+"""
+
+# Secondary indexes, one per WHERE / ORDER BY pattern the commands issue that the primary
+# keys don't already serve: (migration, name, table, key columns, included columns, query
+# served). Lookups by Username, apID and vaccine Name, and Availabilities by Time, use
+# primary keys.
+INDEX_PLAN = [
+    (4, "IX_Appointments_pUsername_apID", "Appointments", ("pUsername", "apID"), ("Time", "cUsername", "Name"),
+     "show_appointments for a patient: WHERE pUsername = ? AND apID > ? ORDER BY apID"),
+    (4, "IX_Appointments_cUsername_apID", "Appointments", ("cUsername", "apID"), ("Time", "pUsername", "Name"),
+     "show_appointments for a caregiver: WHERE cUsername = ? AND apID > ? ORDER BY apID"),
+    (5, "IX_Waitlist_Time_Priority", "Waitlist", ("Time", "Priority DESC", "WaitID"), ("pUsername", "Name"),
+     "waitlist for a date with new availability: WHERE Time = ? ORDER BY Priority DESC, WaitID"),
+    (5, "IX_Waitlist_Name_Priority", "Waitlist", ("Name", "Priority DESC", "WaitID"), ("Time", "pUsername"),
+     "waitlist for a vaccine with new doses: WHERE Name = ? ORDER BY Priority DESC, WaitID"),
+    (6, "IX_Appointments_Time", "Appointments", ("Time",), ("cUsername", "Name"),
+     "report: WHERE Time BETWEEN ? AND ?"),
+]
+
+
+def create_index_statement(name, table, columns, include):
+    statement = f"CREATE INDEX {name} ON {table} ({', '.join(columns)})"
+    if include:
+        statement += f" INCLUDE ({', '.join(include)})"
+    return f"IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = '{name}')\n    {statement};"
+
+
+# (version, name, statements); never edit a migration once it has shipped, add a new one
+MIGRATIONS = [
+    (1, "reconcile base tables", [
+        # older create.sql versions named the table Patient and the availability column Adminstrator
+        """
+        IF OBJECT_ID('Patient', 'U') IS NOT NULL AND OBJECT_ID('Patients', 'U') IS NULL
+            EXEC sp_rename 'Patient', 'Patients';
+        """,
+        """
+        IF COL_LENGTH('Availabilities', 'Adminstrator') IS NOT NULL AND COL_LENGTH('Availabilities', 'Username') IS NULL
+            EXEC sp_rename 'Availabilities.Adminstrator', 'Username', 'COLUMN';
+        """,
+        """
+        IF OBJECT_ID('Caregivers', 'U') IS NULL
+            CREATE TABLE Caregivers (
+                Username varchar(255),
+                Salt BINARY(16),
+                Hash BINARY(16),
+                PRIMARY KEY (Username)
+            );
+        """,
+        """
+        IF OBJECT_ID('Patients', 'U') IS NULL
+            CREATE TABLE Patients (
+                Username varchar(255),
+                Salt BINARY(16),
+                Hash BINARY(16),
+                PRIMARY KEY (Username)
+            );
+        """,
+        """
+        IF OBJECT_ID('Vaccines', 'U') IS NULL
+            CREATE TABLE Vaccines (
+                Name varchar(255),
+                Doses int,
+                PRIMARY KEY (Name)
+            );
+        """,
+        """
+        IF OBJECT_ID('Availabilities', 'U') IS NULL
+            CREATE TABLE Availabilities (
+                Time date,
+                Username varchar(255) REFERENCES Caregivers(Username) NOT NULL,
+                PRIMARY KEY (Time, Username)
+            );
+        """,
+        # every INSERT names its columns, so the column order of an existing table doesn't matter
+        """
+        IF OBJECT_ID('Appointments', 'U') IS NULL
+            CREATE TABLE Appointments (
+                apID int,
+                Time date,
+                cUsername varchar(255) REFERENCES Caregivers,
+                pUsername varchar(255) REFERENCES Patients,
+                Name varchar(255) REFERENCES Vaccines,
+                PRIMARY KEY (apID)
+            );
+        """,
+    ]),
+    (2, "password hash parameters", [
+        """
+        IF COL_LENGTH('Caregivers', 'Kdf') IS NULL
+            ALTER TABLE Caregivers ADD Kdf varchar(64);
+        """,
+        "ALTER TABLE Caregivers ALTER COLUMN Hash VARBINARY(64);",
+        """
+        IF COL_LENGTH('Patients', 'Kdf') IS NULL
+            ALTER TABLE Patients ADD Kdf varchar(64);
+        """,
+        "ALTER TABLE Patients ALTER COLUMN Hash VARBINARY(64);",
+    ]),
+    (3, "appointment ID blocks", [
+        """
+        IF OBJECT_ID('IdBlocks', 'U') IS NULL
+            CREATE TABLE IdBlocks (
+                Name varchar(255),
+                NextValue int NOT NULL,
+                PRIMARY KEY (Name)
+            );
+        """,
+    ]),
+    (4, "indexes for the command queries", [
+        create_index_statement(name, table, columns, include)
+        for version, name, table, columns, include, _ in INDEX_PLAN if version == 4
+    ]),
+    (5, "waitlist", [
+        # WaitID order is arrival order; higher Priority is served first
+        """
+        IF OBJECT_ID('Waitlist', 'U') IS NULL
+            CREATE TABLE Waitlist (
+                WaitID int IDENTITY(1, 1),
+                pUsername varchar(255) REFERENCES Patients NOT NULL,
+                Time date NOT NULL,
+                Name varchar(255) REFERENCES Vaccines NOT NULL,
+                Priority int NOT NULL DEFAULT 0,
+                CreatedAt datetime2 NOT NULL DEFAULT SYSUTCDATETIME(),
+                PRIMARY KEY (WaitID),
+                UNIQUE (pUsername, Time, Name)
+            );
+        """,
+    ] + [
+        create_index_statement(name, table, columns, include)
+        for version, name, table, columns, include, _ in INDEX_PLAN if version == 5
+    ]),
+    (6, "index for the utilization report", [
+        create_index_statement(name, table, columns, include)
+        for version, name, table, columns, include, _ in INDEX_PLAN if version == 6
+    ]),
+]
+
+
+def applied_versions(cursor):
+    # SQLite databases get their whole schema when the backend first connects
+    if ConnectionManager.dialect() != "sqlite":
+        cursor.execute(CREATE_VERSION_TABLE)
+    cursor.execute("SELECT Version FROM SchemaVersion")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def pending_migrations(applied):
+    return [migration for migration in MIGRATIONS if migration[0] not in applied]
+
+
+# Apply every pending migration, each in its own transaction; returns the versions applied
+def migrate():
+    done = []
+    with ConnectionManager() as conn:
+        cursor = conn.cursor()
+        applied = applied_versions(cursor)
+        conn.commit()
+        for version, name, statements in pending_migrations(applied):
+            for statement in statements:
+                cursor.execute(statement)
+            cursor.execute("INSERT INTO SchemaVersion (Version, Name) VALUES (%d, %s)", (version, name))
+            conn.commit()
+            done.append(version)
+    return done
+
+
+def status():
+    with ConnectionManager() as conn:
+        cursor = conn.cursor()
+        applied = applied_versions(cursor)
+        conn.commit()
+    return [(version, name, version in applied) for version, name, _ in MIGRATIONS]
+
+
+# The migrated schema for the SQLite backend, also used to check query plans. SQLite has no
+# INCLUDE, so included columns are appended to the index key, which keeps the indexes
+# covering. Add the SQLite form of every new migration here as well.
+SQLITE_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS Caregivers (Username varchar(255) PRIMARY KEY, Salt blob, Hash blob, "
+    "Kdf varchar(64))",
+    "CREATE TABLE IF NOT EXISTS Patients (Username varchar(255) PRIMARY KEY, Salt blob, Hash blob, Kdf varchar(64))",
+    "CREATE TABLE IF NOT EXISTS Vaccines (Name varchar(255) PRIMARY KEY, Doses int)",
+    "CREATE TABLE IF NOT EXISTS Availabilities (Time date, "
+    "Username varchar(255) NOT NULL REFERENCES Caregivers(Username), PRIMARY KEY (Time, Username))",
+    "CREATE TABLE IF NOT EXISTS Appointments (apID int PRIMARY KEY, Time date, "
+    "cUsername varchar(255) REFERENCES Caregivers, pUsername varchar(255) REFERENCES Patients, "
+    "Name varchar(255) REFERENCES Vaccines)",
+    "CREATE TABLE IF NOT EXISTS IdBlocks (Name varchar(255) PRIMARY KEY, NextValue int NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS Waitlist (WaitID integer PRIMARY KEY, "
+    "pUsername varchar(255) NOT NULL REFERENCES Patients, Time date NOT NULL, "
+    "Name varchar(255) NOT NULL REFERENCES Vaccines, Priority int NOT NULL DEFAULT 0, "
+    "CreatedAt timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP, UNIQUE (pUsername, Time, Name))",
+    "CREATE TABLE IF NOT EXISTS SchemaVersion (Version int PRIMARY KEY, Name varchar(255) NOT NULL, "
+    "AppliedAt timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP)",
+] + [
+    f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns + include)})"
+    for _, name, table, columns, include, _ in INDEX_PLAN
+]
+
+
+# Bring a SQLite database to the current schema; safe to run on every start
+def create_sqlite_schema(conn):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for statement in SQLITE_SCHEMA:
+            conn.execute(statement)
+        conn.executemany("INSERT OR IGNORE INTO SchemaVersion (Version, Name) VALUES (?, ?)",
+                         [(version, name) for version, name, _ in MIGRATIONS])
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+# The statements the commands run most, taken from the models as written, with sample
+# parameters: (description, statement, parameters[, plan steps accepted anyway]). The models
+# are imported here rather than at the top, since the SQLite backend imports this module
+# when it first connects.
+def hot_queries():
+    from db.IdAllocator import LEASE_BLOCK_SQLITE
+    from model import Appointment, Caregiver, CaregiverQueue, Patient, Vaccine
+    from model.Utilization import UtilizationReport
+    from model.Cancellation import Cancellation, LOCK_VACCINES, DELETE_APPOINTMENTS, REINSTATE_SLOTS
+    from model.Waitlist import Waitlist
+
+    day, later = "2024-01-01", "2024-02-01"
+    reserve = Appointment.RESERVE_SQLITE
+    by_id = Cancellation(apIDs=[1, 2]).conditions([1, 2])
+    by_caregiver_day = Cancellation(caregiver_username="c", start=day, end=day).conditions(None)
+    report_appointments, report_slots = UtilizationReport.queries("sqlite")
+    return [
+        ("login", Patient.GET_PATIENT, ("p",)),
+        ("username check (patient)", Patient.PATIENT_EXISTS, ("p",)),
+        ("username check (caregiver)", Caregiver.CAREGIVER_EXISTS, ("c",)),
+        ("search_caregiver_schedule", Caregiver.GET_AVAILABLE, (day,)),
+        # every stocked vaccine is listed for every date, and Vaccines holds a handful of brands
+        ("search_caregiver_schedule_range", Caregiver.GET_AVAILABILITY_SUMMARY, (day, later),
+         ("SCAN v", "USE TEMP B-TREE FOR ORDER BY")),
+        ("next_available", Caregiver.GET_NEXT_AVAILABLE, ("pfizer", day)),
+        ("vaccine lookup", Vaccine.GET_VACCINE, ("pfizer",)),
+        ("dose deltas", Vaccine.APPLY_DELTAS_SQLITE.format("(%s, %d), (%s, %d)"), ("moderna", 1, "pfizer", 1)),
+        ("caregiver queue load", CaregiverQueue.GET_LOADS, (day, day)),
+        ("reserve: lock vaccine", reserve["lock_vaccine"], ("pfizer",)),
+        ("reserve: waitlist entry", reserve["find_entry"], (1,)),
+        ("reserve: any slot", reserve["any_slot"], (day,)),
+        ("reserve: first slot", reserve["first_slot"], (day,)),
+        ("reserve: take slot", reserve["take_slot"], (day, "c")),
+        ("reserve: use dose", reserve["use_dose"], ("pfizer",)),
+        ("reserve: remove waitlist entry", reserve["remove_entry"], (1,)),
+        ("ID block lease", LEASE_BLOCK_SQLITE[1].format(table="Appointments", column="apID"),
+         (20, "Appointments", 20)),
+        ("show_appointments (patient)", Appointment.Appointment.page_query("patient"), (100, "p", 0)),
+        ("show_appointments (caregiver)", Appointment.Appointment.page_query("caregiver", True, True),
+         (100, "c", 0, day, later)),
+        ("waitlist by date", Waitlist.page_query(by_date=True), (50, day, day)),
+        ("waitlist by date, next page", Waitlist.page_query(by_date=True, after=True), (50, day, day, 0, 0, 1)),
+        ("waitlist by vaccine", Waitlist.page_query(by_vaccine=True), (50, day, "pfizer")),
+        ("cancel: lock vaccines", LOCK_VACCINES.format(by_id[0]), by_id[1]),
+        ("cancel: delete by ID", DELETE_APPOINTMENTS.format(by_id[0]), by_id[1]),
+        ("cancel_day/cancel_range: delete", DELETE_APPOINTMENTS.format(by_caregiver_day[0]), by_caregiver_day[1]),
+        ("cancel: reinstate slots", REINSTATE_SLOTS.format("(%s, %s)"), (day, "c")),
+        ("report: appointments", report_appointments, (day, day, later)),
+        ("report: slots", report_slots, (day, day, later)),
+    ]
+
+
+# EXPLAIN every hot query, translated the way the SQLite backend runs it, on an in-memory copy
+# of the schema; returns (query, plan, ok) where ok means every table is reached through an
+# index seek and no extra sort is needed. Scanning VALUES rows or the rows of a subquery the
+# plan has already computed is not a table scan.
+def check_plan():
+    from db.Backend import SqliteBackend
+    translator = SqliteBackend(":memory:")
+    conn = sqlite3.connect(":memory:", isolation_level=None)
+    create_sqlite_schema(conn)
+    conn.execute("ANALYZE")
+
+    results = []
+    for description, query, params, *accepted in hot_queries():
+        accepted = accepted[0] if accepted else ()
+        text, params = translator.translate(query, params)
+        plan = [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + text, params)]
+        computed = {step.split(" ", 1)[1] for step in plan if step.startswith(("CO-ROUTINE ", "MATERIALIZE "))}
+        ok = True
+        for step in plan:
+            if accepted and step.startswith(accepted):
+                continue
+            if step.startswith("SCAN "):
+                source = step[len("SCAN "):].split(" ")[0]
+                constant = step.endswith(("CONSTANT ROW", "CONSTANT ROWS"))
+                if not constant and not source.startswith("(subquery-") and source not in computed:
+                    ok = False
+            if "TEMP B-TREE" in step:
+                ok = False
+        results.append((description, plan, ok))
+    conn.close()
+    return results
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "status"
+    if command == "migrate":
+        applied = migrate()
+        print("Applied migration(s):", ", ".join(map(str, applied)) if applied else "none, already up to date")
+    elif command == "status":
+        for version, name, applied in status():
+            print(f"{version:4d}  {'applied' if applied else 'pending'}  {name}")
+    elif command == "check-plan":
+        failed = 0
+        for description, plan, ok in check_plan():
+            print(f"{'ok  ' if ok else 'FAIL'}  {description}: {'; '.join(plan)}")
+            failed += not ok
+        sys.exit(1 if failed else 0)
+    else:
+        print("usage: python -m db.Migrations [status|migrate|check-plan]")
+        sys.exit(2)
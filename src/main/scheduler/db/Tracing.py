@@ -0,0 +1,110 @@
+import contextvars
+import datetime
+import json
+import os
+import random
+from db import Instrumentation
+
+
+'''
+Opt-in statement tracing and a slow-query log.
+
+Once started, every statement run on a ConnectionManager connection is timed from execute
+until its last row is read. Statements slower than the threshold are written, one JSON
+object per line, to a size-rotated log with the SQL text, the shape of the parameters
+(never their values), the duration, the row count and the command that issued them.
+A sample rate below 1 keeps the log cheap enough to leave on in production.
+
+    TraceLog          log file; tracing is off unless this is set
+    TraceSlowMs       threshold in milliseconds (default 250, 0 logs every statement)
+    TraceSampleRate   fraction of slow statements logged (default 1.0)
+    TraceLogBytes     size at which the log rotates (default 10 MB)
+    TraceLogBackups   rotated files kept (default 5)
+'''
+
+# the Scheduler command running in the current context, set by run_command
+current_command = contextvars.ContextVar("current_command", default=None)
+
+
+# Describe parameters by type only, e.g. "(str, int, date)"; long batches are summarized
+def parameter_shape(params, limit=10):
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return "{" + ", ".join(f"{key}: {type(value).__name__}" for key, value in params.items()) + "}"
+    if not isinstance(params, (tuple, list)):
+        params = (params,)
+    names = [type(value).__name__ for value in params]
+    if len(names) <= limit:
+        return "(" + ", ".join(names) + ")"
+    counts = {}
+    for name in names:
+        counts[name] = counts.get(name, 0) + 1
+    return f"{len(names)} params (" + ", ".join(f"{name}: {count}" for name, count in counts.items()) + ")"
+
+
+class Tracer(Instrumentation.Listener):
+    def __init__(self, path, slow_ms=250, sample_rate=1.0, max_bytes=10 * 1024 * 1024, backups=5):
+        # logging is only imported when tracing is on, it is slow to load
+        import logging
+        import logging.handlers
+        self.slow_seconds = slow_ms / 1000
+        self.sample_rate = sample_rate
+        self.logger = logging.getLogger(f"scheduler.slow_queries.{path}")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups)
+        self.logger.addHandler(self.handler)
+
+    def statement_finished(self, sql, params, seconds, rows):
+        if seconds >= self.slow_seconds and (self.sample_rate >= 1 or random.random() < self.sample_rate):
+            self.write(sql, params, seconds, rows=rows)
+
+    def statement_failed(self, sql, params, seconds, error):
+        # failures are rare and always worth keeping
+        self.write(sql, params, seconds, error=f"{type(error).__name__}: {error}")
+
+    def write(self, sql, params, seconds, rows=None, error=None):
+        record = {
+            "time": datetime.datetime.now().isoformat(timespec="milliseconds"),
+            "command": current_command.get(),
+            "ms": round(seconds * 1000, 3),
+            "rows": rows,
+            "sql": " ".join(sql.split()),
+            "params": parameter_shape(params),
+        }
+        if error is not None:
+            record["error"] = error
+        self.logger.info(json.dumps(record))
+
+    def close(self):
+        self.logger.removeHandler(self.handler)
+        self.handler.close()
+
+
+tracer = None
+
+
+# Start tracing with the TraceLog* settings unless given explicitly; returns the tracer,
+# or None when no log file is configured
+def start(path=None, slow_ms=None, sample_rate=None):
+    global tracer
+    path = path or os.getenv("TraceLog")
+    if not path:
+        return None
+    stop()
+    tracer = Tracer(path,
+                    slow_ms=slow_ms if slow_ms is not None else float(os.getenv("TraceSlowMs", "250")),
+                    sample_rate=sample_rate if sample_rate is not None else float(os.getenv("TraceSampleRate", "1.0")),
+                    max_bytes=int(os.getenv("TraceLogBytes", str(10 * 1024 * 1024))),
+                    backups=int(os.getenv("TraceLogBackups", "5")))
+    Instrumentation.add_listener(tracer)
+    return tracer
+
+
+def stop():
+    global tracer
+    if tracer is not None:
+        Instrumentation.remove_listener(tracer)
+        tracer.close()
+        tracer = None
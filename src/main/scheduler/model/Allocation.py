@@ -0,0 +1,219 @@
+import collections
+import datetime
+import heapq
+from db.ConnectionManager import ConnectionManager
+from db import Batch
+from model.Appointment import appointment_ids
+from model.Caregiver import Caregiver
+from model.CaregiverQueue import caregiver_queue
+from model.Vaccine import Vaccine
+
+
+# reasons a request goes unmet
+DUPLICATE = "duplicate request for this patient"
+UNKNOWN_PATIENT = "unknown patient"
+UNKNOWN_VACCINE = "this facility does not carry that vaccine"
+NO_DOSES = "not enough doses"
+NO_CAREGIVER = "no caregiver free on the preferred dates"
+
+
+class AllocationRequest:
+    def __init__(self, line_no, patient_username, vaccine_name, dates):
+        self.line_no = line_no
+        self.patient_username = patient_username
+        self.vaccine_name = vaccine_name
+        self.dates = dates  # in order of preference
+        # filled in by the allocation
+        self.time = None
+        self.caregiver_username = None
+        self.apID = None
+        self.reason = None
+
+    def preference_rank(self):
+        return self.dates.index(self.time) if self.time is not None else None
+
+
+# Match requests to dates in one pass. Requests are served first come first served; each one
+# takes its most preferred date with a free slot, and when all of its dates are full, the
+# shortest chain of earlier requests that can move to another of their own dates is shifted
+# to make room (an augmenting path), so the number of patients served is maximal for the
+# order. capacity maps date -> free slots; doses maps vaccine -> doses on hand.
+def match_dates(requests, capacity, doses):
+    doses = dict(doses)
+    used = collections.Counter()
+    holders = collections.defaultdict(list)  # date -> requests placed on it
+
+    for request in requests:
+        if request.reason is not None:
+            continue
+        if request.vaccine_name not in doses:
+            request.reason = UNKNOWN_VACCINE
+            continue
+        if doses[request.vaccine_name] <= 0:
+            request.reason = NO_DOSES
+            continue
+        path = augmenting_path(request, capacity, used, holders)
+        if path is None:
+            request.reason = NO_CAREGIVER
+            continue
+        # every request on the chain moves onto its new date; the counts balance out
+        for moved, d in reversed(path):
+            if moved.time is not None:
+                holders[moved.time].remove(moved)
+                used[moved.time] -= 1
+            moved.time = d
+            holders[d].append(moved)
+            used[d] += 1
+        doses[request.vaccine_name] -= 1
+
+
+# Breadth-first search from request over preferred dates; returns [(request, date), ...] where
+# each request takes the date next to it, ending on a date with a free slot, or None
+def augmenting_path(request, capacity, used, holders):
+    # dates are tried in preference order, so a direct placement is always preferred
+    for d in request.dates:
+        if used[d] < capacity.get(d, 0):
+            return [(request, d)]
+
+    parent = {}  # date -> (request moved onto it, date that request leaves or None)
+    queue = collections.deque()
+    for d in request.dates:
+        if d not in parent and capacity.get(d, 0) > 0:
+            parent[d] = (request, None)
+            queue.append(d)
+    while queue:
+        full = queue.popleft()
+        for holder in holders[full]:
+            for d in holder.dates:
+                if d in parent or capacity.get(d, 0) == 0:
+                    continue
+                parent[d] = (holder, full)
+                if used[d] < capacity[d]:
+                    path = []
+                    while d is not None:
+                        moved, previous = parent[d]
+                        path.append((moved, d))
+                        d = previous
+                    return path
+                queue.append(d)
+    return None
+
+
+# Give every date's requests the least loaded free caregivers, earliest dates first, counting
+# each assignment towards the caregiver's load on later dates. slots maps
+# date -> [caregiver usernames]; loads maps caregiver -> appointments held.
+def assign_caregivers(requests, slots, loads):
+    loads = dict(loads)
+    by_date = collections.defaultdict(list)
+    for request in requests:
+        if request.time is not None:
+            by_date[request.time].append(request)
+    for d in sorted(by_date):
+        heap = [(loads.get(username, 0), username) for username in slots[d]]
+        heapq.heapify(heap)
+        for request in by_date[d]:
+            load, username = heapq.heappop(heap)
+            request.caregiver_username = username
+            loads[username] = load + 1
+
+
+class Allocation:
+    """
+    Allocates a clinic day's worth of requests in one transaction: the vaccine rows and the
+    free slots on every requested date are locked, the requests are matched to dates and
+    caregivers in memory, and the appointments, consumed slots and dose decrements are
+    written in bulk before the locks are released.
+    """
+
+    def __init__(self, requests):
+        self.requests = requests
+
+    def run(self):
+        requests = self.requests
+        seen = set()
+        for request in requests:
+            if request.patient_username in seen:
+                request.reason = DUPLICATE
+            seen.add(request.patient_username)
+        vaccine_names = sorted({request.vaccine_name for request in requests})
+        dates = sorted({d for request in requests for d in request.dates})
+        patients = sorted(seen)
+
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            # vaccines first, in the same order as reserve, so the two never deadlock
+            doses = {}
+            for chunk in Batch.chunks(vaccine_names):
+                cursor.execute("SELECT Name, Doses FROM Vaccines WITH (UPDLOCK, ROWLOCK) "
+                               "WHERE Name IN (" + ", ".join(["%s"] * len(chunk)) + ")", tuple(chunk))
+                doses.update({name: count for name, count in cursor.fetchall()})
+
+            known_patients = set()
+            for chunk in Batch.chunks(patients):
+                cursor.execute("SELECT Username FROM Patients WHERE Username IN (" +
+                               ", ".join(["%s"] * len(chunk)) + ")", tuple(chunk))
+                known_patients.update(row[0] for row in cursor.fetchall())
+            for request in requests:
+                if request.reason is None and request.patient_username not in known_patients:
+                    request.reason = UNKNOWN_PATIENT
+
+            # slots locked by a concurrent reservation are skipped rather than waited for
+            slots = collections.defaultdict(list)
+            loads = {}
+            get_slots = "SELECT a.Time, a.Username, (SELECT COUNT(*) FROM Appointments ap " \
+                        "WHERE ap.cUsername = a.Username AND ap.Time >= %s) " \
+                        "FROM Availabilities a WITH (UPDLOCK, READPAST, ROWLOCK) " \
+                        "JOIN (VALUES {}) AS d(Time) ON a.Time = CAST(d.Time AS date)"
+            for chunk in Batch.chunks(dates):
+                cursor.execute(get_slots.format(Batch.values_clause(len(chunk), "(%s)")),
+                               (datetime.date.today(),) + tuple(chunk))
+                for day, username, load in cursor.fetchall():
+                    slots[datetime.datetime(day.year, day.month, day.day)].append(username)
+                    loads[username] = load
+
+            match_dates(requests, {d: len(usernames) for d, usernames in slots.items()}, doses)
+            assign_caregivers(requests, slots, loads)
+            allocated = self.allocated()
+            if allocated:
+                self.write(cursor, allocated)
+            conn.commit()
+
+        for request in allocated:
+            Caregiver.invalidate_availability(request.time)
+            caregiver_queue.invalidate(request.time)
+        for vaccine_name in {request.vaccine_name for request in allocated}:
+            Vaccine.invalidate_cache(vaccine_name)
+        return self
+
+    def write(self, cursor, allocated):
+        first_apID = appointment_ids.lease_range(len(allocated), cursor)
+        for offset, request in enumerate(allocated):
+            request.apID = first_apID + offset
+
+        add_appointments = "INSERT INTO Appointments (apID, Time, cUsername, pUsername, Name) VALUES {}"
+        take_slots = "DELETE a FROM Availabilities a JOIN (VALUES {}) AS t(Time, Username) " \
+                     "ON a.Time = CAST(t.Time AS date) AND a.Username = t.Username"
+        # SQLite has no joined DELETE / UPDATE ... FROM with an alias target; match on row values
+        if ConnectionManager.dialect() == "sqlite":
+            take_slots = "DELETE FROM Availabilities WHERE (Time, Username) IN (VALUES {})"
+        for chunk in Batch.chunks(allocated):
+            cursor.execute(add_appointments.format(Batch.values_clause(len(chunk), "(%d, %s, %s, %s, %s)")),
+                           Batch.flatten((request.apID, request.time, request.caregiver_username,
+                                          request.patient_username, request.vaccine_name) for request in chunk))
+            cursor.execute(take_slots.format(Batch.values_clause(len(chunk), "(%s, %s)")),
+                           Batch.flatten((request.time, request.caregiver_username) for request in chunk))
+
+        used_doses = collections.Counter(request.vaccine_name for request in allocated)
+        take_doses = "UPDATE v SET Doses = v.Doses - u.Used FROM Vaccines v " \
+                     "JOIN (VALUES {}) AS u(Name, Used) ON v.Name = u.Name"
+        if ConnectionManager.dialect() == "sqlite":
+            take_doses = "UPDATE Vaccines SET Doses = Doses - u.Used " \
+                         "FROM (VALUES {}) AS u(Name, Used) WHERE Vaccines.Name = u.Name"
+        for chunk in Batch.chunks(sorted(used_doses.items())):
+            cursor.execute(take_doses.format(Batch.values_clause(len(chunk), "(%s, %d)")), Batch.flatten(chunk))
+
+    def allocated(self):
+        return [request for request in self.requests if request.time is not None]
+
+    def unmet(self):
+        return [request for request in self.requests if request.time is None]
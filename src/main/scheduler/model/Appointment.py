@@ -0,0 +1,258 @@
+import asyncio
+from db.ConnectionManager import ConnectionManager
+from db import AsyncDatabase
+from db.IdAllocator import IdAllocator
+from model.Caregiver import Caregiver
+from model.CaregiverQueue import caregiver_queue
+from model.Vaccine import Vaccine
+
+
+# result codes of the reservation batch
+RESERVED = 0
+UNKNOWN_VACCINE = 1
+NO_DOSES = 2
+NO_CAREGIVER = 3
+ALREADY_SERVED = 4
+
+# Books one appointment in a single round trip. The vaccine row is locked first so that
+# reservations for the same vaccine queue up behind each other instead of both taking the
+# last dose; the caregiver slot is claimed with READPAST so concurrent reservations skip
+# slots another transaction is already taking; the slot is removed from Availabilities so
+# that it can never be handed out twice. The caregiver proposed by caregiver_queue is taken
+# when still free, any other free caregiver otherwise. The appointment ID comes from
+# appointment_ids. A reservation made for a waitlist entry removes the entry in the same
+# transaction, and is abandoned when another process has served the entry already.
+RESERVE_BATCH = """
+SET NOCOUNT ON;
+SET XACT_ABORT ON;
+DECLARE @Time date = %s;
+DECLARE @Patient varchar(255) = %s;
+DECLARE @Vaccine varchar(255) = %s;
+DECLARE @apID int = %d;
+DECLARE @Preferred varchar(255) = %s;
+DECLARE @WaitID int = %s;
+DECLARE @Status int = 0, @Doses int, @Caregiver varchar(255);
+DECLARE @Taken TABLE (Username varchar(255));
+
+BEGIN TRANSACTION;
+
+SELECT @Doses = Doses FROM Vaccines WITH (UPDLOCK, ROWLOCK) WHERE Name = @Vaccine;
+
+IF @WaitID IS NOT NULL AND NOT EXISTS (SELECT 1 FROM Waitlist WITH (UPDLOCK, ROWLOCK) WHERE WaitID = @WaitID)
+    SET @Status = 4;
+ELSE IF @Doses IS NULL OR @Doses < 1
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM Availabilities WHERE Time = @Time)
+        SET @Status = 3;
+    ELSE IF @Doses IS NULL
+        SET @Status = 1;
+    ELSE
+        SET @Status = 2;
+END
+ELSE
+BEGIN
+    IF @Preferred IS NOT NULL
+        DELETE FROM Availabilities WITH (READPAST, ROWLOCK) OUTPUT deleted.Username INTO @Taken
+        WHERE Time = @Time AND Username = @Preferred;
+    IF NOT EXISTS (SELECT 1 FROM @Taken)
+    BEGIN
+        ;WITH Slot AS (
+            SELECT TOP (1) Username FROM Availabilities WITH (UPDLOCK, READPAST, ROWLOCK)
+            WHERE Time = @Time ORDER BY Username
+        )
+        DELETE FROM Slot OUTPUT deleted.Username INTO @Taken;
+    END
+    SELECT @Caregiver = Username FROM @Taken;
+    IF @Caregiver IS NULL
+        SET @Status = 3;
+END
+
+IF @Status = 0
+BEGIN
+    INSERT INTO Appointments (apID, Time, cUsername, pUsername, Name)
+        VALUES (@apID, @Time, @Caregiver, @Patient, @Vaccine);
+    UPDATE Vaccines SET Doses = Doses - 1 WHERE Name = @Vaccine;
+    IF @WaitID IS NOT NULL
+        DELETE FROM Waitlist WHERE WaitID = @WaitID;
+    COMMIT TRANSACTION;
+END
+ELSE
+    ROLLBACK TRANSACTION;
+
+SELECT @Status AS Status, @Caregiver AS Caregiver;
+"""
+
+
+
+# The statements of the reservation batch for SQLite, which has no procedural batches
+RESERVE_SQLITE = {
+    "lock_vaccine": "SELECT Doses FROM Vaccines WITH (UPDLOCK, ROWLOCK) WHERE Name = %s",
+    "find_entry": "SELECT 1 AS Found FROM Waitlist WHERE WaitID = %d",
+    "any_slot": "SELECT 1 AS Found FROM Availabilities WHERE Time = %s",
+    "first_slot": "SELECT TOP (1) Username FROM Availabilities WHERE Time = %s ORDER BY Username",
+    "take_slot": "DELETE FROM Availabilities WHERE Time = %s AND Username = %s",
+    "add_appointment": "INSERT INTO Appointments (apID, Time, cUsername, pUsername, Name) VALUES (%d, %s, %s, %s, %s)",
+    "use_dose": "UPDATE Vaccines SET Doses = Doses - 1 WHERE Name = %s",
+    "remove_entry": "DELETE FROM Waitlist WHERE WaitID = %d",
+}
+
+
+# The reservation batch for SQLite: the same steps issued one by one on a single connection.
+# The lock hint on the first statement opens the transaction with the database write lock,
+# which serializes reservations the way the vaccine row lock does.
+def reserve_sqlite(cursor, time, patient, vaccine, apID, preferred, wait_id):
+    cursor.execute(RESERVE_SQLITE["lock_vaccine"], vaccine)
+    row = cursor.fetchone()
+    doses = row['Doses'] if row is not None else None
+    if wait_id is not None:
+        cursor.execute(RESERVE_SQLITE["find_entry"], wait_id)
+        if cursor.fetchone() is None:
+            return {'Status': ALREADY_SERVED, 'Caregiver': None}
+    if doses is None or doses < 1:
+        cursor.execute(RESERVE_SQLITE["any_slot"], time)
+        if cursor.fetchone() is None:
+            return {'Status': NO_CAREGIVER, 'Caregiver': None}
+        return {'Status': UNKNOWN_VACCINE if doses is None else NO_DOSES, 'Caregiver': None}
+
+    caregiver = None
+    if preferred is not None:
+        cursor.execute(RESERVE_SQLITE["take_slot"], (time, preferred))
+        if cursor.rowcount > 0:
+            caregiver = preferred
+    if caregiver is None:
+        cursor.execute(RESERVE_SQLITE["first_slot"], time)
+        row = cursor.fetchone()
+        if row is None:
+            return {'Status': NO_CAREGIVER, 'Caregiver': None}
+        caregiver = row['Username']
+        cursor.execute(RESERVE_SQLITE["take_slot"], (time, caregiver))
+
+    cursor.execute(RESERVE_SQLITE["add_appointment"], (apID, time, caregiver, patient, vaccine))
+    cursor.execute(RESERVE_SQLITE["use_dose"], vaccine)
+    if wait_id is not None:
+        cursor.execute(RESERVE_SQLITE["remove_entry"], wait_id)
+    return {'Status': RESERVED, 'Caregiver': caregiver}
+
+
+appointment_ids = IdAllocator("Appointments", "apID")
+
+
+class ReservationError(ValueError):
+    # status is the result code of the reservation batch; the message is shown to the user
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Appointment:
+    def __init__(self, time, patient_username, vaccine_name, apID=None, caregiver_username=None):
+        self.apID = apID
+        self.time = time
+        self.patient_username = patient_username
+        self.caregiver_username = caregiver_username
+        self.vaccine_name = vaccine_name
+
+    def get_apID(self):
+        return self.apID
+
+    def get_caregiver_username(self):
+        return self.caregiver_username
+
+    # Reserve a caregiver slot and a dose, and record the appointment, in one transaction;
+    # wait_id names the waitlist entry being served, if any
+    def reserve(self, wait_id=None):
+        return self.book(appointment_ids.next_id(), caregiver_queue.propose(self.time), wait_id)
+
+    # reserve(), with the appointment ID and the caregiver proposal - each of which may need
+    # a query - fetched concurrently
+    async def reserve_async(self, wait_id=None):
+        apID, proposed = await asyncio.gather(AsyncDatabase.run(appointment_ids.next_id),
+                                              AsyncDatabase.run(caregiver_queue.propose, self.time),
+                                              return_exceptions=True)
+        if isinstance(apID, BaseException) or isinstance(proposed, BaseException):
+            # hand back whichever half succeeded
+            if not isinstance(apID, BaseException):
+                appointment_ids.release(apID)
+            if not isinstance(proposed, BaseException):
+                caregiver_queue.restore(self.time, proposed)
+            raise apID if isinstance(apID, BaseException) else proposed
+        return await AsyncDatabase.run(self.book, apID, proposed, wait_id)
+
+    # Book the appointment under apID, preferring caregiver proposed
+    def book(self, apID, proposed, wait_id=None):
+        try:
+            with ConnectionManager() as conn:
+                cursor = conn.cursor(as_dict=True)
+                if ConnectionManager.dialect() == "sqlite":
+                    result = reserve_sqlite(cursor, self.time, self.patient_username, self.vaccine_name, apID,
+                                            proposed, wait_id)
+                    if result['Status'] == RESERVED:
+                        conn.commit()
+                    else:
+                        conn.rollback()
+                else:
+                    cursor.execute(RESERVE_BATCH, (self.time, self.patient_username, self.vaccine_name, apID,
+                                                   proposed, wait_id))
+                    result = cursor.fetchone()
+                    conn.commit()
+        except BaseException:
+            caregiver_queue.restore(self.time, proposed)
+            raise
+
+        status = result['Status']
+        if status != RESERVED:
+            # the batch rolled back, so the ID was never written and the slot is still free
+            appointment_ids.release(apID)
+            caregiver_queue.restore(self.time, proposed)
+        if status == NO_CAREGIVER:
+            caregiver_queue.invalidate(self.time)
+        if status == UNKNOWN_VACCINE:
+            raise ReservationError(status, "This facility does not carry that brand of vaccines. Please try again!")
+        elif status == NO_DOSES:
+            raise ReservationError(status, "Not enough available doses!")
+        elif status == NO_CAREGIVER:
+            raise ReservationError(status, "No Caregiver is available!")
+        elif status == ALREADY_SERVED:
+            raise ReservationError(status, "This waitlist entry has already been served!")
+        Vaccine.invalidate_cache(self.vaccine_name)
+        Caregiver.invalidate_availability(self.time)
+        caregiver_queue.booked(self.time, result['Caregiver'])
+        self.apID = apID
+        self.caregiver_username = result['Caregiver']
+        return self
+
+    # Stream the appointments of a patient (role "patient") or caregiver (role "caregiver") in
+    # apID order, optionally limited to dates start..end and one vaccine. Pages are fetched with
+    # keyset pagination on apID, so memory stays constant however long the history is.
+    @staticmethod
+    def find_for_user(role, username, start=None, end=None, vaccine_name=None, page_size=100):
+        filters = [value for value in (start, end, vaccine_name) if value is not None]
+        get_page = Appointment.page_query(role, start is not None, end is not None, vaccine_name is not None)
+
+        last_apID = 0
+        while True:
+            with ConnectionManager() as conn:
+                cursor = conn.cursor(as_dict=True)
+                cursor.execute(get_page, (page_size, username, last_apID) + tuple(filters))
+                rows = cursor.fetchall()
+            for row in rows:
+                yield Appointment(row['Time'], row['pUsername'], row['Name'], apID=row['apID'],
+                                  caregiver_username=row['cUsername'])
+            if len(rows) < page_size:
+                return
+            last_apID = rows[-1]['apID']
+
+    # The statement fetching a page for find_for_user(); parameters are the page size, the
+    # username, the last apID seen and then the start, end and vaccine filters that are set
+    @staticmethod
+    def page_query(role, by_start=False, by_end=False, by_vaccine=False):
+        user_column = "pUsername" if role == "patient" else "cUsername"
+        conditions = [user_column + " = %s", "apID > %d"]
+        for condition, used in (("Time >= %s", by_start), ("Time <= %s", by_end), ("Name = %s", by_vaccine)):
+            if used:
+                conditions.append(condition)
+        return "SELECT TOP (%d) apID, Time, cUsername, pUsername, Name FROM Appointments " \
+               "WHERE " + " AND ".join(conditions) + " ORDER BY apID"
+
+    def __str__(self):
+        return f"(Appointment ID: {self.apID}, Caregiver username: {self.caregiver_username})"
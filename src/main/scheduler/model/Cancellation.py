@@ -0,0 +1,108 @@
+import collections
+import datetime
+from db.ConnectionManager import ConnectionManager
+from db import Batch
+from model.Appointment import Appointment
+from model.Caregiver import Caregiver
+from model.CaregiverQueue import caregiver_queue
+from model.Vaccine import Vaccine
+
+
+# vaccines first, in name order like reserve, so the two never deadlock
+LOCK_VACCINES = "SELECT Name FROM Vaccines WITH (UPDLOCK, ROWLOCK) " \
+                "WHERE Name IN (SELECT Name FROM Appointments WHERE {}) ORDER BY Name"
+DELETE_APPOINTMENTS = "DELETE FROM Appointments " \
+                      "OUTPUT deleted.apID, deleted.Time, deleted.cUsername, deleted.pUsername, deleted.Name " \
+                      "WHERE {}"
+REINSTATE_SLOTS = "INSERT INTO Availabilities (Time, Username) " \
+                  "SELECT t.Time, t.Username FROM (VALUES {}) AS t(Time, Username) " \
+                  "WHERE NOT EXISTS (SELECT 1 FROM Availabilities a " \
+                  "WHERE a.Time = CAST(t.Time AS date) AND a.Username = t.Username)"
+
+
+class Cancellation:
+    """
+    Cancels any number of appointments in one transaction with a fixed number of set-based
+    statements, however many rows match: the vaccine rows involved are locked, the
+    appointments are deleted with their details returned, each vaccine gets its doses back
+    in one update and the caregivers' slots are reinstated in one insert.
+
+    The appointments are those matching every filter given: apIDs (a list), caregiver and
+    patient usernames, and dates start..end. The usernames double as ownership checks.
+    With reinstate=False the slots are withdrawn instead of reinstated, e.g. when the
+    caregiver will not be in.
+    """
+
+    def __init__(self, apIDs=None, caregiver_username=None, patient_username=None, start=None, end=None,
+                 reinstate=True):
+        if apIDs is None and start is None and end is None:
+            raise ValueError("Choose the appointments by ID or by date!")
+        self.apIDs = apIDs
+        self.caregiver_username = caregiver_username
+        self.patient_username = patient_username
+        self.start = start
+        self.end = end
+        self.reinstate = reinstate
+        # filled in by run()
+        self.cancelled = []
+        self.restored_doses = {}
+        self.reinstated = 0
+
+    def conditions(self, apIDs):
+        conditions = []
+        params = []
+        if apIDs is not None:
+            conditions.append("apID IN (" + ", ".join(["%d"] * len(apIDs)) + ")")
+            params += apIDs
+        for condition, value in (("cUsername = %s", self.caregiver_username),
+                                 ("pUsername = %s", self.patient_username),
+                                 ("Time >= %s", self.start), ("Time <= %s", self.end)):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        return " AND ".join(conditions), tuple(params)
+
+    def run(self):
+        rows = []
+        id_chunks = Batch.chunks(sorted(set(self.apIDs))) if self.apIDs is not None else [None]
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            for chunk in id_chunks:
+                where, params = self.conditions(chunk)
+                cursor.execute(LOCK_VACCINES.format(where), params)
+                cursor.fetchall()
+                cursor.execute(DELETE_APPOINTMENTS.format(where), params)
+                rows += cursor.fetchall()
+
+            # Appointments references Vaccines, so every vaccine is there to give doses back to
+            self.restored_doses = collections.Counter(name for _, _, _, _, name in rows)
+            Vaccine.apply_deltas(cursor, self.restored_doses)
+
+            if self.reinstate:
+                slots = sorted({(day, caregiver) for _, day, caregiver, _, _ in rows})
+                for chunk in Batch.chunks(slots):
+                    cursor.execute(REINSTATE_SLOTS.format(Batch.values_clause(len(chunk), "(%s, %s)")),
+                                   Batch.flatten(chunk))
+                    self.reinstated += cursor.rowcount
+            conn.commit()
+
+        for apID, day, caregiver, patient, name in rows:
+            time = datetime.datetime(day.year, day.month, day.day)
+            self.cancelled.append(Appointment(time, patient, name, apID=apID, caregiver_username=caregiver))
+        for d in self.dates():
+            Caregiver.invalidate_availability(d)
+            caregiver_queue.invalidate(d)
+        caregiver_queue.released(collections.Counter(appointment.caregiver_username
+                                                     for appointment in self.cancelled))
+        for name in self.restored_doses:
+            Vaccine.invalidate_cache(name)
+        return self
+
+    # the dates that had appointments cancelled
+    def dates(self):
+        return sorted({appointment.time for appointment in self.cancelled})
+
+    # requested IDs that were not cancelled: unknown, or not the caller's
+    def missing(self):
+        cancelled = {appointment.apID for appointment in self.cancelled}
+        return [apID for apID in self.apIDs or () if apID not in cancelled]
@@ -1,47 +1,96 @@
-import sys
-sys.path.append("../util/*")
-sys.path.append("../db/*")
 from model.Patient import Patient
-from util.Util import Util
+from util.Util import Util, LEGACY_KDF
 from db.ConnectionManager import ConnectionManager
-import pymssql
+from db import AsyncDatabase
+from db import Batch
+from util.Cache import Cache
+from model.CaregiverQueue import caregiver_queue
+
+# usernames known to be taken; only positive answers are kept, since a username that is
+# free now may be taken by another process at any moment
+caregiver_username_cache = Cache("caregiver_usernames")
+# date -> usernames of the caregivers with a free slot that day
+availability_cache = Cache("availability")
+
+# every column, so that databases not yet migrated to the Kdf column can still log in
+GET_CAREGIVER = "SELECT * FROM Caregivers WHERE Username = %s"
+CAREGIVER_EXISTS = "SELECT Username FROM Caregivers WHERE Username = %s"
+GET_AVAILABLE = "SELECT Time, Username FROM Availabilities WHERE Time = %s ORDER BY Username"
+# per date in a range: the free caregivers and the usable doses of every vaccine; the range
+# seek uses the (Time, Username) primary key
+GET_AVAILABILITY_SUMMARY = "SELECT a.Time, a.Caregivers, v.Name, " \
+                           "CASE WHEN v.Doses < a.Caregivers THEN v.Doses ELSE a.Caregivers END AS Usable " \
+                           "FROM (SELECT Time, COUNT(*) AS Caregivers FROM Availabilities " \
+                           "WHERE Time BETWEEN %s AND %s GROUP BY Time) AS a " \
+                           "LEFT JOIN Vaccines v ON v.Doses > 0 " \
+                           "ORDER BY a.Time, v.Name"
+GET_NEXT_AVAILABLE = "SELECT TOP (1) a.Time, " \
+                     "(SELECT COUNT(*) FROM Availabilities c WHERE c.Time = a.Time) AS Caregivers, v.Doses " \
+                     "FROM Availabilities a JOIN Vaccines v ON v.Name = %s AND v.Doses > 0 " \
+                     "WHERE a.Time >= %s ORDER BY a.Time"
 
 
 class Caregiver:
-    def __init__(self, username, password=None, salt=None, hash=None):
+    def __init__(self, username, password=None, salt=None, hash=None, kdf=None):
         self.username = username
         self.password = password
         self.salt = salt
         self.hash = hash
+        self.kdf = kdf
 
     # getters
     def get(self):
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor(as_dict=True)
-
-        get_caregiver_details = "SELECT Salt, Hash FROM Caregivers WHERE Username = %s"
-        try:
-            cursor.execute(get_caregiver_details, self.username)
+        with ConnectionManager() as conn:
+            cursor = conn.cursor(as_dict=True)
+            cursor.execute(GET_CAREGIVER, self.username)
             for row in cursor:
                 curr_salt = row['Salt']
                 curr_hash = row['Hash']
-                calculated_hash = Util.generate_hash(self.password, curr_salt)
-                if not curr_hash == calculated_hash:
+                curr_kdf = row.get('Kdf')
+                if not Util.verify_password(self.password, curr_salt, curr_hash, curr_kdf):
                     # print("Incorrect password")
-                    cm.close_connection()
                     return None
                 else:
                     self.salt = curr_salt
-                    self.hash = calculated_hash
-                    cm.close_connection()
+                    self.hash = curr_hash
+                    self.kdf = curr_kdf
+                    # without the column the new parameters could not be recorded
+                    if 'Kdf' in row and Util.needs_rehash(curr_kdf):
+                        self.rehash(conn)
                     return self
-        except pymssql.Error as e:
-            raise e
-        finally:
-            cm.close_connection()
         return None
 
+    # awaitable get(), for running alongside other reads
+    async def get_async(self):
+        return await AsyncDatabase.run(self.get)
+
+    # Re-hash the password with the current KDF parameters after a successful login.
+    # The update only applies if the stored hash is still the one we verified against.
+    def rehash(self, conn):
+        kdf = Util.current_kdf()
+        salt, hash = Util.generate_salt_and_hash(self.password, kdf)
+        update_hash = "UPDATE Caregivers SET Salt = %s, Hash = %s, Kdf = %s WHERE Username = %s AND Hash = %s"
+        cursor = conn.cursor()
+        cursor.execute(update_hash, (salt, hash, kdf, self.username, self.hash))
+        conn.commit()
+        if cursor.rowcount == 1:
+            self.salt, self.hash, self.kdf = salt, hash, kdf
+
+    @staticmethod
+    def exists(username):
+        return caregiver_username_cache.get(username, lambda: Caregiver.load_exists(username), keep=bool)
+
+    @staticmethod
+    async def exists_async(username):
+        return await AsyncDatabase.run(Caregiver.exists, username)
+
+    @staticmethod
+    def load_exists(username):
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            cursor.execute(CAREGIVER_EXISTS, username)
+            return cursor.fetchone() is not None
+
     def get_username(self):
         return self.username
 
@@ -52,34 +101,106 @@ class Caregiver:
         return self.hash
 
     def save_to_db(self):
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor()
-
-        add_caregivers = "INSERT INTO Caregivers VALUES (%s, %s, %s)"
-        try:
-            cursor.execute(add_caregivers, (self.username, self.salt, self.hash))
+        add_caregivers = "INSERT INTO Caregivers (Username, Salt, Hash, Kdf) VALUES (%s, %s, %s, %s)"
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            cursor.execute(add_caregivers, (self.username, self.salt, self.hash, self.kdf or LEGACY_KDF))
             # you must call commit() to persist your data if you don't set autocommit to True
             conn.commit()
-        except pymssql.Error:
-            raise
-        finally:
-            cm.close_connection()
+
+    # Insert many caregivers in one transaction, skipping usernames that are already taken.
+    # Returns the number of caregivers inserted.
+    @staticmethod
+    def save_all_to_db(caregivers):
+        add_caregivers = "INSERT INTO Caregivers (Username, Salt, Hash, Kdf) " \
+                         "SELECT v.Username, v.Salt, v.Hash, v.Kdf FROM (VALUES {}) AS v(Username, Salt, Hash, Kdf) " \
+                         "WHERE NOT EXISTS (SELECT 1 FROM Caregivers t WITH (UPDLOCK, HOLDLOCK) WHERE t.Username = v.Username)"
+        inserted = 0
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            for chunk in Batch.chunks(caregivers):
+                rows = [(caregiver.username, caregiver.salt, caregiver.hash, caregiver.kdf or LEGACY_KDF) for caregiver in chunk]
+                statement = add_caregivers.format(Batch.values_clause(len(rows), "(%s, %s, %s, %s)"))
+                cursor.execute(statement, Batch.flatten(rows))
+                inserted += cursor.rowcount
+            conn.commit()
+        return inserted
+
+    # usernames of the caregivers with a free slot on date d
+    @staticmethod
+    def get_available(d):
+        return availability_cache.get(d, lambda: Caregiver.load_available(d))
+
+    @staticmethod
+    async def get_available_async(d):
+        return await AsyncDatabase.run(Caregiver.get_available, d)
+
+    @staticmethod
+    def load_available(d):
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            cursor.execute(GET_AVAILABLE, d)
+            return [row[1] for row in cursor.fetchall()]
+
+    # Per date in start..end that has free caregivers: (date, caregiver count, {vaccine: usable doses}).
+    # Usable doses of a vaccine on a date are capped by the number of free caregivers that day.
+    # One aggregated query.
+    @staticmethod
+    def get_availability_summary(start, end):
+        summary = []
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            cursor.execute(GET_AVAILABILITY_SUMMARY, (start, end))
+            for day, caregivers, vaccine_name, usable in cursor:
+                if not summary or summary[-1][0] != day:
+                    summary.append((day, caregivers, {}))
+                if vaccine_name is not None:
+                    summary[-1][2][vaccine_name] = usable
+        return summary
+
+    # The earliest date on or after d with a free caregiver while vaccine_name has doses left,
+    # as (date, caregiver count, doses), or None
+    @staticmethod
+    def find_next_available(vaccine_name, d):
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            cursor.execute(GET_NEXT_AVAILABLE, (vaccine_name, d))
+            row = cursor.fetchone()
+        return tuple(row) if row is not None else None
+
+    # Forget cached availability after a write; d None forgets every date
+    @staticmethod
+    def invalidate_availability(d=None):
+        availability_cache.invalidate(d)
 
     # Insert availability with parameter date d
     def upload_availability(self, d):
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor()
-
         add_availability = "INSERT INTO Availabilities VALUES (%s , %s)"
-        try:
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
             cursor.execute(add_availability, (d, self.username))
             # you must call commit() to persist your data if you don't set autocommit to True
             conn.commit()
-        except pymssql.Error:
-            # print("Error occurred when updating caregiver availability")
-            raise
-        finally:
-            cm.close_connection()
+        Caregiver.invalidate_availability(d)
+        caregiver_queue.invalidate(d)
 
+    # Insert availability for many dates in one transaction, skipping dates that are already
+    # uploaded. Returns the number of dates inserted and the number skipped.
+    def upload_availabilities(self, dates):
+        unique_dates = sorted(set(dates))
+        add_availabilities = "INSERT INTO Availabilities (Time, Username) " \
+                             "SELECT CAST(v.Time AS date), %s FROM (VALUES {}) AS v(Time) " \
+                             "WHERE NOT EXISTS (SELECT 1 FROM Availabilities a WITH (UPDLOCK, HOLDLOCK) " \
+                             "WHERE a.Time = CAST(v.Time AS date) AND a.Username = %s)"
+        inserted = 0
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            for chunk in Batch.chunks(unique_dates):
+                statement = add_availabilities.format(Batch.values_clause(len(chunk), "(%s)"))
+                cursor.execute(statement, (self.username,) + tuple(chunk) + (self.username,))
+                inserted += cursor.rowcount
+            conn.commit()
+        for d in unique_dates:
+            Caregiver.invalidate_availability(d)
+            caregiver_queue.invalidate(d)
+        return inserted, len(dates) - inserted
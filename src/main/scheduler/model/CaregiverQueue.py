@@ -0,0 +1,103 @@
+import datetime
+import heapq
+import threading
+from db.ConnectionManager import ConnectionManager
+from util.Cache import Cache
+
+
+# the free caregivers of a date with the appointments each holds from today on
+GET_LOADS = "SELECT a.Username, COUNT(ap.apID) FROM Availabilities a " \
+            "LEFT JOIN Appointments ap ON ap.cUsername = a.Username AND ap.Time >= %s " \
+            "WHERE a.Time = %s GROUP BY a.Username"
+
+
+class DateQueue:
+    # min-heap of (load, username) over the caregivers free on one date
+    def __init__(self, loads):
+        self.heap = [(load, username) for username, load in loads.items()]
+        heapq.heapify(self.heap)
+        # caregivers whose slot this process has not handed out yet
+        self.free = set(loads)
+
+
+class CaregiverQueue:
+    """
+    Chooses the caregiver for each booking so that work spreads evenly.
+
+    A caregiver's load is the number of appointments they hold from today on. Every date
+    has a min-heap of its free caregivers keyed by load; loads are shared between dates
+    and heap entries are corrected lazily when popped, so a pick is O(log n). The choice is
+    only a preference: the reservation batch falls back to any free slot when another
+    process took the proposed one, and queues are rebuilt from the database after the
+    cache TTL.
+    """
+
+    def __init__(self):
+        self.loads = {}
+        self.queues = Cache("caregiver_queues")
+        self._lock = threading.Lock()
+
+    def load_queue(self, d):
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            cursor.execute(GET_LOADS, (datetime.date.today(), d))
+            loads = {username: load for username, load in cursor.fetchall()}
+        with self._lock:
+            # fresher than anything counted in this process
+            self.loads.update(loads)
+        return DateQueue(loads)
+
+    # The least loaded caregiver still free on date d, or None when none are known.
+    # The caregiver is held back until booked() or restore() is called.
+    def propose(self, d):
+        queue = self.queues.get(d, lambda: self.load_queue(d))
+        with self._lock:
+            while queue.heap:
+                load, username = heapq.heappop(queue.heap)
+                if username not in queue.free:
+                    continue
+                current = self.loads.get(username, 0)
+                if current != load:
+                    # booked or cancelled on another date since this entry was pushed
+                    heapq.heappush(queue.heap, (current, username))
+                    continue
+                queue.free.discard(username)
+                return username
+        return None
+
+    # Record that the reservation for date d went to caregiver. A date whose queue is not
+    # cached is left alone; it is loaded with the booking already counted.
+    def booked(self, d, caregiver):
+        queue = self.queues.peek(d)
+        with self._lock:
+            self.loads[caregiver] = self.loads.get(caregiver, 0) + 1
+            # differs from the proposal when that slot was gone; then this one is still queued
+            if queue is not None:
+                queue.free.discard(caregiver)
+
+    # Record that `counts` maps caregiver -> appointments of theirs that were cancelled.
+    # Heap entries are only corrected upwards when popped, so a lower load would sit behind
+    # the stale one; every queue is rebuilt instead.
+    def released(self, counts):
+        with self._lock:
+            for username, count in counts.items():
+                if username in self.loads:
+                    self.loads[username] = max(0, self.loads[username] - count)
+        self.queues.invalidate()
+
+    # Put back a proposed caregiver whose reservation did not go through
+    def restore(self, d, username):
+        queue = self.queues.peek(d)
+        if username is None or queue is None:
+            return
+        with self._lock:
+            if username not in queue.free:
+                queue.free.add(username)
+                heapq.heappush(queue.heap, (self.loads.get(username, 0), username))
+
+    # Rebuild the queue for date d, or every queue, on next use
+    def invalidate(self, d=None):
+        self.queues.invalidate(d)
+
+
+caregiver_queue = CaregiverQueue()
@@ -1,46 +1,79 @@
-import sys
-sys.path.append("../util/*")
-sys.path.append("../db/*")
-from util.Util import Util
+from util.Util import Util, LEGACY_KDF
 from db.ConnectionManager import ConnectionManager
-import pymssql
+from db import AsyncDatabase
+from db import Batch
+from util.Cache import Cache
+
+# usernames known to be taken; only positive answers are kept, since a username that is
+# free now may be taken by another process at any moment
+patient_username_cache = Cache("patient_usernames")
+
+# every column, so that databases not yet migrated to the Kdf column can still log in
+GET_PATIENT = "SELECT * FROM Patients WHERE Username = %s"
+PATIENT_EXISTS = "SELECT Username FROM Patients WHERE Username = %s"
 
 
 class Patient:
-    def __init__(self, username, password=None, salt=None, hash=None):
+    def __init__(self, username, password=None, salt=None, hash=None, kdf=None):
         self.username = username
         self.password = password
         self.salt = salt
         self.hash = hash
+        self.kdf = kdf
 
     # getters
     def get(self):
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor(as_dict=True)
-
-        get_caregiver_details = "SELECT Salt, Hash FROM Patients WHERE Username = %s"
-        try:
-            cursor.execute(get_caregiver_details, self.username)
+        with ConnectionManager() as conn:
+            cursor = conn.cursor(as_dict=True)
+            cursor.execute(GET_PATIENT, self.username)
             for row in cursor:
                 curr_salt = row['Salt']
                 curr_hash = row['Hash']
-                calculated_hash = Util.generate_hash(self.password, curr_salt)
-                if not curr_hash == calculated_hash:
+                curr_kdf = row.get('Kdf')
+                if not Util.verify_password(self.password, curr_salt, curr_hash, curr_kdf):
                     # print("Incorrect password")
-                    cm.close_connection()
                     return None
                 else:
                     self.salt = curr_salt
-                    self.hash = calculated_hash
-                    cm.close_connection()
+                    self.hash = curr_hash
+                    self.kdf = curr_kdf
+                    # without the column the new parameters could not be recorded
+                    if 'Kdf' in row and Util.needs_rehash(curr_kdf):
+                        self.rehash(conn)
                     return self
-        except pymssql.Error as e:
-            raise e
-        finally:
-            cm.close_connection()
         return None
 
+    # awaitable get(), for running alongside other reads
+    async def get_async(self):
+        return await AsyncDatabase.run(self.get)
+
+    # Re-hash the password with the current KDF parameters after a successful login.
+    # The update only applies if the stored hash is still the one we verified against.
+    def rehash(self, conn):
+        kdf = Util.current_kdf()
+        salt, hash = Util.generate_salt_and_hash(self.password, kdf)
+        update_hash = "UPDATE Patients SET Salt = %s, Hash = %s, Kdf = %s WHERE Username = %s AND Hash = %s"
+        cursor = conn.cursor()
+        cursor.execute(update_hash, (salt, hash, kdf, self.username, self.hash))
+        conn.commit()
+        if cursor.rowcount == 1:
+            self.salt, self.hash, self.kdf = salt, hash, kdf
+
+    @staticmethod
+    def exists(username):
+        return patient_username_cache.get(username, lambda: Patient.load_exists(username), keep=bool)
+
+    @staticmethod
+    async def exists_async(username):
+        return await AsyncDatabase.run(Patient.exists, username)
+
+    @staticmethod
+    def load_exists(username):
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            cursor.execute(PATIENT_EXISTS, username)
+            return cursor.fetchone() is not None
+
     def get_username(self):
         return self.username
 
@@ -51,18 +84,29 @@ class Patient:
         return self.hash
 
     def save_to_db(self):
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor()
-
-        add_caregivers = "INSERT INTO Patients VALUES (%s, %s, %s)"
-        try:
-            cursor.execute(add_caregivers, (self.username, self.salt, self.hash))
+        add_caregivers = "INSERT INTO Patients (Username, Salt, Hash, Kdf) VALUES (%s, %s, %s, %s)"
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            cursor.execute(add_caregivers, (self.username, self.salt, self.hash, self.kdf or LEGACY_KDF))
             # you must call commit() to persist your data if you don't set autocommit to True
             conn.commit()
-        except pymssql.Error:
-            raise
-        finally:
-            cm.close_connection()
+
+    # Insert many patients in one transaction, skipping usernames that are already taken.
+    # Returns the number of patients inserted.
+    @staticmethod
+    def save_all_to_db(patients):
+        add_patients = "INSERT INTO Patients (Username, Salt, Hash, Kdf) " \
+                       "SELECT v.Username, v.Salt, v.Hash, v.Kdf FROM (VALUES {}) AS v(Username, Salt, Hash, Kdf) " \
+                       "WHERE NOT EXISTS (SELECT 1 FROM Patients t WITH (UPDLOCK, HOLDLOCK) WHERE t.Username = v.Username)"
+        inserted = 0
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            for chunk in Batch.chunks(patients):
+                rows = [(patient.username, patient.salt, patient.hash, patient.kdf or LEGACY_KDF) for patient in chunk]
+                statement = add_patients.format(Batch.values_clause(len(rows), "(%s, %s, %s, %s)"))
+                cursor.execute(statement, Batch.flatten(rows))
+                inserted += cursor.rowcount
+            conn.commit()
+        return inserted
     
 
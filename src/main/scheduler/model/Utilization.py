@@ -0,0 +1,176 @@
+import datetime
+import math
+from db.ConnectionManager import ConnectionManager
+
+try:
+    # optional; without it the same column arithmetic runs on plain lists
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# rows fetched per round trip of the bulk reads
+FETCH_ROWS = 10000
+# run-out dates further out than this are not projected
+RUN_OUT_HORIZON_DAYS = 3650
+
+
+# Column helpers: each takes and returns whole columns, as NumPy arrays when numpy is
+# installed and lists otherwise
+
+def column(values, dtype="int64"):
+    return numpy.fromiter(values, dtype=dtype) if numpy is not None else list(values)
+
+
+# counts[i] = occurrences of code i in codes, for i in range(length)
+def bincount(codes, length):
+    if numpy is not None:
+        return numpy.bincount(codes, minlength=length)
+    counts = [0] * length
+    for code in codes:
+        counts[code] += 1
+    return counts
+
+
+def plus(a, b):
+    return a + b if numpy is not None else [x + y for x, y in zip(a, b)]
+
+
+# element-wise a / b, 0 where b is 0
+def ratio(a, b):
+    if numpy is not None:
+        return numpy.divide(a, b, out=numpy.zeros(len(a)), where=b > 0)
+    return [x / y if y else 0.0 for x, y in zip(a, b)]
+
+
+# Code a column of names as small integers, names first then values in order of first
+# appearance; returns (codes, names by code). dict.fromkeys() and map() walk the column in C;
+# numpy.unique() would sort it, which measured several times slower.
+def factorize(values, names=None):
+    index = dict.fromkeys(names or [])
+    index.update(dict.fromkeys(values))
+    index = {name: code for code, name in enumerate(index)}
+    return column(map(index.__getitem__, values)), list(index)
+
+
+class UtilizationReport:
+    """
+    Utilization of the caregivers' slots over the days start..end, per day and per
+    caregiver, and the dose burn rate of every vaccine with the date its stock runs out.
+
+    A day's capacity is its booked appointments plus its open slots (a booked slot leaves
+    Availabilities), utilization is booked / capacity and free capacity is the open slots,
+    assuming every booked patient shows up. The burn rate is the vaccine's appointments in
+    the window per day of the window. Booked appointments have already taken their doses,
+    so the doses on hand last doses / rate days from the start of the window, or from today
+    once the window has begun.
+
+    Appointments and Availabilities are each read once, in bulk, as columns: dates arrive as
+    day offsets from start computed by the database and names are coded as small integers,
+    so every figure is a bincount or an element-wise operation over whole columns. Each
+    fetched chunk becomes arrays in one step when numpy is installed; what stays per row is
+    the driver building a Python tuple for it, which bounds how fast the rows can be read.
+    """
+
+    def __init__(self, start, end, today=None):
+        if end < start:
+            raise ValueError("The end date must not be before the start date!")
+        self.start = start
+        self.end = end
+        self.today = today or datetime.datetime.combine(datetime.date.today(), datetime.time())
+        self.days = [start + datetime.timedelta(days=i) for i in range((end - start).days + 1)]
+
+    # Read the rows of the query into one column per dtype: NumPy arrays converted a chunk
+    # at a time when numpy is installed, lists otherwise
+    @staticmethod
+    def read_columns(cursor, query, params, dtypes):
+        chunks = [[] for _ in dtypes]
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(FETCH_ROWS)
+            if not rows:
+                break
+            if numpy is None:
+                for values, row in zip(chunks, zip(*rows)):
+                    values.extend(row)
+                continue
+            block = numpy.array(rows, dtype=object).reshape(len(rows), len(dtypes))
+            for j, dtype in enumerate(dtypes):
+                chunks[j].append(block[:, j].astype(dtype))
+        if numpy is None:
+            return chunks
+        return [numpy.concatenate(values) if values else numpy.zeros(0, dtype=dtype)
+                for values, dtype in zip(chunks, dtypes)]
+
+    # The appointment and slot queries for the dialect, taking (start, start, end); both seek
+    # on an index by Time that covers the columns read
+    @staticmethod
+    def queries(dialect):
+        day_offset = "DATEDIFF(day, %s, Time)"
+        if dialect == "sqlite":
+            day_offset = "CAST(julianday(Time) - julianday(%s) AS INTEGER)"
+        get_appointments = "SELECT " + day_offset + ", cUsername, Name FROM Appointments " \
+                           "WHERE Time BETWEEN %s AND %s"
+        get_slots = "SELECT " + day_offset + ", Username FROM Availabilities WHERE Time BETWEEN %s AND %s"
+        return get_appointments, get_slots
+
+    def read(self):
+        get_appointments, get_slots = self.queries(ConnectionManager.dialect())
+        window = (self.start, self.start, self.end)
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            appointments = self.read_columns(cursor, get_appointments, window, ("int64", object, object))
+            slots = self.read_columns(cursor, get_slots, window, ("int64", object))
+            cursor.execute("SELECT Name, Doses FROM Vaccines ORDER BY Name")
+            vaccines = cursor.fetchall()
+        return appointments, slots, vaccines
+
+    def run(self):
+        (booked_days, booked_caregivers, booked_vaccines), (open_days, open_caregivers), vaccines = self.read()
+        day_count = len(self.days)
+
+        self.booked_by_day = bincount(booked_days, day_count)
+        self.open_by_day = bincount(open_days, day_count)
+        self.capacity_by_day = plus(self.booked_by_day, self.open_by_day)
+        self.utilization_by_day = ratio(self.booked_by_day, self.capacity_by_day)
+
+        booked_codes, self.caregivers = factorize(booked_caregivers)
+        open_codes, self.caregivers = factorize(open_caregivers, self.caregivers)
+        self.booked_by_caregiver = bincount(booked_codes, len(self.caregivers))
+        self.open_by_caregiver = bincount(open_codes, len(self.caregivers))
+        self.utilization_by_caregiver = ratio(self.booked_by_caregiver,
+                                              plus(self.booked_by_caregiver, self.open_by_caregiver))
+
+        self.vaccines = [name for name, _ in vaccines]
+        self.doses = column((doses for _, doses in vaccines))
+        # Appointments references Vaccines, so every code is one of self.vaccines
+        vaccine_codes, _ = factorize(booked_vaccines, self.vaccines)
+        self.burn_rate = [float(count) / day_count for count in bincount(vaccine_codes, len(self.vaccines))]
+        return self
+
+    # The date the doses on hand of vaccine i run out at its burn rate, or None if not within
+    # RUN_OUT_HORIZON_DAYS
+    def run_out(self, i):
+        if self.burn_rate[i] <= 0:
+            return None
+        days = self.doses[i] / self.burn_rate[i]
+        if days > RUN_OUT_HORIZON_DAYS:
+            return None
+        # the window's doses are already taken; the rest last from when the window starts
+        return max(self.today, self.start) + datetime.timedelta(days=math.floor(days))
+
+    def to_json(self):
+        return {
+            "start": f"{self.start:%Y-%m-%d}",
+            "end": f"{self.end:%Y-%m-%d}",
+            "days": [{"date": f"{d:%Y-%m-%d}", "booked": int(self.booked_by_day[i]),
+                      "free": int(self.open_by_day[i]), "utilization": float(self.utilization_by_day[i])}
+                     for i, d in enumerate(self.days)],
+            "caregivers": [{"username": username, "booked": int(self.booked_by_caregiver[i]),
+                            "free": int(self.open_by_caregiver[i]),
+                            "utilization": float(self.utilization_by_caregiver[i])}
+                           for i, username in enumerate(self.caregivers)],
+            "vaccines": [{"name": name, "doses": int(self.doses[i]), "burn_per_day": self.burn_rate[i],
+                          "runs_out": f"{self.run_out(i):%Y-%m-%d}" if self.run_out(i) is not None else None}
+                         for i, name in enumerate(self.vaccines)],
+        }
@@ -1,7 +1,19 @@
-import sys
-sys.path.append("../db/*")
 from db.ConnectionManager import ConnectionManager
-import pymssql
+from db import AsyncDatabase
+from db import Batch
+from util.Cache import Cache
+
+# vaccine name -> doses (None for unknown vaccines), and the full (name, doses) list
+vaccine_cache = Cache("vaccines")
+vaccine_list_cache = Cache("vaccine_list")
+
+GET_VACCINE = "SELECT Name, Doses FROM Vaccines WHERE Name = %s"
+# add a delta to the doses of each (Name, Delta) row unless that takes them below zero
+APPLY_DELTAS = "UPDATE v SET Doses = v.Doses + d.Delta OUTPUT inserted.Name, inserted.Doses " \
+               "FROM Vaccines v JOIN (VALUES {}) AS d(Name, Delta) ON v.Name = d.Name " \
+               "WHERE v.Doses + d.Delta >= 0"
+APPLY_DELTAS_SQLITE = "UPDATE Vaccines SET Doses = Doses + d.Delta FROM (VALUES {}) AS d(Name, Delta) " \
+                      "WHERE Vaccines.Name = d.Name AND Vaccines.Doses + d.Delta >= 0 RETURNING Name, Doses"
 
 
 class Vaccine:
@@ -10,24 +22,45 @@ class Vaccine:
         self.available_doses = available_doses
 
     # getters
-    def get(self):
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor()
-
-        get_vaccine = "SELECT Name, Doses FROM Vaccines WHERE Name = %s"
-        try:
-            cursor.execute(get_vaccine, self.vaccine_name)
+    # pass cached=False before a read-modify-write, so the write starts from the stored value
+    def get(self, cached=True):
+        doses = vaccine_cache.get(self.vaccine_name, self.load_doses) if cached else self.load_doses()
+        if doses is None:
+            return None
+        self.available_doses = doses
+        return self
+
+    def load_doses(self):
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            cursor.execute(GET_VACCINE, self.vaccine_name)
             for row in cursor:
-                self.available_doses = row[1]
-                return self
-        except pymssql.Error:
-            # print("Error occurred when getting Vaccine")
-            raise
-        finally:
-            cm.close_connection()
+                return row[1]
         return None
 
+    # all (name, doses) rows
+    @staticmethod
+    def get_all():
+        return vaccine_list_cache.get("all", Vaccine.load_all)
+
+    @staticmethod
+    async def get_all_async():
+        return await AsyncDatabase.run(Vaccine.get_all)
+
+    @staticmethod
+    def load_all():
+        get_vaccines = "SELECT Name, Doses FROM Vaccines"
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            cursor.execute(get_vaccines)
+            return [tuple(row) for row in cursor.fetchall()]
+
+    # Forget cached doses after a write; name None forgets every vaccine
+    @staticmethod
+    def invalidate_cache(name=None):
+        vaccine_cache.invalidate(name)
+        vaccine_list_cache.invalidate()
+
     def get_vaccine_name(self):
         return self.vaccine_name
 
@@ -38,62 +71,74 @@ class Vaccine:
         if self.available_doses is None or self.available_doses <= 0:
             raise ValueError("Argument cannot be negative!")
 
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor()
-
-        add_doses = "INSERT INTO VACCINES VALUES (%s, %d)"
-        try:
+        add_doses = "INSERT INTO Vaccines (Name, Doses) VALUES (%s, %d)"
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
             cursor.execute(add_doses, (self.vaccine_name, self.available_doses))
             # you must call commit() to persist your data if you don't set autocommit to True
             conn.commit()
-        except pymssql.Error:
-            # print("Error occurred when insert Vaccines")
-            raise
-        finally:
-            cm.close_connection()
-
-    # Increment the available doses
-    def increase_available_doses(self, num):
-        if num <= 0:
-            raise ValueError("Argument cannot be negative!")
-        self.available_doses += num
-
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor()
-
-        update_vaccine_availability = "UPDATE vaccines SET Doses = %d WHERE name = %s"
-        try:
-            cursor.execute(update_vaccine_availability, (self.available_doses, self.vaccine_name))
-            # you must call commit() to persist your data if you don't set autocommit to True
-            conn.commit()
-        except pymssql.Error:
-            # print("Error occurred when updating vaccine availability")
-            raise
-        finally:
-            cm.close_connection()
-
-    # Decrement the available doses
-    def decrease_available_doses(self, num):
-        if self.available_doses - num < 0:
-            ValueError("Not enough available doses!")
-        self.available_doses -= num
-
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor()
-
-        update_vaccine_availability = "UPDATE vaccines SET Doses = %d WHERE name = %s"
-        try:
-            cursor.execute(update_vaccine_availability, (self.available_doses, self.vaccine_name))
-            # you must call commit() to persist your data if you don't set autocommit to True
+        Vaccine.invalidate_cache(self.vaccine_name)
+
+    # Dose counts are only ever changed by deltas applied in the database, never by writing
+    # back a value computed here, so concurrent writers cannot lose each other's updates. A
+    # decrement is guarded by Doses >= n in the same statement; whether a change applied is
+    # read from the rows it affected, so no application-level locking is needed.
+
+    # Apply dose changes to many vaccines on the caller's cursor, as part of its transaction.
+    # `deltas` maps vaccine name -> doses to add (negative to take). Returns vaccine name ->
+    # new dose count, or None when a vaccine is unknown or short, and the caller must then
+    # roll back so that no change applies.
+    @staticmethod
+    def apply_deltas(cursor, deltas):
+        adjust = APPLY_DELTAS_SQLITE if ConnectionManager.dialect() == "sqlite" else APPLY_DELTAS
+        results = {}
+        # one statement per chunk, in name order so that concurrent batches lock rows alike
+        for chunk in Batch.chunks(sorted((name, delta) for name, delta in deltas.items() if delta != 0)):
+            cursor.execute(adjust.format(Batch.values_clause(len(chunk), "(%s, %d)")), Batch.flatten(chunk))
+            rows = cursor.fetchall()
+            if len(rows) != len(chunk):
+                return None
+            results.update({name: doses for name, doses in rows})
+        return results
+
+    # Add doses to many vaccines at once, creating the ones that don't exist yet.
+    # `deltas` maps vaccine name -> doses to add. All rows are upserted with set-based MERGE
+    # statements in one transaction; returns vaccine name -> (action, new dose count).
+    @staticmethod
+    def add_doses_in_bulk(deltas):
+        for num in deltas.values():
+            if num <= 0:
+                raise ValueError("Argument cannot be negative!")
+
+        upsert_vaccines = "MERGE Vaccines WITH (HOLDLOCK) AS t USING (VALUES {}) AS s(Name, Doses) " \
+                          "ON t.Name = s.Name " \
+                          "WHEN MATCHED THEN UPDATE SET t.Doses = t.Doses + s.Doses " \
+                          "WHEN NOT MATCHED THEN INSERT (Name, Doses) VALUES (s.Name, s.Doses) " \
+                          "OUTPUT $action, inserted.Name, inserted.Doses;"
+        # SQLite has no MERGE; the names that exist are read under the write lock instead
+        find_existing = "SELECT Name FROM Vaccines WITH (UPDLOCK) WHERE Name IN ({})"
+        upsert_vaccines_sqlite = "INSERT INTO Vaccines (Name, Doses) VALUES {} " \
+                                 "ON CONFLICT (Name) DO UPDATE SET Doses = Doses + excluded.Doses " \
+                                 "RETURNING Name, Doses"
+        results = {}
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            for chunk in Batch.chunks(sorted(deltas.items())):
+                if ConnectionManager.dialect() == "sqlite":
+                    cursor.execute(find_existing.format(", ".join(["%s"] * len(chunk))), tuple(name for name, _ in chunk))
+                    existing = {row[0] for row in cursor.fetchall()}
+                    cursor.execute(upsert_vaccines_sqlite.format(Batch.values_clause(len(chunk), "(%s, %d)")),
+                                   Batch.flatten(chunk))
+                    for name, doses in cursor.fetchall():
+                        results[name] = ("update" if name in existing else "insert", doses)
+                    continue
+                statement = upsert_vaccines.format(Batch.values_clause(len(chunk), "(%s, %d)"))
+                cursor.execute(statement, Batch.flatten(chunk))
+                for action, name, doses in cursor.fetchall():
+                    results[name] = (action.lower(), doses)
             conn.commit()
-        except pymssql.Error:
-            # print("Error occurred when updating vaccine availability")
-            raise
-        finally:
-            cm.close_connection()
+        Vaccine.invalidate_cache()
+        return results
 
     def __str__(self):
         return f"(Vaccine Name: {self.vaccine_name}, Available Doses: {self.available_doses})"
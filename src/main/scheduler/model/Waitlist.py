@@ -0,0 +1,147 @@
+import datetime
+from db.ConnectionManager import ConnectionManager
+from model.Appointment import Appointment, ReservationError, NO_CAREGIVER, NO_DOSES
+
+
+class Waitlist:
+    """
+    Reservations that could not be made yet, served in order of Priority (highest first)
+    and then arrival.
+
+    Whenever capacity is freed - availability uploaded for a date, doses added for a
+    vaccine, an appointment cancelled - fulfil() walks only the entries that capacity can
+    serve, through the (Time, Priority, WaitID) and (Name, Priority, WaitID) indexes, and
+    books them until the capacity runs out.
+    """
+
+    def __init__(self, wait_id, time, patient_username, vaccine_name, priority=0):
+        self.wait_id = wait_id
+        self.time = time
+        self.patient_username = patient_username
+        self.vaccine_name = vaccine_name
+        self.priority = priority
+
+    @staticmethod
+    def from_row(row):
+        # dates are keyed as datetimes everywhere else, like the parsed command input
+        day = row['Time']
+        return Waitlist(row['WaitID'], datetime.datetime(day.year, day.month, day.day), row['pUsername'],
+                        row['Name'], row['Priority'])
+
+    # Record a reservation that could not be made. Returns the number of entries ahead of it
+    # for that date, or None when the vaccine is unknown or the patient already has that
+    # appointment. Joining twice keeps the first place.
+    @staticmethod
+    def add(time, patient_username, vaccine_name):
+        add_entry = "INSERT INTO Waitlist (pUsername, Time, Name) " \
+                    "SELECT %s, %s, %s WHERE EXISTS (SELECT 1 FROM Vaccines WHERE Name = %s) " \
+                    "AND NOT EXISTS (SELECT 1 FROM Waitlist WITH (UPDLOCK, HOLDLOCK) " \
+                    "WHERE pUsername = %s AND Time = %s AND Name = %s) " \
+                    "AND NOT EXISTS (SELECT 1 FROM Appointments " \
+                    "WHERE pUsername = %s AND Time = %s AND Name = %s)"
+        get_position = "SELECT (SELECT COUNT(*) FROM Waitlist w WHERE w.Time = mine.Time " \
+                       "AND (w.Priority > mine.Priority OR (w.Priority = mine.Priority AND w.WaitID < mine.WaitID))) " \
+                       "FROM Waitlist mine WHERE mine.pUsername = %s AND mine.Time = %s AND mine.Name = %s"
+        key = (patient_username, time, vaccine_name)
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            cursor.execute(add_entry, key + (vaccine_name,) + key + key)
+            cursor.execute(get_position, key)
+            row = cursor.fetchone()
+            conn.commit()
+        return row[0] if row is not None else None
+
+    # Leave the waitlist; returns whether the patient was on it
+    @staticmethod
+    def remove(time, patient_username, vaccine_name):
+        remove_entry = "DELETE FROM Waitlist WHERE pUsername = %s AND Time = %s AND Name = %s"
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            cursor.execute(remove_entry, (patient_username, time, vaccine_name))
+            removed = cursor.rowcount
+            conn.commit()
+        return removed > 0
+
+    # The dates in start..end that anyone is waiting for; a seek on the (Time, ...) index
+    @staticmethod
+    def waiting_dates(start, end):
+        get_dates = "SELECT DISTINCT Time FROM Waitlist WHERE Time BETWEEN %s AND %s"
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            cursor.execute(get_dates, (start, end))
+            return {datetime.datetime(day.year, day.month, day.day) for day, in cursor.fetchall()}
+
+    # A patient's current entries, earliest date first
+    @staticmethod
+    def find_for_patient(patient_username):
+        get_entries = "SELECT WaitID, Time, pUsername, Name, Priority FROM Waitlist " \
+                      "WHERE pUsername = %s ORDER BY Time, WaitID"
+        with ConnectionManager() as conn:
+            cursor = conn.cursor(as_dict=True)
+            cursor.execute(get_entries, patient_username)
+            rows = cursor.fetchall()
+        return [Waitlist.from_row(row) for row in rows]
+
+    # Stream the waiting entries for date d or for vaccine_name in serving order, skipping
+    # past dates. Pages use keyset pagination on (Priority DESC, WaitID).
+    @staticmethod
+    def pending(d=None, vaccine_name=None, page_size=50):
+        params = [datetime.date.today()] + [value for value in (d, vaccine_name) if value is not None]
+        after = None
+        while True:
+            statement = Waitlist.page_query(d is not None, vaccine_name is not None, after is not None)
+            if after is None:
+                page_params = (page_size,) + tuple(params)
+            else:
+                page_params = (page_size,) + tuple(params) + (after[0], after[0], after[1])
+            with ConnectionManager() as conn:
+                cursor = conn.cursor(as_dict=True)
+                cursor.execute(statement, page_params)
+                rows = cursor.fetchall()
+            for row in rows:
+                yield Waitlist.from_row(row)
+            if len(rows) < page_size:
+                return
+            after = (rows[-1]['Priority'], rows[-1]['WaitID'])
+
+    # The statement fetching a page for pending(); parameters are the page size, today, then
+    # the date and vaccine filters that are set and, after the first page, the last
+    # (Priority, Priority, WaitID) seen
+    @staticmethod
+    def page_query(by_date=False, by_vaccine=False, after=False):
+        conditions = ["Time >= %s"]
+        if by_date:
+            conditions.append("Time = %s")
+        if by_vaccine:
+            conditions.append("Name = %s")
+        if after:
+            conditions.append("(Priority < %d OR (Priority = %d AND WaitID > %d))")
+        return "SELECT TOP (%d) WaitID, Time, pUsername, Name, Priority FROM Waitlist " \
+               "WHERE " + " AND ".join(conditions) + " ORDER BY Priority DESC, WaitID"
+
+    # Book waiting patients into capacity that was just freed on date d and/or for
+    # vaccine_name; stops as soon as that capacity is used up. Returns the appointments made.
+    @staticmethod
+    def fulfil(d=None, vaccine_name=None):
+        booked = []
+        full_dates = set()
+        empty_vaccines = set()
+        for entry in Waitlist.pending(d, vaccine_name):
+            if entry.time in full_dates or entry.vaccine_name in empty_vaccines:
+                continue
+            try:
+                booked.append(Appointment(entry.time, entry.patient_username, entry.vaccine_name)
+                              .reserve(wait_id=entry.wait_id))
+            except ReservationError as e:
+                if e.status == NO_CAREGIVER:
+                    if d is not None:
+                        break
+                    full_dates.add(entry.time)
+                elif e.status == NO_DOSES:
+                    if vaccine_name is not None:
+                        break
+                    empty_vaccines.add(entry.vaccine_name)
+        return booked
+
+    def __str__(self):
+        return f"(Waitlist ID: {self.wait_id}, Date: {self.time:%m-%d-%Y}, Vaccine: {self.vaccine_name})"
@@ -0,0 +1,86 @@
+import collections
+import os
+import threading
+import time
+
+
+# every cache by name, for reporting
+caches = {}
+
+
+class Cache:
+    """
+    A thread-safe read-through cache with LRU eviction and a time-to-live per entry.
+
+    Sizes and TTLs default to the CacheSize and CacheTtl environment variables; a TTL of 0
+    disables caching. Writers invalidate the keys they change, the TTL bounds how stale an
+    entry can get when another process does the writing.
+    """
+
+    def __init__(self, name, max_size=None, ttl=None):
+        self.name = name
+        self.max_size = max_size if max_size is not None else int(os.getenv("CacheSize", "1024"))
+        self.ttl = ttl if ttl is not None else float(os.getenv("CacheTtl", "30"))
+        self._entries = collections.OrderedDict()  # key -> (value, expires), least recently used first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # bumped by every invalidation, so a load that raced with a write is not stored
+        self._generation = 0
+        caches[name] = self
+
+    # Return the cached value for key, calling loader() to fill it on a miss.
+    # A loaded value is only kept when keep(value) is true, if keep is given.
+    def get(self, key, loader, keep=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self._generation
+
+        # load outside the lock so a slow query doesn't block every other reader
+        value = loader()
+        if self.ttl > 0 and (keep is None or keep(value)):
+            with self._lock:
+                if generation != self._generation:
+                    return value
+                self._entries[key] = (value, time.monotonic() + self.ttl)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    # The cached value for key, or None when it is not cached; never loads
+    def peek(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                return entry[0]
+        return None
+
+    # Drop one key, or everything when no key is given
+    def invalidate(self, key=None):
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
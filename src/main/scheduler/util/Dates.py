@@ -0,0 +1,56 @@
+import datetime
+
+
+WEEKDAYS = {"mon": 0, "tue": 1, "wed": 2, "thu": 3, "fri": 4, "sat": 5, "sun": 6}
+
+
+class Dates:
+    # parse a date in the mm-dd-yyyy format used by every command
+    def parse_date(token):
+        date_tokens = token.split("-")
+        if len(date_tokens) != 3:
+            raise ValueError("Dates must be in the format mm-dd-yyyy")
+        month = int(date_tokens[0])
+        day = int(date_tokens[1])
+        year = int(date_tokens[2])
+        return datetime.datetime(year, month, day)
+
+    # Expand start..end (inclusive) with a recurrence pattern:
+    #   daily, weekdays, weekends, a comma separated list of days (mon,wed,fri), or everyN (every N days)
+    def expand_range(start, end, pattern="daily"):
+        if end < start:
+            raise ValueError("The end date must not be before the start date!")
+
+        step = 1
+        days = set(range(7))
+        if pattern == "weekdays":
+            days = set(range(5))
+        elif pattern == "weekends":
+            days = {5, 6}
+        elif pattern.startswith("every"):
+            step = int(pattern[len("every"):])
+            if step <= 0:
+                raise ValueError("The recurrence interval must be positive!")
+        elif pattern != "daily":
+            try:
+                days = {WEEKDAYS[day] for day in pattern.split(",")}
+            except KeyError as e:
+                raise ValueError("Unknown day " + str(e))
+
+        dates = []
+        d = start
+        while d <= end:
+            if d.weekday() in days:
+                dates.append(d)
+            d += datetime.timedelta(days=step)
+        return dates
+
+    # read one mm-dd-yyyy date per line, ignoring blank lines and # comments
+    def read_dates(path):
+        dates = []
+        with open(path) as f:
+            for line in f:
+                line = line.split("#", 1)[0].strip()
+                if line:
+                    dates.append(Dates.parse_date(line))
+        return dates
@@ -0,0 +1,62 @@
+import csv
+import json
+from util.Dates import Dates
+
+
+class Demand:
+    # Stream (line number, patient username, vaccine name, preferred dates, error) tuples from
+    # a clinic-day request file, dates in order of preference.
+    #   .csv:          patient,vaccine,date[,date...] per line; an optional header row is skipped
+    #   anything else: JSON lines, one {"patient": ..., "vaccine": ..., "dates": [...]} per line
+    # Dates use the mm-dd-yyyy format of the commands; names are lower-cased like every
+    # other command input. Invalid lines carry an error message instead of failing the file.
+    def read(path):
+        if path.lower().endswith(".csv"):
+            yield from Demand.read_csv(path)
+        else:
+            yield from Demand.read_json_lines(path)
+
+    def read_csv(path):
+        with open(path, newline="") as f:
+            for line_no, row in enumerate(csv.reader(f), start=1):
+                if not row or not "".join(row).strip():
+                    continue
+                if line_no == 1 and row[0].strip().lower() in ("patient", "username"):
+                    continue
+                if len(row) < 3:
+                    yield line_no, None, None, None, "expected patient,vaccine,date[,date...]"
+                    continue
+                yield (line_no,) + Demand.parse_entry(row[0], row[1], [token for token in row[2:] if token.strip()])
+
+    def read_json_lines(path):
+        with open(path) as f:
+            for line_no, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError as e:
+                    yield line_no, None, None, None, "invalid JSON: " + str(e)
+                    continue
+                if not isinstance(entry, dict) or not {"patient", "vaccine", "dates"} <= entry.keys() \
+                        or not isinstance(entry["dates"], list):
+                    yield line_no, None, None, None, "expected an object with patient, vaccine and a dates list"
+                    continue
+                yield (line_no,) + Demand.parse_entry(entry["patient"], entry["vaccine"], entry["dates"])
+
+    def parse_entry(patient, vaccine, dates):
+        patient = str(patient).strip().lower()
+        vaccine = str(vaccine).strip().lower()
+        if not patient or not vaccine:
+            return patient, vaccine, None, "missing patient or vaccine"
+        if not dates:
+            return patient, vaccine, None, "no preferred dates"
+        preferred = []
+        for token in dates:
+            try:
+                d = Dates.parse_date(str(token).strip())
+            except ValueError:
+                return patient, vaccine, None, f"invalid date {token}"
+            if d not in preferred:
+                preferred.append(d)
+        return patient, vaccine, preferred, None
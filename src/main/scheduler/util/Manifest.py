@@ -0,0 +1,65 @@
+import csv
+import json
+
+
+class Manifest:
+    # Stream (line number, vaccine name, doses, error) tuples from a shipment manifest.
+    #   .csv:          name,doses per line; an optional header row is skipped
+    #   .json:         an array of {"name": ..., "doses": ...} objects
+    #   anything else: JSON lines, one {"name": ..., "doses": ...} object per line
+    # Names are lower-cased like every other command input. Invalid lines carry an error
+    # message instead of failing the whole manifest.
+    def read(path):
+        if path.lower().endswith(".csv"):
+            yield from Manifest.read_csv(path)
+        elif path.lower().endswith(".json"):
+            yield from Manifest.read_json(path)
+        else:
+            yield from Manifest.read_json_lines(path)
+
+    def read_csv(path):
+        with open(path, newline="") as f:
+            for line_no, row in enumerate(csv.reader(f), start=1):
+                if not row or not "".join(row).strip():
+                    continue
+                if line_no == 1 and row[0].strip().lower() in ("name", "vaccine"):
+                    continue
+                if len(row) != 2:
+                    yield line_no, None, None, "expected name,doses"
+                    continue
+                yield (line_no,) + Manifest.parse_entry(row[0], row[1])
+
+    def read_json(path):
+        with open(path) as f:
+            entries = json.load(f)
+        for line_no, entry in enumerate(entries, start=1):
+            yield (line_no,) + Manifest.parse_object(entry)
+
+    def read_json_lines(path):
+        with open(path) as f:
+            for line_no, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError as e:
+                    yield line_no, None, None, "invalid JSON: " + str(e)
+                    continue
+                yield (line_no,) + Manifest.parse_object(entry)
+
+    def parse_object(entry):
+        if not isinstance(entry, dict) or "name" not in entry or "doses" not in entry:
+            return None, None, "expected an object with name and doses"
+        return Manifest.parse_entry(entry["name"], entry["doses"])
+
+    def parse_entry(name, doses):
+        name = str(name).strip().lower()
+        if not name:
+            return None, None, "missing vaccine name"
+        try:
+            doses = int(doses)
+        except (TypeError, ValueError):
+            return name, None, "doses must be a whole number"
+        if doses <= 0:
+            return name, doses, "doses must be positive"
+        return name, doses, None
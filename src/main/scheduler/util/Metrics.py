@@ -0,0 +1,235 @@
+import atexit
+import bisect
+import json
+import os
+import re
+import threading
+import time
+from db import Instrumentation
+
+
+'''
+In-process metrics: counters and latency histograms per command and per SQL statement,
+plus connection churn. Recording is a dictionary lookup and a bucket increment under one
+lock, so it is cheap next to a database round trip.
+
+Set MetricsFile to have a background thread rewrite a snapshot every MetricsInterval
+seconds (default 60): JSON when the file name ends in .json, Prometheus text otherwise.
+Set Metrics=off to stop recording SQL statements.
+'''
+
+# latency bucket upper bounds in seconds; anything slower lands in +Inf
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    # upper bound of the bucket holding the given fraction of observations
+    def quantile(self, fraction):
+        if self.count == 0:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def snapshot(self):
+        return {"count": self.count, "sum": self.sum, "buckets": list(self.counts)}
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}    # (name, label) -> int
+        self.histograms = {}  # (name, label) -> Histogram
+
+    def increment(self, name, label="", amount=1):
+        key = (name, label)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, label, seconds):
+        key = (name, label)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def counter(self, name, label=""):
+        with self._lock:
+            return self.counters.get((name, label), 0)
+
+    # copies of the histograms with the given name, by label
+    def histograms_named(self, name):
+        with self._lock:
+            return {label: snapshot_of(histogram)
+                    for (metric, label), histogram in self.histograms.items() if metric == name}
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def to_json(self):
+        with self._lock:
+            return {
+                "counters": [{"name": name, "label": label, "value": value}
+                             for (name, label), value in sorted(self.counters.items())],
+                "histograms": [dict(name=name, label=label, **histogram.snapshot())
+                               for (name, label), histogram in sorted(self.histograms.items())],
+                "bucket_bounds": list(BUCKETS),
+            }
+
+    def to_prometheus(self):
+        lines = []
+        typed = set()
+        with self._lock:
+            for (name, label), value in sorted(self.counters.items()):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {name} counter")
+                lines.append(f"{name}{label_text(name, label)} {value}")
+            for (name, label), histogram in sorted(self.histograms.items()):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {name} histogram")
+                cumulative = 0
+                for bound, count in zip(BUCKETS + (float("inf"),), histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{label_text(name, label, le)} {cumulative}")
+                lines.append(f"{name}_sum{label_text(name, label)} {histogram.sum}")
+                lines.append(f"{name}_count{label_text(name, label)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def snapshot_of(histogram):
+    copy = Histogram()
+    copy.counts = list(histogram.counts)
+    copy.count = histogram.count
+    copy.sum = histogram.sum
+    return copy
+
+
+# the label name used by each metric that has one
+LABEL_NAMES = {
+    "scheduler_command_seconds": "command",
+    "scheduler_command_failures_total": "command",
+    "scheduler_statement_seconds": "statement",
+    "scheduler_statement_errors_total": "statement",
+}
+
+
+def label_text(name, label, le=None):
+    pairs = []
+    if label:
+        escaped = label.replace("\\", "\\\\").replace('"', '\\"')
+        pairs.append(f'{LABEL_NAMES.get(name, "label")}="{escaped}"')
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+registry = Registry()
+
+
+# Reduce SQL text to a stable statement label: whitespace collapsed and multi-row VALUES
+# lists folded, so batches of different sizes share one label
+def statement_label(sql, limit=80):
+    label = " ".join(sql.split())
+    label = re.sub(r"\(%[sd](, %[sd])*\)(, \(%[sd](, %[sd])*\))+", "(...), ...", label)
+    return label if len(label) <= limit else label[:limit - 3] + "..."
+
+
+class StatementMetrics(Instrumentation.Listener):
+    def __init__(self):
+        # sql text -> label, SQL strings are module constants so this stays small
+        self._labels = {}
+
+    def label(self, sql):
+        label = self._labels.get(sql)
+        if label is None:
+            label = statement_label(sql)
+            if len(self._labels) < 1000:
+                self._labels[sql] = label
+        return label
+
+    def connection_opened(self):
+        registry.increment("scheduler_connections_opened_total")
+
+    def statement_executed(self, sql, params, seconds, rowcount):
+        registry.observe("scheduler_statement_seconds", self.label(sql), seconds)
+
+    def statement_failed(self, sql, params, seconds, error):
+        label = self.label(sql)
+        registry.observe("scheduler_statement_seconds", label, seconds)
+        registry.increment("scheduler_statement_errors_total", label)
+
+    def rows_fetched(self, count):
+        registry.increment("scheduler_rows_fetched_total", amount=count)
+
+
+statements = StatementMetrics()
+if os.getenv("Metrics", "on").lower() != "off":
+    Instrumentation.add_listener(statements)
+
+
+def record_command(operation, seconds, failed=False):
+    registry.observe("scheduler_command_seconds", operation, seconds)
+    if failed:
+        registry.increment("scheduler_command_failures_total", operation)
+
+
+def record_connection_acquired(seconds):
+    registry.increment("scheduler_connections_acquired_total")
+    registry.observe("scheduler_connection_wait_seconds", "", seconds)
+
+
+def record_connection_released(discarded):
+    if discarded:
+        registry.increment("scheduler_connections_discarded_total")
+
+
+def write_snapshot(path):
+    text = json.dumps(registry.to_json(), indent=2) if path.endswith(".json") else registry.to_prometheus()
+    # write then rename, so a scraper never reads a half-written file
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+
+# Start rewriting the snapshot file in the background; returns the thread, or None when no
+# file is configured
+def start_dump(path=None, interval=None):
+    path = path or os.getenv("MetricsFile")
+    if not path:
+        return None
+    interval = interval if interval is not None else float(os.getenv("MetricsInterval", "60"))
+
+    def dump():
+        while True:
+            time.sleep(interval)
+            try:
+                write_snapshot(path)
+            except OSError as e:
+                print("Error writing metrics:", e)
+
+    thread = threading.Thread(target=dump, name="metrics-dump", daemon=True)
+    thread.start()
+    # and once more on the way out, so short runs leave a snapshot too
+    atexit.register(write_snapshot, path)
+    return thread
@@ -0,0 +1,18 @@
+import csv
+
+
+class Roster:
+    # Stream (line number, username, password, error) tuples from a username,password CSV.
+    # An optional header row is skipped. Values are lower-cased exactly like the interactive
+    # create_patient / create_caregiver commands, so imported users log in the same way.
+    def read(path):
+        with open(path, newline="") as f:
+            for line_no, row in enumerate(csv.reader(f), start=1):
+                if not row or not "".join(row).strip():
+                    continue
+                if line_no == 1 and row[0].strip().lower() == "username":
+                    continue
+                if len(row) != 2 or not row[0].strip() or not row[1]:
+                    yield line_no, None, None, "expected username,password"
+                    continue
+                yield line_no, row[0].strip().lower(), row[1].lower(), None
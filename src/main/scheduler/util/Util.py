@@ -1,17 +1,68 @@
 import hashlib
+import hmac
 import os
+import time
+
+
+# Hashes are stored next to a "pbkdf2_<algorithm>$<iterations>$<dklen>" record of the
+# parameters that produced them. Rows written before the record existed have none and
+# were produced with these parameters.
+LEGACY_KDF = "pbkdf2_sha256$100000$16"
 
 
 class Util:
     def generate_salt():
         return os.urandom(16)
 
-    def generate_hash(password, salt):
+    # the KDF parameters new hashes are produced with; tuned with the KdfAlgorithm,
+    # KdfIterations and KdfDklen environment variables
+    def current_kdf():
+        return Util.format_kdf(os.getenv("KdfAlgorithm", "sha256"),
+                               int(os.getenv("KdfIterations", "100000")),
+                               int(os.getenv("KdfDklen", "16")))
+
+    def format_kdf(algorithm, iterations, dklen):
+        return f"pbkdf2_{algorithm}${iterations}${dklen}"
+
+    def parse_kdf(kdf):
+        scheme, iterations, dklen = (kdf or LEGACY_KDF).split("$")
+        if not scheme.startswith("pbkdf2_"):
+            raise ValueError("Unsupported password hash scheme " + scheme)
+        return scheme[len("pbkdf2_"):], int(iterations), int(dklen)
+
+    def generate_hash(password, salt, kdf=LEGACY_KDF):
+        algorithm, iterations, dklen = Util.parse_kdf(kdf)
         key = hashlib.pbkdf2_hmac(
-            'sha256',
+            algorithm,
             password.encode('utf-8'),
             salt,
-            100000,
-            dklen=16
+            iterations,
+            dklen=dklen
         )
         return key
+
+    # salt and hash in one call, so it can be shipped to a worker process
+    def generate_salt_and_hash(password, kdf=LEGACY_KDF):
+        salt = Util.generate_salt()
+        return salt, Util.generate_hash(password, salt, kdf)
+
+    def verify_password(password, salt, hash, kdf):
+        return hmac.compare_digest(Util.generate_hash(password, salt, kdf), hash)
+
+    # true when a stored hash was produced with parameters other than the current ones
+    def needs_rehash(kdf):
+        return (kdf or LEGACY_KDF) != Util.current_kdf()
+
+    # Find the iteration count whose hash takes about target_ms on this host
+    def calibrate_iterations(target_ms, algorithm="sha256", dklen=16):
+        salt = Util.generate_salt()
+        iterations = 10000
+        while True:
+            start = time.perf_counter()
+            hashlib.pbkdf2_hmac(algorithm, b"calibration", salt, iterations, dklen=dklen)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            # time a run of at least a tenth of the target so the estimate is stable
+            if elapsed_ms >= target_ms / 10:
+                break
+            iterations *= 2
+        return max(1000, int(iterations * target_ms / elapsed_ms) // 1000 * 1000)
@@ -0,0 +1,86 @@
+import os
+import sys
+
+import pytest
+
+# the tests import the scheduler's packages the way Scheduler.py does, from its directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "main", "scheduler"))
+
+from db.Backend import SqliteBackend
+from db.ConnectionManager import ConnectionManager
+from db.ConnectionPool import ConnectionPool
+from util import Cache
+
+
+class Database:
+    # a SQLite database the models are pointed at, with raw access for seeding and checks
+    def __init__(self, path):
+        self.backend = SqliteBackend(path)
+
+    def seed(self, caregivers=(), patients=(), vaccines=(), availabilities=(), appointments=(),
+             waitlist=()):
+        conn = self.backend.connect()
+        try:
+            conn.executemany("INSERT INTO Caregivers (Username) VALUES (?)", [(name,) for name in caregivers])
+            conn.executemany("INSERT INTO Patients (Username) VALUES (?)", [(name,) for name in patients])
+            conn.executemany("INSERT INTO Vaccines (Name, Doses) VALUES (?, ?)", list(vaccines))
+            conn.executemany("INSERT INTO Availabilities (Time, Username) VALUES (?, ?)", list(availabilities))
+            conn.executemany("INSERT INTO Appointments (apID, Time, cUsername, pUsername, Name) "
+                             "VALUES (?, ?, ?, ?, ?)", list(appointments))
+            conn.executemany("INSERT INTO Waitlist (pUsername, Time, Name, Priority) VALUES (?, ?, ?, ?)",
+                             list(waitlist))
+        finally:
+            conn.close()
+
+    def query(self, sql, params=()):
+        conn = self.backend.connect()
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+
+# A fresh SQLite database in tmp_path behind ConnectionManager, with nothing cached or
+# allocated from an earlier test
+@pytest.fixture
+def database(tmp_path):
+    from model.Appointment import appointment_ids
+    from model.CaregiverQueue import caregiver_queue
+
+    db = Database(str(tmp_path / "scheduler.db"))
+    ConnectionManager.configure_pool(ConnectionPool(db.backend.connect, size=8), db.backend)
+    for cache in Cache.caches.values():
+        cache.invalidate()
+    caregiver_queue.loads.clear()
+    with appointment_ids._lock:
+        appointment_ids._next = appointment_ids._limit = 0
+        appointment_ids._returned.clear()
+    yield db
+    ConnectionManager.configure_pool(None)
+    ConnectionManager._backend = None
+
+
+# Run a Scheduler command line in a session of its own, logged in as patient or caregiver
+def run_as(role, username, line):
+    import Scheduler
+    Scheduler.load_models()
+    session = Scheduler.Session()
+    if role == "patient":
+        session.patient = Scheduler.Patient(username)
+    else:
+        session.caregiver = Scheduler.Caregiver(username)
+    token = Scheduler.current_session.set(session)
+    try:
+        Scheduler.run_command(line)
+    finally:
+        Scheduler.current_session.reset(token)
+
+
+@pytest.fixture
+def as_caregiver():
+    return lambda username, line: run_as("caregiver", username, line)
+
+
+@pytest.fixture
+def as_patient():
+    return lambda username, line: run_as("patient", username, line)
@@ -0,0 +1,35 @@
+import threading
+
+THREADS = 16
+
+
+def test_concurrent_additions_to_a_new_vaccine_all_count(database, as_caregiver, capsys):
+    database.seed(caregivers=["c1"])
+    start = threading.Barrier(THREADS)
+    exits = []
+
+    def add():
+        start.wait()
+        try:
+            as_caregiver("c1", "add_doses moderna 5")
+        except SystemExit:
+            exits.append(True)
+
+    threads = [threading.Thread(target=add) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(60)
+
+    assert exits == []
+    assert capsys.readouterr().out.splitlines() == ["Doses updated!"] * THREADS
+    assert database.query("SELECT Name, Doses FROM Vaccines") == [("moderna", 5 * THREADS)]
+
+
+def test_zero_doses_are_refused(database, as_caregiver, capsys):
+    database.seed(caregivers=["c1"], vaccines=[("pfizer", 3)])
+    as_caregiver("c1", "add_doses pfizer 0")
+    as_caregiver("c1", "add_doses moderna 0")
+    assert capsys.readouterr().out.splitlines() == \
+        ["Error occurred when adding doses", "Error: Argument cannot be negative!"] * 2
+    assert database.query("SELECT Name, Doses FROM Vaccines") == [("pfizer", 3)]
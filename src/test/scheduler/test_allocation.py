@@ -0,0 +1,65 @@
+import datetime
+
+from model.Allocation import Allocation, AllocationRequest, match_dates, assign_caregivers, \
+    UNKNOWN_PATIENT, UNKNOWN_VACCINE, NO_DOSES, NO_CAREGIVER
+
+D1, D2, D3 = (datetime.datetime(2030, 12, day) for day in (1, 2, 3))
+
+
+def request(patient, dates, vaccine="pfizer"):
+    return AllocationRequest(0, patient, vaccine, dates)
+
+
+def test_earlier_request_moves_to_its_second_choice():
+    first = request("p1", [D1, D2])
+    second = request("p2", [D1])
+    match_dates([first, second], {D1: 1, D2: 1}, {"pfizer": 5})
+    assert (first.time, second.time) == (D2, D1)
+    assert first.preference_rank() == 1
+
+
+def test_chain_of_moves():
+    # p3 only fits on D1, so p1 moves to D2 and p2 on to D3
+    requests = [request("p1", [D1, D2]), request("p2", [D2, D3]), request("p3", [D1])]
+    match_dates(requests, {D1: 1, D2: 1, D3: 1}, {"pfizer": 5})
+    assert [r.time for r in requests] == [D2, D3, D1]
+
+
+def test_request_with_no_room_is_unmatched():
+    requests = [request("p1", [D1]), request("p2", [D1, D3]), request("p3", [D2])]
+    match_dates(requests, {D1: 1}, {"pfizer": 5})
+    assert [r.time for r in requests] == [D1, None, None]
+    assert [r.reason for r in requests] == [None, NO_CAREGIVER, NO_CAREGIVER]
+
+
+def test_doses_limit_the_matches():
+    requests = [request("p1", [D1]), request("p2", [D1]), request("p3", [D1], "moderna")]
+    match_dates(requests, {D1: 5}, {"pfizer": 1})
+    assert [r.reason for r in requests] == [None, NO_DOSES, UNKNOWN_VACCINE]
+
+
+def test_caregivers_are_assigned_least_loaded_first():
+    requests = [request("p1", [D1]), request("p2", [D1]), request("p3", [D2])]
+    match_dates(requests, {D1: 2, D2: 1}, {"pfizer": 5})
+    assign_caregivers(requests, {D1: ["c1", "c2"], D2: ["c1", "c2"]}, {"c1": 3})
+    # c2 starts idle and c1 has three appointments; by D2, c2 holds one more than before
+    assert [r.caregiver_username for r in requests] == ["c2", "c1", "c2"]
+
+
+def test_allocation_is_limited_by_caregivers_and_doses(database):
+    database.seed(caregivers=["c1", "c2"], patients=["p1", "p2", "p3", "p4", "p5"],
+                  vaccines=[("pfizer", 2), ("moderna", 1)],
+                  availabilities=[(D1.date(), "c1"), (D1.date(), "c2"), (D2.date(), "c1")])
+    requests = [request("p1", [D1, D2]), request("p2", [D1]), request("p3", [D1, D2]),
+                request("p4", [D3], "moderna"), request("p5", [D1], "moderna"), request("ghost", [D2])]
+
+    allocation = Allocation(requests).run()
+
+    # p5 only fits on D1 once p1 has moved to D2; p3 finds no pfizer left and nobody works D3
+    assert [(r.patient_username, r.time, r.caregiver_username, r.reason) for r in allocation.requests] == [
+        ("p1", D2, "c1", None), ("p2", D1, "c1", None), ("p3", None, None, NO_DOSES),
+        ("p4", None, None, NO_CAREGIVER), ("p5", D1, "c2", None), ("ghost", None, None, UNKNOWN_PATIENT)]
+    assert sorted(database.query("SELECT Time, cUsername, pUsername, Name FROM Appointments")) == [
+        (D1.date(), "c1", "p2", "pfizer"), (D1.date(), "c2", "p5", "moderna"), (D2.date(), "c1", "p1", "pfizer")]
+    assert database.query("SELECT COUNT(*) FROM Availabilities") == [(0,)]
+    assert database.query("SELECT Name, Doses FROM Vaccines ORDER BY Name") == [("moderna", 0), ("pfizer", 0)]
@@ -0,0 +1,52 @@
+import pytest
+
+from db.Backend import DatabaseError, SqliteBackend
+
+
+@pytest.fixture
+def backend(tmp_path):
+    return SqliteBackend(str(tmp_path / "scheduler.db"))
+
+
+@pytest.mark.parametrize("tsql, sqlite", [
+    ("SELECT Doses FROM Vaccines WITH (UPDLOCK, ROWLOCK) WHERE Name = %s",
+     "SELECT Doses FROM Vaccines WHERE Name = ?"),
+    ("SELECT TOP (%d) apID FROM Appointments WHERE pUsername = %s ORDER BY apID",
+     "SELECT apID FROM Appointments WHERE pUsername = ? ORDER BY apID LIMIT ?"),
+    ("SELECT 1 FROM Availabilities a WHERE a.Time = CAST(t.Time AS date)",
+     "SELECT 1 FROM Availabilities a WHERE a.Time = date(t.Time)"),
+    ("SELECT v.Name FROM (VALUES (%s), (%s)) AS v(Name)",
+     "SELECT v.Name FROM (SELECT column1 AS Name FROM (VALUES (?), (?))) AS v"),
+    ("DELETE FROM Appointments OUTPUT deleted.apID, deleted.Name WHERE apID = %d",
+     "DELETE FROM Appointments WHERE apID = ? RETURNING apID, Name"),
+    ("UPDATE Vaccines SET Doses = Doses + %d OUTPUT inserted.Doses WHERE Name = %s",
+     "UPDATE Vaccines SET Doses = Doses + ? WHERE Name = ? RETURNING Doses"),
+])
+def test_translates_known_idioms(backend, tsql, sqlite):
+    assert backend.rewrite(tsql)[0] == sqlite
+
+
+def test_moves_top_parameter_to_the_end(backend):
+    assert backend.translate("SELECT TOP (%d) apID FROM Appointments WHERE pUsername = %s", (5, "p"))[1] == ("p", 5)
+
+
+@pytest.mark.parametrize("tsql", [
+    # idioms in forms the rewrite does not recognise
+    "SELECT Name FROM Vaccines WITH (TABLOCKX) WHERE Name = %s",
+    "SELECT Name FROM Vaccines WHERE Name IN (SELECT TOP (1) Name FROM Appointments)",
+    "INSERT INTO Vaccines (Name, Doses) OUTPUT inserted.Name VALUES (%s, %d)",
+    "SELECT 1 FROM Availabilities WHERE Time = CAST(DATEADD(day, 1, %s) AS date)",
+    # T-SQL with no SQLite rewrite at all
+    "MERGE Vaccines AS t USING (VALUES (%s, %d)) AS s(Name, Doses) ON t.Name = s.Name "
+    "WHEN MATCHED THEN UPDATE SET t.Doses = t.Doses + s.Doses;",
+    "DECLARE @Doses int = %d; SELECT @Doses",
+    "SELECT ISNULL(MAX(apID), 0) FROM Appointments",
+])
+def test_refuses_untranslated_tsql(backend, tsql):
+    with pytest.raises(DatabaseError):
+        backend.rewrite(tsql)
+
+
+def test_allows_tsql_words_in_string_literals(backend):
+    assert backend.rewrite("SELECT Name FROM Vaccines WHERE Name = 'merge @ top'")[0] == \
+        "SELECT Name FROM Vaccines WHERE Name = 'merge @ top'"
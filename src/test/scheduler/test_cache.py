@@ -0,0 +1,88 @@
+import pytest
+
+from util import Cache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(Cache.time, "monotonic", clock)
+    # keep the test caches out of the process-wide registry
+    monkeypatch.setattr(Cache, "caches", {})
+    return clock
+
+
+def loader(value, calls):
+    def load():
+        calls.append(value)
+        return value
+    return load
+
+
+def test_hits_until_the_ttl_expires(clock):
+    cache = Cache.Cache("test", max_size=10, ttl=30)
+    calls = []
+    assert cache.get("a", loader(1, calls)) == 1
+    clock.now += 29
+    assert cache.get("a", loader(2, calls)) == 1
+    clock.now += 2
+    assert cache.get("a", loader(3, calls)) == 3
+    assert calls == [1, 3]
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
+    assert cache.peek("a") == 3
+    clock.now += 31
+    assert cache.peek("a") is None
+
+
+def test_least_recently_used_is_evicted(clock):
+    cache = Cache.Cache("test", max_size=2, ttl=30)
+    calls = []
+    cache.get("a", loader("a", calls))
+    cache.get("b", loader("b", calls))
+    cache.get("a", loader("a", calls))
+    cache.get("c", loader("c", calls))
+    assert cache.peek("b") is None
+    assert (cache.peek("a"), cache.peek("c")) == ("a", "c")
+    assert cache.stats()["evictions"] == 1
+
+
+def test_invalidation(clock):
+    cache = Cache.Cache("test", max_size=10, ttl=30)
+    for key in "abc":
+        cache.get(key, lambda: key)
+    cache.invalidate("a")
+    assert [cache.peek(key) for key in "abc"] == [None, "b", "c"]
+    cache.invalidate()
+    assert cache.stats()["size"] == 0
+
+
+def test_load_racing_an_invalidation_is_not_stored(clock):
+    cache = Cache.Cache("test", max_size=10, ttl=30)
+
+    # a write lands while the value is being read from the database
+    def load():
+        cache.invalidate("a")
+        return "stale"
+    assert cache.get("a", load) == "stale"
+    assert cache.peek("a") is None
+    assert cache.get("a", lambda: "fresh") == "fresh"
+    assert cache.peek("a") == "fresh"
+
+
+def test_keep_and_zero_ttl(clock):
+    cache = Cache.Cache("test", max_size=10, ttl=30)
+    cache.get("missing", lambda: False, keep=bool)
+    assert cache.stats()["size"] == 0
+    disabled = Cache.Cache("test_disabled", max_size=10, ttl=0)
+    calls = []
+    disabled.get("a", loader(1, calls))
+    disabled.get("a", loader(1, calls))
+    assert calls == [1, 1]
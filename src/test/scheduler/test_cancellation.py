@@ -0,0 +1,40 @@
+import datetime
+
+DAY = datetime.date(2030, 12, 1)
+LATER = datetime.date(2030, 12, 2)
+
+
+def seed_two_caregivers(database):
+    database.seed(caregivers=["c1", "c2"], patients=["p1", "p2"], vaccines=[("pfizer", 5)],
+                  appointments=[(1, DAY, "c1", "p1", "pfizer"), (2, DAY, "c2", "p2", "pfizer"),
+                                (3, LATER, "c1", "p2", "pfizer"), (4, LATER, "c2", "p1", "pfizer")])
+
+
+def remaining(database):
+    return database.query("SELECT apID FROM Appointments ORDER BY apID")
+
+
+def test_cancel_day_only_cancels_own_appointments(database, as_caregiver, capsys):
+    seed_two_caregivers(database)
+    as_caregiver("c1", "cancel_day 12-01-2030")
+    assert capsys.readouterr().out.splitlines()[0] == \
+        "Cancelled 1 appointment(s) on 1 date(s); doses restored: pfizer: 1; 1 slot(s) reinstated."
+    assert remaining(database) == [(2,), (3,), (4,)]
+    assert database.query("SELECT Time, Username FROM Availabilities") == [(DAY, "c1")]
+
+
+def test_cancel_day_takes_no_other_caregiver(database, as_caregiver, capsys):
+    seed_two_caregivers(database)
+    as_caregiver("c1", "cancel_day 12-01-2030 c2")
+    assert capsys.readouterr().out.splitlines() == ["Please try again!"]
+    assert remaining(database) == [(1,), (2,), (3,), (4,)]
+
+
+def test_cancel_range_only_cancels_own_appointments(database, as_caregiver, capsys):
+    seed_two_caregivers(database)
+    as_caregiver("c2", "cancel_range 12-01-2030 12-02-2030 withdraw")
+    assert capsys.readouterr().out.splitlines()[0] == \
+        "Cancelled 2 appointment(s) on 2 date(s); doses restored: pfizer: 2; slots withdrawn."
+    assert remaining(database) == [(1,), (3,)]
+    assert database.query("SELECT Doses FROM Vaccines") == [(7,)]
+    assert database.query("SELECT COUNT(*) FROM Availabilities") == [(0,)]
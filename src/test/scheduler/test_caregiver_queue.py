@@ -0,0 +1,58 @@
+import datetime
+
+from model.CaregiverQueue import caregiver_queue
+
+D1, D2, LATER = (datetime.datetime(2030, 12, day) for day in (1, 2, 20))
+
+
+# appointments on LATER giving each caregiver the load asked for
+def holding(loads):
+    usernames = [username for username, load in loads.items() for _ in range(load)]
+    return [(apID, LATER.date(), username, "p1", "pfizer") for apID, username in enumerate(usernames, 1)]
+
+
+def seed(database, slots, loads=None):
+    caregivers = sorted({username for usernames in slots.values() for username in usernames})
+    database.seed(caregivers=caregivers, patients=["p1"], vaccines=[("pfizer", 10)],
+                  availabilities=[(d.date(), username) for d, usernames in slots.items() for username in usernames],
+                  appointments=holding(loads or {}))
+
+
+def test_least_loaded_caregiver_first(database):
+    seed(database, {D1: ["c1", "c2", "c3"]}, {"c1": 2, "c3": 1})
+    assert [caregiver_queue.propose(D1) for _ in range(4)] == ["c2", "c3", "c1", None]
+
+
+def test_stale_entry_is_corrected_when_popped(database):
+    seed(database, {D1: ["c1", "c2"], D2: ["c1", "c2"]})
+    assert caregiver_queue.propose(D1) == "c1"
+    caregiver_queue.restore(D1, "c1")
+    # c1 is booked on D2, so D1's heap entry (0, c1) is out of date
+    assert caregiver_queue.propose(D2) == "c1"
+    caregiver_queue.booked(D2, "c1")
+    assert caregiver_queue.propose(D1) == "c2"
+    assert caregiver_queue.propose(D1) == "c1"
+    assert caregiver_queue.propose(D1) is None
+
+
+def test_released_appointments_lower_the_load(database):
+    seed(database, {D1: ["c1", "c2"]}, {"c1": 2, "c2": 1})
+    assert caregiver_queue.propose(D1) == "c2"
+    caregiver_queue.restore(D1, "c2")
+
+    # c1's appointments are cancelled
+    database.query("DELETE FROM Appointments WHERE cUsername = 'c1'")
+    caregiver_queue.released({"c1": 2, "c9": 1})
+    assert caregiver_queue.loads == {"c1": 0, "c2": 1}
+    assert caregiver_queue.propose(D1) == "c1"
+
+
+def test_booking_on_a_date_not_queued_loads_nothing(database, monkeypatch):
+    seed(database, {D1: ["c1"]})
+
+    def load_queue(d):
+        raise AssertionError("queue loaded")
+    monkeypatch.setattr(caregiver_queue, "load_queue", load_queue)
+    caregiver_queue.booked(D1, "c1")
+    caregiver_queue.restore(D1, "c1")
+    assert caregiver_queue.loads == {"c1": 1}
@@ -0,0 +1,176 @@
+import threading
+import time
+
+import pytest
+
+from db.ConnectionPool import ConnectionPool
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=None):
+        if self.conn.broken:
+            raise ConnectionError("connection reset")
+
+    def fetchall(self):
+        return [(1,)]
+
+
+class FakeConnection:
+    # a stand-in DB-API connection that records what the pool does with it
+    def __init__(self, number):
+        self.number = number
+        self.broken = False
+        self.fail_rollback = False
+        self.rollbacks = 0
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        if self.fail_rollback:
+            raise ConnectionError("connection reset")
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+class FakeDriver:
+    def __init__(self):
+        self.opened = []
+
+    def connect(self):
+        conn = FakeConnection(len(self.opened))
+        self.opened.append(conn)
+        return conn
+
+
+def make_pool(**kwargs):
+    driver = FakeDriver()
+    return driver, ConnectionPool(driver.connect, **kwargs)
+
+
+def test_reuses_released_connection():
+    driver, pool = make_pool(size=2)
+    first = pool.acquire()
+    pool.release(first)
+    assert pool.acquire() is first
+    assert len(driver.opened) == 1
+
+
+def test_times_out_when_exhausted():
+    driver, pool = make_pool(size=1, timeout=0.05)
+    pool.acquire()
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        pool.acquire()
+    assert time.monotonic() - start >= 0.05
+    assert len(driver.opened) == 1
+
+
+def test_waiter_gets_released_connection():
+    driver, pool = make_pool(size=1, timeout=5)
+    held = pool.acquire()
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+    waiter.start()
+    time.sleep(0.05)
+    assert not acquired
+    pool.release(held)
+    waiter.join(5)
+    assert acquired == [held]
+
+
+def test_failed_connect_frees_its_slot():
+    _, pool = make_pool(size=1, timeout=0.05)
+
+    def refuse():
+        raise ConnectionError("refused")
+
+    connect, pool.connect = pool.connect, refuse
+    with pytest.raises(ConnectionError):
+        pool.acquire()
+    pool.connect = connect
+    pool.acquire()
+
+
+def test_unhealthy_connection_is_discarded_on_checkout():
+    driver, pool = make_pool(size=1, check_interval=0)
+    first = pool.acquire()
+    pool.release(first)
+    first.broken = True
+    time.sleep(0.01)
+    second = pool.acquire()
+    assert second is not first
+    assert first.closed
+    assert len(driver.opened) == 2
+
+
+def test_healthy_connection_is_kept_on_checkout():
+    _, pool = make_pool(size=1, check_interval=0)
+    first = pool.acquire()
+    pool.release(first)
+    time.sleep(0.01)
+    assert pool.acquire() is first
+    assert not first.closed
+
+
+def test_idle_connections_are_evicted():
+    driver, pool = make_pool(size=2, idle_timeout=0.05)
+    first = pool.acquire()
+    pool.release(first)
+    time.sleep(0.1)
+    second = pool.acquire()
+    assert second is not first
+    assert first.closed
+    assert len(driver.opened) == 2
+
+
+def test_release_rolls_back():
+    _, pool = make_pool(size=1)
+    conn = pool.acquire()
+    pool.release(conn)
+    assert conn.rollbacks == 1
+    assert not conn.closed
+
+
+def test_release_discards_connection_that_cannot_roll_back():
+    driver, pool = make_pool(size=1)
+    first = pool.acquire()
+    first.fail_rollback = True
+    pool.release(first)
+    assert first.closed
+    assert pool.acquire() is not first
+    assert len(driver.opened) == 2
+
+
+def test_release_with_discard_closes():
+    _, pool = make_pool(size=1)
+    conn = pool.acquire()
+    pool.release(conn, discard=True)
+    assert conn.closed
+    assert conn.rollbacks == 0
+
+
+def test_fill_opens_ahead_of_demand():
+    driver, pool = make_pool(size=3)
+    assert pool.fill(5) == 3
+    assert pool.fill(5) == 0
+    assert len(driver.opened) == 3
+
+
+def test_close_closes_idle_and_rejects_acquire():
+    _, pool = make_pool(size=2)
+    idle = pool.acquire()
+    held = pool.acquire()
+    pool.release(idle)
+    pool.close()
+    assert idle.closed
+    pool.release(held)
+    assert held.closed
+    with pytest.raises(RuntimeError):
+        pool.acquire()
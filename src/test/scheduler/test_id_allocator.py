@@ -0,0 +1,49 @@
+import pytest
+
+from db.ConnectionManager import ConnectionManager
+from db.IdAllocator import IdAllocator
+
+
+def allocator(block_size=3):
+    return IdAllocator("Appointments", "apID", block_size=block_size)
+
+
+def test_ids_continue_across_blocks(database):
+    ids = allocator()
+    assert [ids.next_id() for _ in range(7)] == [1, 2, 3, 4, 5, 6, 7]
+    # three blocks leased, the last one partly used
+    assert database.query("SELECT Name, NextValue FROM IdBlocks") == [("Appointments", 10)]
+
+
+def test_first_block_starts_after_existing_ids(database):
+    database.seed(caregivers=["c1"], patients=["p1"], vaccines=[("pfizer", 1)],
+                  appointments=[(41, "2030-12-01", "c1", "p1", "pfizer")])
+    assert allocator().next_id() == 42
+
+
+def test_processes_get_disjoint_blocks(database):
+    first, second = allocator(), allocator()
+    assert [first.next_id(), second.next_id(), first.next_id(), second.next_id()] == [1, 4, 2, 5]
+
+
+def test_released_ids_are_handed_out_again(database):
+    ids = allocator()
+    taken = [ids.next_id() for _ in range(3)]
+    ids.release(taken[1])
+    assert [ids.next_id(), ids.next_id()] == [2, 4]
+
+
+def test_lease_range_rolls_back_with_the_transaction(database):
+    ids = allocator()
+    with ConnectionManager() as conn:
+        assert ids.lease_range(5, conn.cursor()) == 1
+        conn.rollback()
+    with ConnectionManager() as conn:
+        assert ids.lease_range(5, conn.cursor()) == 1
+        conn.commit()
+    assert ids.next_id() == 6
+
+
+def test_block_size_must_be_positive():
+    with pytest.raises(ValueError):
+        allocator(0)
@@ -0,0 +1,90 @@
+import datetime
+import threading
+
+from model.Appointment import Appointment, ReservationError, NO_CAREGIVER, NO_DOSES
+
+DAY = datetime.datetime(2030, 12, 1)
+THREADS = 24
+
+
+# Reserve for every patient at once, from one thread each; returns (booked, failures)
+def reserve_all(patients, vaccine="pfizer"):
+    start = threading.Barrier(len(patients))
+    booked = []
+    failures = []
+    lock = threading.Lock()
+
+    def reserve(patient):
+        start.wait()
+        try:
+            appointment = Appointment(DAY, patient, vaccine).reserve()
+            with lock:
+                booked.append(appointment)
+        except ReservationError as e:
+            with lock:
+                failures.append(e.status)
+
+    threads = [threading.Thread(target=reserve, args=(patient,)) for patient in patients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(60)
+    return booked, failures
+
+
+def check_consistent(database, doses_before):
+    # no caregiver holds two appointments on one date, no booked slot is still open,
+    # every appointment took exactly one dose and no count went negative
+    assert database.query("SELECT Time, cUsername FROM Appointments GROUP BY Time, cUsername "
+                          "HAVING COUNT(*) > 1") == []
+    assert database.query("SELECT 1 FROM Appointments ap JOIN Availabilities a "
+                          "ON a.Time = ap.Time AND a.Username = ap.cUsername") == []
+    doses = dict(database.query("SELECT Name, Doses FROM Vaccines"))
+    used = dict(database.query("SELECT Name, COUNT(*) FROM Appointments GROUP BY Name"))
+    for name, before in doses_before.items():
+        assert doses[name] >= 0
+        assert doses[name] + used.get(name, 0) == before
+
+
+def test_last_slot_is_booked_once(database):
+    patients = [f"p{i}" for i in range(THREADS)]
+    database.seed(caregivers=["c1"], patients=patients, vaccines=[("pfizer", 100)],
+                  availabilities=[(DAY.date(), "c1")])
+
+    booked, failures = reserve_all(patients)
+
+    assert len(booked) == 1
+    assert failures == [NO_CAREGIVER] * (THREADS - 1)
+    assert database.query("SELECT cUsername FROM Appointments") == [("c1",)]
+    check_consistent(database, {"pfizer": 100})
+
+
+def test_last_dose_is_booked_once(database):
+    caregivers = [f"c{i}" for i in range(THREADS)]
+    patients = [f"p{i}" for i in range(THREADS)]
+    database.seed(caregivers=caregivers, patients=patients, vaccines=[("pfizer", 1)],
+                  availabilities=[(DAY.date(), c) for c in caregivers])
+
+    booked, failures = reserve_all(patients)
+
+    assert len(booked) == 1
+    assert failures == [NO_DOSES] * (THREADS - 1)
+    assert database.query("SELECT Doses FROM Vaccines") == [(0,)]
+    check_consistent(database, {"pfizer": 1})
+
+
+def test_no_double_booking_under_contention(database):
+    # fewer slots and doses than patients, so both run out while reservations race
+    caregivers = [f"c{i}" for i in range(THREADS // 2)]
+    patients = [f"p{i}" for i in range(THREADS)]
+    database.seed(caregivers=caregivers, patients=patients, vaccines=[("pfizer", THREADS // 3)],
+                  availabilities=[(DAY.date(), c) for c in caregivers])
+
+    booked, failures = reserve_all(patients)
+
+    assert len(booked) == THREADS // 3
+    assert len(failures) == THREADS - THREADS // 3
+    assert len({appointment.apID for appointment in booked}) == len(booked)
+    assert len({appointment.caregiver_username for appointment in booked}) == len(booked)
+    assert database.query("SELECT COUNT(*) FROM Availabilities") == [(THREADS // 2 - THREADS // 3,)]
+    check_consistent(database, {"pfizer": THREADS // 3})
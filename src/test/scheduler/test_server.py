@@ -0,0 +1,119 @@
+import asyncio
+import io
+import json
+
+import pytest
+
+import Scheduler
+import Server
+
+
+@pytest.fixture(autouse=True)
+def fast_hashing(monkeypatch):
+    monkeypatch.setenv("KdfIterations", "1000")
+    monkeypatch.setenv("Prewarm", "off")
+
+
+class Client:
+    # a local client sending command lines and reading back their JSON results
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    async def send(self, line):
+        self.writer.write((line + "\n").encode("utf-8"))
+        await self.writer.drain()
+        return json.loads(await self.reader.readline())
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+# Start a server on a free local port, run scenario(connect) and shut the server down
+def serve(scenario):
+    async def run():
+        server = await Server.SchedulerServer(port=0, workers=4, queue_size=4).start()
+        clients = []
+
+        async def connect():
+            client = Client(*await asyncio.open_connection(server.host, server.port))
+            clients.append(client)
+            return client
+
+        try:
+            await scenario(connect)
+        finally:
+            for client in clients:
+                await client.close()
+            await server.close()
+
+    asyncio.run(run())
+
+
+def test_clients_have_their_own_sessions(database):
+    database.seed(vaccines=[("pfizer", 5)])
+
+    async def scenario(connect):
+        caregiver, patient = await connect(), await connect()
+        assert (await caregiver.send("create_caregiver c1 pw"))["output"] == ["Created user  c1"]
+        assert (await patient.send("create_patient p1 pw"))["output"] == ["Created user  p1"]
+        await caregiver.send("login_caregiver c1 pw")
+        await patient.send("login_patient p1 pw")
+
+        assert (await caregiver.send("upload_availability 12-01-2030"))["output"] == ["Availability uploaded!"]
+        assert (await patient.send("upload_availability 12-02-2030"))["output"] == \
+            ["Please login as a caregiver first!"]
+        reserved = await patient.send("reserve 12-01-2030 pfizer")
+        assert reserved["output"] == ["Appointment ID: 1, Caregiver username: c1"]
+
+    serve(scenario)
+    assert database.query("SELECT pUsername, cUsername FROM Appointments") == [("p1", "c1")]
+
+
+def test_concurrent_clients(database):
+    caregivers = [f"c{i}" for i in range(8)]
+    database.seed(vaccines=[("pfizer", 100)])
+
+    async def scenario(connect):
+        clients = [await connect() for _ in caregivers]
+        results = await asyncio.gather(*[client.send(f"create_caregiver {name} pw")
+                                         for client, name in zip(clients, caregivers)])
+        assert [result["output"] for result in results] == [[f"Created user  {name}"] for name in caregivers]
+        await asyncio.gather(*[client.send(f"login_caregiver {name} pw") for client, name in zip(clients, caregivers)])
+        results = await asyncio.gather(*[client.send("upload_availability 12-01-2030") for client in clients])
+        assert all(result["output"] == ["Availability uploaded!"] for result in results)
+
+    serve(scenario)
+    assert sorted(database.query("SELECT Username FROM Availabilities")) == [(name,) for name in caregivers]
+
+
+def test_file_and_operator_commands_are_refused(database, tmp_path):
+    roster = tmp_path / "users.csv"
+    roster.write_text("intruder,pw\n")
+    database.seed(caregivers=["c1"])
+
+    async def scenario(connect):
+        client = await connect()
+        await client.send("create_caregiver c2 pw")
+        await client.send("login_caregiver c2 pw")
+        for line in [f"import_users patient {roster}", f"upload_availability_file {roster}",
+                     f"import_inventory {roster}", f"allocate {roster}", "calibrate_kdf 10", "stats",
+                     "cache_stats"]:
+            result = await client.send(line)
+            assert result["error"] == "not allowed"
+            assert result["output"] == ["This command is not available over the network!"]
+        # the connection is still usable afterwards
+        assert (await client.send("logout"))["output"] == ["Successfully logged out!"]
+
+    serve(scenario)
+    assert database.query("SELECT Username FROM Patients") == []
+
+
+def test_import_users_needs_a_caregiver_login(database, tmp_path):
+    roster = tmp_path / "users.csv"
+    roster.write_text("p1,pw\n")
+    out = io.StringIO()
+    Scheduler.run_script(io.StringIO(f"import_users patient {roster}\n"), out)
+    assert json.loads(out.getvalue())["output"] == ["Please login as a caregiver first!"]
+    assert database.query("SELECT Username FROM Patients") == []
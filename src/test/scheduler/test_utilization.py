@@ -0,0 +1,65 @@
+import datetime
+
+import pytest
+
+from model import Utilization
+from model.Utilization import UtilizationReport, factorize
+
+START = datetime.datetime(2030, 12, 1)
+END = datetime.datetime(2030, 12, 4)
+TODAY = datetime.datetime(2030, 11, 1)
+
+
+@pytest.fixture(params=["numpy", "lists"])
+def columns(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(Utilization, "numpy", None)
+    return request.param
+
+
+def test_factorize_keeps_given_names_first(columns):
+    values = ["moderna", "pfizer", "janssen", "moderna"]
+    if columns == "numpy":
+        values = Utilization.numpy.array(values, dtype=object)
+    codes, names = factorize(values, ["pfizer", "zeta"])
+    assert names == ["pfizer", "zeta", "moderna", "janssen"]
+    assert list(codes) == [2, 0, 3, 2]
+
+
+def test_report(database, columns):
+    database.seed(caregivers=["c1", "c2"], patients=["p1"], vaccines=[("pfizer", 6), ("moderna", 3)],
+                  appointments=[(1, START.date(), "c1", "p1", "pfizer"), (2, START.date(), "c2", "p1", "pfizer"),
+                                (3, END.date(), "c2", "p1", "pfizer")],
+                  availabilities=[(START.date(), "c1"), (END.date(), "c1")])
+
+    summary = UtilizationReport(START, END, today=TODAY).run().to_json()
+
+    assert [(day["booked"], day["free"]) for day in summary["days"]] == [(2, 1), (0, 0), (0, 0), (1, 1)]
+    assert [(c["username"], c["booked"], c["free"]) for c in summary["caregivers"]] == \
+        [("c1", 1, 2), ("c2", 2, 0)]
+    # 3 doses over the 4 days is 0.75 a day, so the 6 left last 8 days from the window's start
+    # rather than from today, which is a month earlier
+    assert summary["vaccines"] == [
+        {"name": "moderna", "doses": 3, "burn_per_day": 0.0, "runs_out": None},
+        {"name": "pfizer", "doses": 6, "burn_per_day": 0.75, "runs_out": "2030-12-09"},
+    ]
+
+
+def test_run_out_counts_from_today_once_the_window_has_begun(database):
+    database.seed(caregivers=["c1"], patients=["p1"], vaccines=[("pfizer", 4)],
+                  appointments=[(1, START.date(), "c1", "p1", "pfizer")])
+    report = UtilizationReport(START, END, today=START + datetime.timedelta(days=2)).run()
+    assert report.to_json()["vaccines"][0]["runs_out"] == "2030-12-19"
+
+
+def test_run_out_past_the_horizon_is_not_projected(database, as_caregiver, capsys):
+    # a tiny burn rate would put the date past datetime.max
+    database.seed(caregivers=["c1"], patients=["p1"], vaccines=[("pfizer", 200000)],
+                  appointments=[(1, START.date(), "c1", "p1", "pfizer")])
+    report = UtilizationReport(START, END + datetime.timedelta(days=16), today=TODAY).run()
+    assert report.to_json()["vaccines"][0]["runs_out"] is None
+
+    as_caregiver("c1", "report 11-25-2030 12-15-2030")
+    assert capsys.readouterr().out.splitlines()[-1] == "Vaccine pfizer: 200000 dose(s), 0.05 per day, lasts over ten years"
@@ -0,0 +1,66 @@
+import datetime
+
+from model.Waitlist import Waitlist
+
+DAY = datetime.date(2030, 12, 1)
+
+
+def test_cancelling_patient_sees_only_a_count(database, as_patient, capsys):
+    database.seed(caregivers=["c1"], patients=["p1", "p2"], vaccines=[("pfizer", 0)],
+                  appointments=[(1, DAY, "c1", "p1", "pfizer")], waitlist=[("p2", DAY, "pfizer", 0)])
+
+    as_patient("p1", "cancel 1")
+
+    out = capsys.readouterr().out
+    assert "Waitlist: booked 1 waiting patient(s)." in out.splitlines()
+    assert "p2" not in out
+    assert database.query("SELECT pUsername, cUsername FROM Appointments") == [("p2", "c1")]
+    assert database.query("SELECT COUNT(*) FROM Waitlist") == [(0,)]
+
+
+def test_patient_with_the_appointment_is_not_waitlisted(database, as_patient, capsys):
+    database.seed(caregivers=["c1"], patients=["p1"], vaccines=[("pfizer", 5)],
+                  availabilities=[(DAY, "c1")])
+
+    as_patient("p1", "reserve 12-01-2030 pfizer")
+    as_patient("p1", "reserve 12-01-2030 pfizer")
+    assert database.query("SELECT COUNT(*) FROM Waitlist") == [(0,)]
+    assert "waitlist" not in capsys.readouterr().out
+
+    # cancelling frees the slot without booking the patient straight back into it
+    as_patient("p1", "cancel 1")
+    assert database.query("SELECT COUNT(*) FROM Appointments") == [(0,)]
+    assert database.query("SELECT Time, Username FROM Availabilities") == [(DAY, "c1")]
+
+
+def waiting(database):
+    return database.query("SELECT pUsername FROM Waitlist ORDER BY WaitID")
+
+
+def test_fulfil_serves_priority_then_arrival(database):
+    database.seed(caregivers=["c1", "c2"], patients=["p1", "p2", "p3", "p4"], vaccines=[("pfizer", 5)],
+                  availabilities=[(DAY, "c1"), (DAY, "c2")],
+                  waitlist=[("p1", DAY, "pfizer", 0), ("p2", DAY, "pfizer", 0), ("p3", DAY, "pfizer", 1),
+                            ("p4", DAY, "pfizer", 0)])
+
+    booked = Waitlist.fulfil(datetime.datetime(2030, 12, 1))
+
+    # two slots: the priority entry first, then the earliest arrival; the rest keep waiting
+    assert [appointment.patient_username for appointment in booked] == ["p3", "p1"]
+    assert waiting(database) == [("p2",), ("p4",)]
+
+
+def test_fulfil_for_a_vaccine_skips_full_dates_and_stops_when_doses_run_out(database):
+    later = datetime.date(2030, 12, 2)
+    past = datetime.date(2020, 1, 1)
+    database.seed(caregivers=["c1", "c2"], patients=["p1", "p2", "p3", "p4"], vaccines=[("pfizer", 1)],
+                  availabilities=[(later, "c1"), (later, "c2")],
+                  waitlist=[("p1", past, "pfizer", 9), ("p2", DAY, "pfizer", 2), ("p3", later, "pfizer", 1),
+                            ("p4", later, "pfizer", 0)])
+
+    booked = Waitlist.fulfil(vaccine_name="pfizer")
+
+    # p1's date has passed and nobody works on DAY, so p3 gets the one dose
+    assert [appointment.patient_username for appointment in booked] == ["p3"]
+    assert waiting(database) == [("p1",), ("p2",), ("p4",)]
+    assert database.query("SELECT Doses FROM Vaccines") == [(0,)]